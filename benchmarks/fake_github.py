@@ -0,0 +1,378 @@
+"""
+A local stand-in for the parts of the GitHub REST and GraphQL APIs cibot uses.
+
+The server keeps one repository in memory, seeded over ``POST /_bench/reset`` and
+counts every API call per endpoint, read back over ``GET /_bench/stats``.
+"""
+
+import json
+import re
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs, urlparse
+
+REPO = r"/repos/(?P<owner>[^/]+)/(?P<name>[^/]+)"
+
+type Handler = Callable[["FakeGithub", dict[str, str], dict[str, Any]], tuple[int, Any]]
+
+
+@dataclass
+class Page:
+	"""A page of a REST listing, sent with a ``Link`` header like GitHub does."""
+
+	items: list[Any]
+	url: str
+	page: int
+	per_page: int
+	total: int
+
+	def link(self) -> str:
+		last = max((self.total + self.per_page - 1) // self.per_page, 1)
+		links = {"first": 1, "last": last}
+		if self.page < last:
+			links["next"] = self.page + 1
+		if self.page > 1:
+			links["prev"] = self.page - 1
+		return ", ".join(
+			f'<{self.url}?per_page={self.per_page}&page={page}>; rel="{rel}"'
+			for rel, page in links.items()
+		)
+
+
+class FakeGithub:
+	def __init__(self, base_url: str) -> None:
+		self.base_url = base_url
+		self.lock = threading.Lock()
+		self.reset({})
+
+	def reset(self, seed: dict[str, Any]) -> None:
+		self.slug: str = seed.get("slug", "bench/repo")
+		self.latency: float = seed.get("latency_ms", 0) / 1000
+		self.issues: dict[int, dict[str, Any]] = {
+			int(n): i for n, i in seed.get("issues", {}).items()
+		}
+		self.prs: dict[int, dict[str, Any]] = {int(n): pr for n, pr in seed.get("prs", {}).items()}
+		self.comments: dict[int, dict[str, Any]] = {c["id"]: c for c in seed.get("comments", [])}
+		self.review_comments: dict[int, dict[str, Any]] = {
+			c["id"]: c for c in seed.get("review_comments", [])
+		}
+		self.commit_pulls: list[int] = seed.get("commit_pulls", [])
+		self.next_id = max([1000, *self.comments, *self.review_comments]) + 1
+		self.calls: Counter[str] = Counter()
+
+	def new_id(self) -> int:
+		self.next_id += 1
+		return self.next_id
+
+	@property
+	def repo_url(self) -> str:
+		return f"{self.base_url}/repos/{self.slug}"
+
+	def issue_json(self, number: int) -> dict[str, Any]:
+		issue = self.issues.get(number) or self.prs[number]
+		return {
+			"id": number,
+			"number": number,
+			"title": issue["title"],
+			"body": issue["body"],
+			"state": "open",
+			"url": f"{self.repo_url}/issues/{number}",
+		}
+
+	def comment_json(self, comment: dict[str, Any]) -> dict[str, Any]:
+		return {
+			"id": comment["id"],
+			"body": comment["body"],
+			"url": f"{self.repo_url}/issues/comments/{comment['id']}",
+		}
+
+	def review_comment_json(self, comment: dict[str, Any]) -> dict[str, Any]:
+		return {
+			"id": comment["id"],
+			"body": comment["body"],
+			"path": comment["path"],
+			"line": comment["line"],
+			"start_line": comment.get("start_line"),
+		}
+
+
+def get_repo(api: FakeGithub, params: dict[str, str], body: dict[str, Any]) -> tuple[int, Any]:
+	owner, name = api.slug.split("/")
+	return 200, {
+		"id": 1,
+		"name": name,
+		"full_name": api.slug,
+		"owner": {"login": owner},
+		"url": api.repo_url,
+	}
+
+
+def get_issue(api: FakeGithub, params: dict[str, str], body: dict[str, Any]) -> tuple[int, Any]:
+	return 200, api.issue_json(int(params["number"]))
+
+
+def edit_issue(api: FakeGithub, params: dict[str, str], body: dict[str, Any]) -> tuple[int, Any]:
+	number = int(params["number"])
+	issue = api.issues.get(number) or api.prs[number]
+	issue.update({k: v for k, v in body.items() if k in ("title", "body")})
+	return 200, api.issue_json(number)
+
+
+def list_issue_comments(
+	api: FakeGithub, params: dict[str, str], body: dict[str, Any]
+) -> tuple[int, Any]:
+	number = int(params["number"])
+	comments = [c for c in api.comments.values() if c["issue"] == number]
+	per_page = int(params.get("per_page", 30))
+	page = int(params.get("page", 1))
+	return 200, Page(
+		items=[api.comment_json(c) for c in comments[(page - 1) * per_page : page * per_page]],
+		url=f"{api.repo_url}/issues/{number}/comments",
+		page=page,
+		per_page=per_page,
+		total=len(comments),
+	)
+
+
+def create_issue_comment(
+	api: FakeGithub, params: dict[str, str], body: dict[str, Any]
+) -> tuple[int, Any]:
+	comment = {"id": api.new_id(), "issue": int(params["number"]), "body": body["body"]}
+	api.comments[comment["id"]] = comment
+	return 201, api.comment_json(comment)
+
+
+def get_issue_comment(
+	api: FakeGithub, params: dict[str, str], body: dict[str, Any]
+) -> tuple[int, Any]:
+	if (comment := api.comments.get(int(params["id"]))) is None:
+		return 404, {"message": "Not Found"}
+	return 200, api.comment_json(comment)
+
+
+def edit_issue_comment(
+	api: FakeGithub, params: dict[str, str], body: dict[str, Any]
+) -> tuple[int, Any]:
+	if (comment := api.comments.get(int(params["id"]))) is None:
+		return 404, {"message": "Not Found"}
+	comment["body"] = body["body"]
+	return 200, api.comment_json(comment)
+
+
+def delete_issue_comment(
+	api: FakeGithub, params: dict[str, str], body: dict[str, Any]
+) -> tuple[int, Any]:
+	if api.comments.pop(int(params["id"]), None) is None:
+		return 404, {"message": "Not Found"}
+	return 204, None
+
+
+def get_pull(api: FakeGithub, params: dict[str, str], body: dict[str, Any]) -> tuple[int, Any]:
+	number = int(params["number"])
+	pr = api.prs[number]
+	return 200, {
+		**api.issue_json(number),
+		"url": f"{api.repo_url}/pulls/{number}",
+		"issue_url": f"{api.repo_url}/issues/{number}",
+		"head": {"sha": pr["head_sha"]},
+		"labels": [{"name": label} for label in pr["labels"]],
+	}
+
+
+def create_review_comment(
+	api: FakeGithub, params: dict[str, str], body: dict[str, Any]
+) -> tuple[int, Any]:
+	comment = {
+		"id": api.new_id(),
+		"pr": int(params["number"]),
+		"path": body["path"],
+		"line": body["line"],
+		"start_line": body.get("start_line"),
+		"body": body["body"],
+	}
+	api.review_comments[comment["id"]] = comment
+	return 201, api.review_comment_json(comment)
+
+
+def create_review(api: FakeGithub, params: dict[str, str], body: dict[str, Any]) -> tuple[int, Any]:
+	for payload in body.get("comments", []):
+		create_review_comment(api, params, payload)
+	return 200, {"id": api.new_id(), "body": body.get("body", "")}
+
+
+def delete_review_comment(
+	api: FakeGithub, params: dict[str, str], body: dict[str, Any]
+) -> tuple[int, Any]:
+	if api.review_comments.pop(int(params["id"]), None) is None:
+		return 404, {"message": "Not Found"}
+	return 204, None
+
+
+def commit_pulls(api: FakeGithub, params: dict[str, str], body: dict[str, Any]) -> tuple[int, Any]:
+	return 200, [{"number": number} for number in api.commit_pulls]
+
+
+def create_release(
+	api: FakeGithub, params: dict[str, str], body: dict[str, Any]
+) -> tuple[int, Any]:
+	return 201, {
+		"id": api.new_id(),
+		"tag_name": body["tag_name"],
+		"html_url": f"https://github.invalid/{api.slug}/releases/{body['tag_name']}",
+	}
+
+
+def graphql(api: FakeGithub, params: dict[str, str], body: dict[str, Any]) -> tuple[int, Any]:
+	"""Answer ``PR_CONTEXT_QUERY``, one review thread per review comment."""
+	variables = body["variables"]
+	number = variables["number"]
+	pr = api.prs[number]
+	comments = [c for c in api.comments.values() if c["issue"] == number]
+	threads = [c for c in api.review_comments.values() if c["pr"] == number]
+	offset = int(variables.get("threadsCursor") or 0)
+	page = threads[offset : offset + 100]
+	pull_request = {
+		"number": number,
+		"title": pr["title"],
+		"body": pr["body"],
+		"headRefOid": pr["head_sha"],
+		"author": {"login": pr["author"], "name": pr["author"].title()},
+		"labels": {"nodes": [{"name": label} for label in pr["labels"]]},
+		"comments": {
+			"pageInfo": {"hasPreviousPage": len(comments) > 100},
+			"nodes": [{"databaseId": c["id"], "body": c["body"]} for c in comments[-100:]],
+		},
+		"reviewThreads": {
+			"pageInfo": {
+				"hasNextPage": offset + 100 < len(threads),
+				"endCursor": str(offset + 100),
+			},
+			"nodes": [
+				{
+					"comments": {
+						"pageInfo": {"hasNextPage": False},
+						"nodes": [
+							{
+								"databaseId": c["id"],
+								"body": c["body"],
+								"path": c["path"],
+								"line": c["line"],
+								"startLine": c.get("start_line"),
+								"originalLine": c["line"],
+								"originalStartLine": c.get("start_line"),
+							}
+						],
+					}
+				}
+				for c in page
+			],
+		},
+	}
+	return 200, {"data": {"repository": {"pullRequest": pull_request}}}
+
+
+ROUTES: list[tuple[str, re.Pattern[str], Handler]] = [
+	(verb, re.compile(f"{pattern}$"), handler)
+	for verb, pattern, handler in [
+		("GET", REPO, get_repo),
+		("GET", rf"{REPO}/issues/(?P<number>\d+)", get_issue),
+		("PATCH", rf"{REPO}/issues/(?P<number>\d+)", edit_issue),
+		("GET", rf"{REPO}/issues/(?P<number>\d+)/comments", list_issue_comments),
+		("POST", rf"{REPO}/issues/(?P<number>\d+)/comments", create_issue_comment),
+		("GET", rf"{REPO}/issues/comments/(?P<id>\d+)", get_issue_comment),
+		("PATCH", rf"{REPO}/issues/comments/(?P<id>\d+)", edit_issue_comment),
+		("DELETE", rf"{REPO}/issues/comments/(?P<id>\d+)", delete_issue_comment),
+		("GET", rf"{REPO}/pulls/(?P<number>\d+)", get_pull),
+		("POST", rf"{REPO}/pulls/(?P<number>\d+)/comments", create_review_comment),
+		("POST", rf"{REPO}/pulls/(?P<number>\d+)/reviews", create_review),
+		("DELETE", rf"{REPO}/pulls/comments/(?P<id>\d+)", delete_review_comment),
+		("GET", rf"{REPO}/commits/(?P<sha>\w+)/pulls", commit_pulls),
+		("POST", rf"{REPO}/releases", create_release),
+		("POST", r"/graphql", graphql),
+	]
+]
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+	server: "FakeGithubServer"
+	protocol_version = "HTTP/1.1"
+
+	def log_message(self, format: str, *args: Any) -> None:  # noqa: A002, ANN401
+		pass
+
+	def _send(self, status: int, payload: Any, headers: dict[str, str] | None = None) -> None:  # noqa: ANN401
+		data = b"" if payload is None else json.dumps(payload).encode()
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.send_header("X-RateLimit-Limit", "5000")
+		self.send_header("X-RateLimit-Remaining", "4999")
+		self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+		for key, value in (headers or {}).items():
+			self.send_header(key, value)
+		self.end_headers()
+		self.wfile.write(data)
+
+	def _handle(self) -> None:
+		url = urlparse(self.path)
+		length = int(self.headers.get("Content-Length") or 0)
+		body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+		api = self.server.api
+		if url.path == "/_bench/reset":
+			with api.lock:
+				api.reset(body)
+			return self._send(200, {})
+		if url.path == "/_bench/stats":
+			with api.lock:
+				return self._send(200, dict(api.calls))
+		for verb, pattern, handler in ROUTES:
+			if verb == self.command and (match := pattern.match(url.path)):
+				params = {
+					**{k: v[-1] for k, v in parse_qs(url.query).items()},
+					**match.groupdict(),
+				}
+				if api.latency:
+					time.sleep(api.latency)
+				with api.lock:
+					api.calls[handler.__name__] += 1
+					status, payload = handler(api, params, body)
+				if isinstance(payload, Page):
+					return self._send(status, payload.items, {"Link": payload.link()})
+				return self._send(status, payload)
+		return self._send(404, {"message": f"no fake for {self.command} {url.path}"})
+
+	do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _handle
+
+
+class FakeGithubServer(ThreadingHTTPServer):
+	daemon_threads = True
+
+	def __init__(self, port: int = 0) -> None:
+		super().__init__(("127.0.0.1", port), RequestHandler)
+		self.api = FakeGithub(self.base_url)
+
+	@property
+	def base_url(self) -> str:
+		host, port = self.server_address[:2]
+		return f"http://{host}:{port}"
+
+
+def serve(port: int, ready: Any = None) -> None:  # noqa: ANN401
+	"""Serve forever, reporting the bound port through ``ready`` (a multiprocessing queue)."""
+	server = FakeGithubServer(port)
+	if ready is not None:
+		ready.put(server.server_address[1])
+	server.serve_forever()
+
+
+if __name__ == "__main__":
+	import sys
+
+	server = FakeGithubServer(int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
+	print(f"fake GitHub API on {server.base_url}")  # noqa: T201
+	server.serve_forever()
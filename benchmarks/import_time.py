@@ -0,0 +1,103 @@
+"""
+Measure the cold import time of the cibot CLI.
+
+cibot starts from scratch on every CI event, so every module ``cibot.cli`` pulls in
+at import is paid on each run. Every sample imports the CLI in a fresh interpreter
+with ``-X importtime`` and the median cumulative time is checked against a budget::
+
+    python benchmarks/import_time.py --repeat 9 --budget-ms 300
+
+The run also fails when importing the CLI, or loading a plugin, drags in modules
+that only another plugin needs.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+TARGET = "cibot.cli"
+
+# plugin requested -> top-level modules that must stay unimported
+UNEXPECTED_MODULES = {
+	None: ["cibot.plugins.deferred_release", "cibot.plugins.diffcov", "cibot.plugins.semver"],
+	"semver": ["cibot.plugins.diffcov", "diff_cover", "jinja2"],
+	"deferred_release": ["cibot.plugins.diffcov", "diff_cover", "jinja2"],
+	"diffcov": ["diff_cover", "jinja2"],
+}
+
+LOADED_MODULES = """
+import json, sys
+import cibot.cli
+if {plugin!r}:
+	cibot.cli.load_plugin({plugin!r})
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def parse_importtime(stderr: str) -> dict[str, tuple[int, int]]:
+	"""Parse ``-X importtime`` output into module -> (self, cumulative) microseconds."""
+	out = {}
+	for line in stderr.splitlines():
+		if not line.startswith("import time:") or "self [us]" in line:
+			continue
+		self_us, cumulative_us, module = line.removeprefix("import time:").split("|")
+		out[module.strip()] = (int(self_us), int(cumulative_us))
+	return out
+
+
+def sample() -> dict[str, tuple[int, int]]:
+	stderr = subprocess.run(
+		[sys.executable, "-X", "importtime", "-c", f"import {TARGET}"],
+		check=True,
+		capture_output=True,
+		text=True,
+	).stderr
+	return parse_importtime(stderr)
+
+
+def loaded_modules(plugin: str | None) -> set[str]:
+	stdout = subprocess.run(
+		[sys.executable, "-c", LOADED_MODULES.format(plugin=plugin)],
+		check=True,
+		capture_output=True,
+		text=True,
+	).stdout
+	return set(json.loads(stdout))
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+	parser.add_argument("--repeat", type=int, default=7)
+	parser.add_argument(
+		"--budget-ms", type=float, default=300, help="Median import time to stay under"
+	)
+	parser.add_argument("--top", type=int, default=15, help="Slowest modules to list")
+	args = parser.parse_args()
+
+	samples = [sample() for _ in range(args.repeat)]
+	totals = [s[TARGET][1] / 1000 for s in samples]
+	median = statistics.median(totals)
+	median_sample = samples[totals.index(sorted(totals)[len(totals) // 2])]
+
+	print(f"import {TARGET}: median {median:.1f}ms, min {min(totals):.1f}ms")  # noqa: T201
+	print(f"{'module':<50} {'self ms':>8} {'cumul ms':>9}")  # noqa: T201
+	slowest = sorted(median_sample.items(), key=lambda item: item[1][0], reverse=True)
+	for module, (self_us, cumulative_us) in slowest[: args.top]:
+		print(f"{module:<50} {self_us / 1000:>8.1f} {cumulative_us / 1000:>9.1f}")  # noqa: T201
+
+	failures = 0
+	if median > args.budget_ms:
+		print(f"over budget: {median:.1f}ms > {args.budget_ms}ms")  # noqa: T201
+		failures += 1
+	for plugin, unexpected in UNEXPECTED_MODULES.items():
+		modules = loaded_modules(plugin)
+		if leaked := [m for m in unexpected if m in modules]:
+			print(f"loading {plugin or 'no plugin'} imported {', '.join(leaked)}")  # noqa: T201
+			failures += 1
+	return 1 if failures else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
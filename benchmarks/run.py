@@ -0,0 +1,336 @@
+"""
+Run cibot end to end against a local fake GitHub API, no network involved.
+
+Every scenario builds a throwaway git workspace with a coverage report, seeds the
+fake API with a PR of the configured shape and runs the CLI command in-process.
+Wall time (median of ``--repeat`` runs), API calls per endpoint and peak traced
+memory are reported per scenario. Memory is measured in one extra run, tracemalloc
+slows down the async backend's event loop too much to time the same runs::
+
+    python benchmarks/run.py --repeat 5 --json results.json
+    python benchmarks/run.py --compare results.json
+
+``--compare`` exits non zero when a scenario got slower than ``--tolerance`` or
+makes more API calls than the baseline.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+import httpx
+import msgspec
+from loguru import logger
+
+from cibot import cli
+from cibot.backends.base import PRContributor
+from cibot.plugins.deferred_release import ChangeNote, ChangeType, ReleaseNoteBucket
+from cibot.plugins.diffcov import DIFF_COV_REVIEW_COMMENT_ID
+from cibot.storage_layers.github_issue import COMMENT_BASE, Bucket
+
+sys.path.insert(0, str(Path(__file__).parent))
+import fake_github
+
+PR_NUMBER = 42
+STORAGE_ISSUE = 1
+
+
+@dataclass(frozen=True)
+class PrShape:
+	comments: int = 5
+	"""Existing human comments on the PR"""
+	review_comments: int = 0
+	"""Existing (stale) diff coverage review comments"""
+	labels: int = 3
+	violations: int = 10
+	"""Uncovered changed lines, each one becomes a review comment"""
+	bucket_keys: int = 10
+	"""Unrelated keys already in the storage bucket"""
+
+
+@dataclass(frozen=True)
+class Scenario:
+	name: str
+	command: str
+	plugins: tuple[str, ...]
+	shape: PrShape = field(default_factory=PrShape)
+	release: bool = False
+	"""Label the PR as a minor release PR"""
+
+
+SCENARIOS = [
+	Scenario("pr-small", "on_pr_changed", ("deferred_release", "diffcov"), PrShape()),
+	Scenario(
+		"pr-large",
+		"on_pr_changed",
+		("deferred_release", "diffcov"),
+		PrShape(comments=250, review_comments=300, labels=20, violations=400, bucket_keys=500),
+	),
+	Scenario(
+		"release-pr",
+		"on_pr_changed",
+		("deferred_release", "semver"),
+		PrShape(bucket_keys=200),
+		release=True,
+	),
+	Scenario(
+		"commit-to-main", "on_commit_to_main", ("deferred_release",), PrShape(bucket_keys=200)
+	),
+]
+
+
+@dataclass
+class Result:
+	wall_ms: list[float] = field(default_factory=list)
+	peak_kib: int = 0
+	api_calls: dict[str, int] = field(default_factory=dict)
+	failed: str | None = None
+
+	def summary(self) -> dict[str, Any]:
+		return {
+			"median_ms": round(statistics.median(self.wall_ms), 1),
+			"min_ms": round(min(self.wall_ms), 1),
+			"peak_kib": self.peak_kib,
+			"api_calls": sum(self.api_calls.values()),
+			"api_calls_by_endpoint": self.api_calls,
+			"failed": self.failed,
+		}
+
+
+def git(cwd: Path, *args: str) -> str:
+	return subprocess.run(
+		["git", *args], cwd=cwd, check=True, capture_output=True, text=True
+	).stdout.strip()
+
+
+def build_workspace(root: Path, shape: PrShape) -> tuple[Path, str]:
+	"""Create a feature branch adding ``violations`` uncovered lines, pushed to a local remote."""
+	remote, work = root / "remote.git", root / "work"
+	git(root, "init", "-q", "--bare", "-b", "main", str(remote))
+	git(root, "init", "-q", "-b", "main", str(work))
+	git(work, "config", "user.name", "bench")
+	git(work, "config", "user.email", "bench@no.reply")
+	git(work, "remote", "add", "origin", str(remote))
+	(work / "pyproject.toml").write_text('[project]\nname = "bench"\nversion = "0.1.0"\n')
+	(work / "pkg").mkdir()
+	(work / "pkg" / "mod.py").write_text("def base():\n\treturn 0\n")
+	git(work, "add", ".")
+	git(work, "commit", "-q", "-m", "base")
+	git(work, "push", "-q", "origin", "main")
+
+	git(work, "checkout", "-q", "-b", "feature")
+	# alternate covered and uncovered lines so every violation is its own comment
+	added = [f"\tx{i} = {i}" for i in range(shape.violations * 2)]
+	(work / "pkg" / "mod.py").write_text(
+		"def base():\n\treturn 0\n\n\ndef feature():\n" + "\n".join(added) + "\n"
+	)
+	git(work, "commit", "-q", "-am", "feature")
+	git(work, "push", "-q", "-u", "origin", "feature")
+	first = 6
+	lines = "".join(
+		f'<line number="{first + i}" hits="{i % 2}"/>' for i in range(shape.violations * 2)
+	)
+	(work / "coverage.xml").write_text(
+		'<?xml version="1.0" ?><coverage version="7"><sources><source>.</source></sources>'
+		'<packages><package name="pkg"><classes><class name="mod.py" filename="pkg/mod.py">'
+		f"<lines>{lines}</lines></class></classes></package></packages></coverage>"
+	)
+	return work, git(work, "rev-parse", "HEAD")
+
+
+def seed(scenario: Scenario, head_sha: str, latency_ms: float) -> dict[str, Any]:
+	shape = scenario.shape
+	contributor = PRContributor(pr_number=7, pr_author_username="octocat", pr_author_fullname=None)
+	pending = ReleaseNoteBucket(
+		notes={
+			7: ChangeNote(
+				change_type=ChangeType.FEATURE,
+				header="Earlier feature",
+				description="Adds something",
+				pr_number=7,
+				contributor=contributor,
+			)
+		}
+	)
+	bucket = Bucket(
+		plugin_srorage={
+			**{f"bench-key-{i}": json.dumps({"value": "x" * 64}) for i in range(shape.bucket_keys)},
+			"Deferred Release-pending-changes": msgspec.json.encode(pending).decode(),
+		}
+	)
+	labels = ["minor release" if scenario.release else "Feature"]
+	labels += [f"area-{i}" for i in range(shape.labels - 1)]
+	return {
+		"slug": "bench/repo",
+		"latency_ms": latency_ms,
+		"issues": {
+			STORAGE_ISSUE: {
+				"title": "cibot storage",
+				"body": COMMENT_BASE.format(json.dumps(msgspec.to_builtins(bucket), indent=2)),
+			}
+		},
+		"prs": {
+			PR_NUMBER: {
+				"title": "Add the feature",
+				"body": "Adds the feature.\n___\nReviewer notes.",
+				"labels": labels,
+				"author": "octocat",
+				"head_sha": head_sha,
+			}
+		},
+		"comments": [
+			{"id": 100 + i, "issue": PR_NUMBER, "body": f"comment {i}"}
+			for i in range(shape.comments)
+		],
+		"review_comments": [
+			{
+				"id": 10_000 + i,
+				"pr": PR_NUMBER,
+				"path": "pkg/mod.py",
+				"line": 1000 + i,
+				"start_line": None,
+				"body": f"\n[//]: {DIFF_COV_REVIEW_COMMENT_ID}\nstale\n",
+			}
+			for i in range(shape.review_comments)
+		],
+		"commit_pulls": [PR_NUMBER],
+	}
+
+
+def run_once(
+	scenario: Scenario,
+	client: httpx.Client,
+	latency_ms: float,
+	result: Result,
+	*,
+	trace_memory: bool = False,
+) -> None:
+	"""Time one run of ``scenario``, or only record its peak memory with ``trace_memory``."""
+	with tempfile.TemporaryDirectory(prefix="cibot-bench-") as tmp:
+		work, head_sha = build_workspace(Path(tmp), scenario.shape)
+		client.post("/_bench/reset", json=seed(scenario, head_sha, latency_ms)).raise_for_status()
+		for cached in (
+			cli.get_storage,
+			cli.get_github_repo,
+			cli.get_github_client,
+			cli.get_scheduler,
+		):
+			cached.cache_clear()
+		cwd = Path.cwd()
+		os.chdir(work)
+		if trace_memory:
+			tracemalloc.start()
+		start = time.perf_counter()
+		try:
+			if scenario.command == "on_pr_changed":
+				cli.on_pr_changed(PR_NUMBER, plugin=list(scenario.plugins), trace=None)
+			else:
+				cli.on_commit_to_main(plugin=list(scenario.plugins), trace=None)
+		except Exception as e:  # noqa: BLE001
+			result.failed = f"{type(e).__name__}: {e}"
+		finally:
+			if trace_memory:
+				result.peak_kib = tracemalloc.get_traced_memory()[1] // 1024
+				tracemalloc.stop()
+			else:
+				result.wall_ms.append((time.perf_counter() - start) * 1000)
+			os.chdir(cwd)
+		result.api_calls = client.get("/_bench/stats").raise_for_status().json()
+
+
+def configure_env(api_url: str, backend: str) -> None:
+	os.environ.update(
+		{
+			"CIBOT_BACKEND": backend,
+			"CIBOT_STORAGE": "github_issue",
+			"CIBOT_STORAGE_GH_ISSUE_NUMBER": str(STORAGE_ISSUE),
+			"CIBOT_GITHUB_TOKEN": "bench",
+			"CIBOT_GITHUB_REPO_SLUG": "bench/repo",
+			"CIBOT_GITHUB_API_URL": api_url,
+			# measure cibot, not the pacing the real API asks for
+			"CIBOT_GITHUB_SCHEDULER_MUTATION_INTERVAL": "0",
+			"DIFF_COV_COMPARE_BRANCH": "main",
+			"DIFF_COV_FAIL_UNDER": "0",
+			"DIFF_COV_CACHE": "none",
+			"DEFERRED_RELEASE_PROJECT_NAME": "bench",
+		}
+	)
+
+
+def compare(results: dict[str, dict[str, Any]], baseline_path: Path, tolerance: float) -> int:
+	baseline = json.loads(baseline_path.read_text())
+	regressions = 0
+	for name, current in results.items():
+		if (before := baseline.get(name)) is None:
+			continue
+		if current["median_ms"] > before["median_ms"] * (1 + tolerance):
+			print(f"{name}: median {before['median_ms']}ms -> {current['median_ms']}ms")  # noqa: T201
+			regressions += 1
+		if current["api_calls"] > before["api_calls"]:
+			print(f"{name}: API calls {before['api_calls']} -> {current['api_calls']}")  # noqa: T201
+			regressions += 1
+	return regressions
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+	parser.add_argument("--repeat", type=int, default=3)
+	parser.add_argument("--scenario", action="append", choices=[s.name for s in SCENARIOS])
+	parser.add_argument("--backend", default="github", choices=["github", "github_async"])
+	parser.add_argument("--latency-ms", type=float, default=0, help="Delay of every fake API call")
+	parser.add_argument("--json", type=Path, help="Write the results to this file")
+	parser.add_argument("--compare", type=Path, help="Baseline results to check against")
+	parser.add_argument("--tolerance", type=float, default=0.2)
+	parser.add_argument("--verbose", action="store_true", help="Keep cibot's logs")
+	args = parser.parse_args()
+
+	if not args.verbose:
+		logger.remove()
+	ready = multiprocessing.get_context("spawn").Queue()
+	server = multiprocessing.get_context("spawn").Process(
+		target=fake_github.serve, args=(0, ready), daemon=True
+	)
+	server.start()
+	api_url = f"http://127.0.0.1:{ready.get(timeout=30)}"
+	configure_env(api_url, args.backend)
+
+	results: dict[str, dict[str, Any]] = {}
+	try:
+		with httpx.Client(base_url=api_url) as client:
+			for scenario in SCENARIOS:
+				if args.scenario and scenario.name not in args.scenario:
+					continue
+				result = Result()
+				for _ in range(args.repeat):
+					run_once(scenario, client, args.latency_ms, result)
+				run_once(scenario, client, args.latency_ms, result, trace_memory=True)
+				results[scenario.name] = {"shape": asdict(scenario.shape), **result.summary()}
+	finally:
+		server.terminate()
+
+	print(f"{'scenario':<16} {'median ms':>10} {'min ms':>10} {'API calls':>10} {'peak KiB':>10}")  # noqa: T201
+	for name, summary in results.items():
+		print(  # noqa: T201
+			f"{name:<16} {summary['median_ms']:>10} {summary['min_ms']:>10} "
+			f"{summary['api_calls']:>10} {summary['peak_kib']:>10}"
+			+ (f"  FAILED {summary['failed']}" if summary["failed"] else "")
+		)
+	if args.json:
+		args.json.write_text(json.dumps(results, indent=2))
+	if args.compare:
+		return 1 if compare(results, args.compare, args.tolerance) else 0
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -1,10 +1,10 @@
-import subprocess
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 
 from msgspec import Struct
 
 from cibot.storage_layers.base import BaseStorage
+from cibot.tracing import run_process
 
 
 class PRContributor(Struct):
@@ -37,35 +37,115 @@ class PrReviewComment(Struct):
 	end_line: int
 	content: str
 	content_id: str
+	outdated: bool = False
+	"""Read back from a position that is no longer part of the diff"""
+
+	def body(self) -> str:
+		return f"""
+[//]: {self.content_id}
+{self.content}
+"""
+
+
+class PrCommentSnapshot(Struct):
+	id: int
+	body: str
+
+
+class PrReviewCommentSnapshot(Struct):
+	id: int
+	file: str
+	start_line: int | None
+	end_line: int | None
+	"""None only for comments on a whole file"""
+	body: str
+	outdated: bool = False
+	"""The commented lines left the diff, the lines are where the comment was created"""
+
+
+class PrContext(Struct):
+	"""Everything plugins read about a PR, loaded once per run."""
+
+	pr_number: int
+	title: str
+	body: str
+	labels: list[str]
+	author_login: str
+	author_name: str | None
+	head_sha: str
+	bot_comments: list[PrCommentSnapshot]
+	review_comments: list[PrReviewCommentSnapshot]
+	comments_truncated: bool = False
+	"""True when older issue comments were not loaded into ``bot_comments``"""
+
+	def description(self) -> PrDescription:
+		return PrDescription(
+			contributor=PRContributor(
+				pr_number=self.pr_number,
+				pr_author_username=self.author_login,
+				pr_author_fullname=self.author_name,
+			),
+			header=self.title,
+			description=self.body,
+			pr_number=self.pr_number,
+		)
 
 
 class CiBotBackendBase(ABC):
+	pr_number: int | None
+
 	def __init__(self, storage: BaseStorage) -> None:
 		super().__init__()
 
+	def reset(self, pr_number: int | None) -> None:
+		"""Drop what was loaded for earlier events before reusing the backend for ``pr_number``."""
+		self.pr_number = pr_number
+
 	@abstractmethod
 	def name(self) -> str: ...
 
+	def close(self) -> None:  # noqa: B027 optional, most backends hold no connections
+		"""Release the backend's connections, backends without any have nothing to do."""
+
 	@abstractmethod
 	def upsert_pr_comment(self, content: str, comment_id: str) -> None: ...
 
+	@abstractmethod
+	def get_pr_comment(self, comment_id: str) -> str | None:
+		"""Body of the bot comment carrying ``comment_id``, None if there is none yet."""
+
+	@abstractmethod
+	def forget_pr(self, pr_number: int) -> None:
+		"""Drop what the backend keeps in storage about a merged or closed PR."""
+
 	@abstractmethod
 	def create_pr_review_comment(self, comment: PrReviewComment) -> None: ...
 
+	def create_pr_review_comments(self, comments: list[PrReviewComment]) -> None:
+		for comment in comments:
+			self.create_pr_review_comment(comment)
+
 	@abstractmethod
 	def get_review_comments_for_content_id(self, id: str) -> list[tuple[int, PrReviewComment]]: ...
 
 	@abstractmethod
 	def delete_pr_review_comment(self, comment_id: int) -> None: ...
 
+	def delete_pr_review_comments(self, comment_ids: list[int]) -> None:
+		for comment_id in comment_ids:
+			self.delete_pr_review_comment(comment_id)
+
 	@abstractmethod
 	def publish_release(self, release_info: ReleaseInfo) -> None: ...
 
 	def run_cmd(self, *args: str) -> None:
-		return subprocess.run([*args], check=False).check_returncode()
+		return run_process([*args], check=False).check_returncode()
 
 	def git(self, *args: str) -> None:
-		return subprocess.run(["git", *args], check=False).check_returncode()
+		return run_process(["git", *args], check=False).check_returncode()
+
+	@abstractmethod
+	def get_pr_context(self, pr_number: int) -> PrContext: ...
 
 	@abstractmethod
 	def get_pr_description(self, pr_number: int) -> PrDescription: ...
@@ -81,7 +161,7 @@ class CiBotBackendBase(ABC):
 
 	def get_current_commit_hash(self) -> str:
 		return (
-			subprocess.run(["git", "rev-parse", "HEAD"], check=True, capture_output=True)
+			run_process(["git", "rev-parse", "HEAD"], check=True, capture_output=True)
 			.stdout.decode()
 			.strip()
 		)
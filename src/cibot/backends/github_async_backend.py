@@ -0,0 +1,263 @@
+import asyncio
+import contextvars
+import threading
+from collections.abc import Coroutine
+from typing import Any, override
+
+import httpx
+from loguru import logger
+
+from cibot.backends.base import (
+	PrContext,
+	PrDescription,
+	PrReviewComment,
+	ReleaseInfo,
+)
+from cibot.backends.github_backend import (
+	PR_CONTEXT_QUERY,
+	REVIEW_BODY,
+	GithubBotComments,
+	GithubSettings,
+	graphql_url,
+	pr_context_from_graphql,
+	review_batches,
+	review_comment_payload,
+	review_comments_for_content_id,
+	thread_comment_nodes,
+)
+from cibot.ratelimit import RequestScheduler, ScheduledTransport
+from cibot.storage_layers.base import BaseStorage
+
+
+class AsyncGithubBackend(GithubBotComments):
+	"""
+	GitHub backend on a pooled ``httpx.AsyncClient``.
+
+	The client lives on an event loop running in a background thread, so the
+	synchronous backend interface can be called from any thread while batch
+	operations (e.g. deleting many review comments) run concurrently over the
+	same keep-alive connections. Every request goes through a ``RequestScheduler``.
+	Bot comments are upserted from the calling thread like in ``GithubBackend``, only
+	their requests hop onto the loop, so storage calls never block it.
+
+	Each call hops onto the loop thread, so without network latency this backend is
+	slower than ``GithubBackend``. It only pays off when requests wait on the network
+	and a PR has many review comments to delete, which then dominate the run.
+	"""
+
+	def __init__(
+		self,
+		storage: BaseStorage,
+		pr_number: int | None,
+		settings: GithubSettings,
+		scheduler: RequestScheduler | None = None,
+	) -> None:
+		if not settings.TOKEN:
+			msg = "missing GITHUB_TOKEN"
+			raise ValueError(msg)
+		if not settings.REPO_SLUG:
+			msg = "missing GITHUB_REPO_SLUG"
+			raise ValueError(msg)
+		self.changes_storage = storage
+		self.pr_number = pr_number
+		self.settings = settings
+		self.repo_slug = settings.REPO_SLUG
+		self._pr_contexts: dict[int, PrContext] = {}
+		self._scanned_prs: set[int] = set()
+		self._context_lock = asyncio.Lock()
+		self._lock = threading.RLock()
+		self.scheduler = scheduler or RequestScheduler()
+		transport = httpx.AsyncHTTPTransport(
+			http2=settings.HTTP2,
+			limits=httpx.Limits(
+				max_connections=settings.MAX_CONNECTIONS,
+				max_keepalive_connections=settings.MAX_CONNECTIONS,
+			),
+		)
+		self._client = httpx.AsyncClient(
+			base_url=f"{settings.API_URL.rstrip('/')}/repos/{settings.REPO_SLUG}",
+			headers={
+				"Authorization": f"Bearer {settings.TOKEN}",
+				"Accept": "application/vnd.github+json",
+				"X-GitHub-Api-Version": "2022-11-28",
+			},
+			transport=ScheduledTransport(transport, self.scheduler),
+			timeout=httpx.Timeout(15.0),
+		)
+		self._graphql_url = graphql_url(settings.API_URL)
+		self._loop = asyncio.new_event_loop()
+		self._thread = threading.Thread(
+			target=self._loop.run_forever, name="cibot-github-async", daemon=True
+		)
+		self._thread.start()
+
+	def _run[T](self, coro: Coroutine[Any, Any, T]) -> T:
+		context = contextvars.copy_context()
+		return asyncio.run_coroutine_threadsafe(
+			self._in_context(coro, context), self._loop
+		).result()
+
+	@staticmethod
+	async def _in_context[T](coro: Coroutine[Any, Any, T], context: contextvars.Context) -> T:
+		"""Run ``coro`` in the caller's context so trace spans keep their plugin."""
+		return await asyncio.get_running_loop().create_task(coro, context=context)
+
+	@override
+	def close(self) -> None:
+		self._run(self._client.aclose())
+		self._loop.call_soon_threadsafe(self._loop.stop)
+		self._thread.join()
+
+	async def _request(self, verb: str, path: str, **payload: Any) -> Any:  # noqa: ANN401
+		response = await self._client.request(verb, path, json=payload or None)
+		response.raise_for_status()
+		if response.status_code == httpx.codes.NO_CONTENT:
+			return None
+		return response.json()
+
+	@override
+	def _rest(self, verb: str, path: str, *, missing_ok: bool = False, **payload: Any) -> Any:
+		try:
+			return self._run(self._request(verb, path, **payload))
+		except httpx.HTTPStatusError as e:
+			if not missing_ok or e.response.status_code != httpx.codes.NOT_FOUND:
+				raise
+			return None
+
+	async def _graphql(self, query: str, variables: dict[str, Any]) -> dict[str, Any]:
+		response = await self._client.post(
+			self._graphql_url, json={"query": query, "variables": variables}
+		)
+		response.raise_for_status()
+		data = response.json()
+		if errors := data.get("errors"):
+			msg = f"GraphQL query failed: {errors}"
+			raise RuntimeError(msg)
+		return data["data"]
+
+	@override
+	def name(self) -> str:
+		return "github"
+
+	@override
+	def configure_git(self) -> None:
+		self.git("config", "user.name", "cibot")
+		self.git("config", "user.email", "cibot@no.reply")
+
+	@override
+	def reset(self, pr_number: int | None) -> None:
+		super().reset(pr_number)
+		self._pr_contexts.clear()
+		self._scanned_prs.clear()
+
+	@override
+	def get_pr_context(self, pr_number: int) -> PrContext:
+		return self._run(self._get_pr_context(pr_number))
+
+	async def _get_pr_context(self, pr_number: int) -> PrContext:
+		async with self._context_lock:
+			if (context := self._pr_contexts.get(pr_number)) is None:
+				context = self._pr_contexts[pr_number] = await self._fetch_pr_context(pr_number)
+			return context
+
+	async def _fetch_pr_context(self, pr_number: int) -> PrContext:
+		owner, name = self.repo_slug.split("/")
+		variables: dict[str, Any] = {"owner": owner, "name": name, "number": pr_number}
+		pr = (await self._graphql(PR_CONTEXT_QUERY, variables))["repository"]["pullRequest"]
+		threads = pr["reviewThreads"]
+		review_comment_nodes = thread_comment_nodes(threads)
+		while threads["pageInfo"]["hasNextPage"]:
+			variables["threadsCursor"] = threads["pageInfo"]["endCursor"]
+			data = await self._graphql(PR_CONTEXT_QUERY, variables)
+			threads = data["repository"]["pullRequest"]["reviewThreads"]
+			review_comment_nodes.extend(thread_comment_nodes(threads))
+		context = pr_context_from_graphql(pr, review_comment_nodes)
+		logger.info(f"Loaded context of PR #{pr_number}")
+		return context
+
+	@override
+	def create_pr_review_comment(self, comment: PrReviewComment) -> None:
+		self._run(self._create_pr_review_comment(comment))
+
+	async def _create_pr_review_comment(self, comment: PrReviewComment) -> None:
+		context = await self._get_pr_context(comment.pr_number)
+		await self._request(
+			"POST",
+			f"/pulls/{comment.pr_number}/comments",
+			commit_id=context.head_sha,
+			**review_comment_payload(comment),
+		)
+
+	@override
+	def create_pr_review_comments(self, comments: list[PrReviewComment]) -> None:
+		self._run(self._create_pr_review_comments(comments))
+
+	async def _create_pr_review_comments(self, comments: list[PrReviewComment]) -> None:
+		"""Submit ``REVIEW_BATCH_SIZE`` sized pull request reviews concurrently."""
+
+		async def submit(pr_number: int, batch: list[dict[str, Any]]) -> None:
+			context = await self._get_pr_context(pr_number)
+			logger.info(f"Submitting review with {len(batch)} comments on PR #{pr_number}")
+			await self._request(
+				"POST",
+				f"/pulls/{pr_number}/reviews",
+				commit_id=context.head_sha,
+				event="COMMENT",
+				body=REVIEW_BODY,
+				comments=batch,
+			)
+
+		batches = review_batches(comments, self.settings.REVIEW_BATCH_SIZE)
+		await asyncio.gather(*(submit(pr_number, batch) for pr_number, batch in batches))
+		for pr_number, _ in batches:
+			# the review response has no comment ids, reload on next access
+			self._pr_contexts.pop(pr_number, None)
+
+	@override
+	def get_review_comments_for_content_id(self, id: str) -> list[tuple[int, PrReviewComment]]:
+		assert self.pr_number is not None, "pr_number is not set"
+		return review_comments_for_content_id(self.get_pr_context(self.pr_number), id)
+
+	@override
+	def delete_pr_review_comment(self, comment_id: int) -> None:
+		self.delete_pr_review_comments([comment_id])
+
+	@override
+	def delete_pr_review_comments(self, comment_ids: list[int]) -> None:
+		self._run(self._delete_pr_review_comments(comment_ids))
+
+	async def _delete_pr_review_comments(self, comment_ids: list[int]) -> None:
+		await asyncio.gather(
+			*(self._request("DELETE", f"/pulls/comments/{id_}") for id_ in comment_ids)
+		)
+		if self.pr_number in self._pr_contexts:
+			context = self._pr_contexts[self.pr_number]
+			deleted = set(comment_ids)
+			context.review_comments = [c for c in context.review_comments if c.id not in deleted]
+
+	@override
+	def publish_release(self, release_info: ReleaseInfo) -> None:
+		release = self._run(
+			self._request(
+				"POST",
+				"/releases",
+				name=release_info.header,
+				tag_name=release_info.version,
+				body=release_info.note,
+				generate_release_notes=False,
+			)
+		)
+		logger.info(f"Published release {release_info.version} at {release['html_url']}")
+
+	@override
+	def get_pr_description(self, pr_number: int) -> PrDescription:
+		return self.get_pr_context(pr_number).description()
+
+	@override
+	def get_commit_associated_pr(self, commit_hash: str) -> PrDescription:
+		pulls = self._rest("GET", f"/commits/{commit_hash}/pulls")
+		return self.get_pr_description(pulls[0]["number"])
+
+	@override
+	def get_pr_labels(self, pr_number: int) -> list[str]:
+		return self.get_pr_context(pr_number).labels
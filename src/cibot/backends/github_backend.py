@@ -1,19 +1,24 @@
-from functools import cached_property
-from typing import ClassVar, override
+import threading
+from abc import abstractmethod
+from collections.abc import Iterator
+from typing import Any, ClassVar, override
 
-import github
-import github.PullRequest
+import msgspec
+from github import UnknownObjectException
 from github.Repository import Repository
 from loguru import logger
 from pydantic_settings import BaseSettings
 
 from cibot.backends.base import (
 	CiBotBackendBase,
-	PRContributor,
+	PrCommentSnapshot,
+	PrContext,
 	PrDescription,
 	PrReviewComment,
+	PrReviewCommentSnapshot,
 	ReleaseInfo,
 )
+from cibot.ratelimit import RequestScheduler, is_idempotent, is_mutation
 from cibot.storage_layers.base import BaseStorage
 
 
@@ -23,22 +28,307 @@ class GithubSettings(BaseSettings):
 	}
 	TOKEN: str | None = None
 	REPO_SLUG: str | None = None
+	API_URL: str = "https://api.github.com"
+	HTTP2: bool = False
+	MAX_CONNECTIONS: int = 20
+	REVIEW_BATCH_SIZE: int = 50
+	"""Max review comments submitted in a single pull request review"""
 
 
-class GithubBackend(CiBotBackendBase):
+def graphql_url(api_url: str) -> str:
+	"""Mirror PyGithub: ``https://host/api/v3`` -> ``https://host/api/graphql``."""
+	return f"{api_url.rstrip('/').removesuffix('/v3')}/graphql"
+
+
+COMMENT_MARKER = "CIBOT-COMMENT-ID"
+REVIEW_BODY = "<!-- cibot review -->"
+"""GitHub requires a body for ``COMMENT`` reviews, the annotations carry the content"""
+
+PR_CONTEXT_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $threadsCursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      number
+      title
+      body
+      headRefOid
+      author { login ... on User { name } }
+      labels(first: 100) { nodes { name } }
+      comments(last: 100) {
+        pageInfo { hasPreviousPage }
+        nodes { databaseId body }
+      }
+      reviewThreads(first: 100, after: $threadsCursor) {
+        pageInfo { hasNextPage endCursor }
+        nodes {
+          comments(first: 100) {
+            pageInfo { hasNextPage }
+            nodes { databaseId body path line startLine originalLine originalStartLine }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+class PrCommentRef(msgspec.Struct):
+	"""Id of the bot comment carrying a marker, to find it without scanning the PR."""
+
+	id: int
+
+
+def comment_ref_prefix(pr_number: int) -> str:
+	return f"pr-comment-{pr_number}-"
+
+
+def comment_ref_key(pr_number: int, comment_id: str) -> str:
+	return f"{comment_ref_prefix(pr_number)}{comment_id}"
+
+
+def latest_bot_comment(context: PrContext, comment_id: str) -> PrCommentSnapshot | None:
+	return next((c for c in reversed(context.bot_comments) if comment_id in c.body), None)
+
+
+def thread_comment_nodes(threads: dict[str, Any]) -> list[dict[str, Any]]:
+	"""
+	Comments of a page of review threads.
+
+	Only the first 100 comments of each thread are loaded. cibot's annotations open
+	their threads, so the replies past that cap are never needed.
+	"""
+	nodes: list[dict[str, Any]] = []
+	for thread in threads["nodes"]:
+		comments = thread["comments"]
+		if comments["pageInfo"]["hasNextPage"]:
+			logger.debug("Not loading the replies past the first 100 of a review thread")
+		nodes.extend(comments["nodes"])
+	return nodes
+
+
+def review_comment_snapshot(node: dict[str, Any]) -> PrReviewCommentSnapshot:
+	# GraphQL reports ``line: null`` once the commented lines are no longer part of the
+	# diff, such outdated comments keep the position they were created at
+	outdated = node["line"] is None
+	return PrReviewCommentSnapshot(
+		id=node["databaseId"],
+		file=node["path"],
+		start_line=node["originalStartLine" if outdated else "startLine"],
+		end_line=node["originalLine" if outdated else "line"],
+		body=node["body"],
+		outdated=outdated,
+	)
+
+
+def review_comments_for_content_id(
+	context: PrContext, content_id: str
+) -> list[tuple[int, PrReviewComment]]:
+	return [
+		(
+			comment.id,
+			PrReviewComment(
+				content_id=content_id,
+				file=comment.file,
+				start_line=comment.start_line,
+				end_line=comment.end_line,
+				content=comment.body,
+				pr_number=context.pr_number,
+				outdated=comment.outdated,
+			),
+		)
+		for comment in context.review_comments
+		# file level comments have no line at all, cibot never creates them
+		if content_id in comment.body and comment.end_line is not None
+	]
+
+
+def pr_context_from_graphql(
+	pr: dict[str, Any], review_comment_nodes: list[dict[str, Any]]
+) -> PrContext:
+	author = pr["author"] or {"login": "ghost"}
+	return PrContext(
+		pr_number=pr["number"],
+		title=pr["title"],
+		body=pr["body"] or "",
+		labels=[label["name"] for label in pr["labels"]["nodes"]],
+		author_login=author["login"],
+		author_name=author.get("name") or None,
+		head_sha=pr["headRefOid"],
+		bot_comments=[
+			PrCommentSnapshot(id=c["databaseId"], body=c["body"])
+			for c in pr["comments"]["nodes"]
+			if COMMENT_MARKER in c["body"]
+		],
+		review_comments=[review_comment_snapshot(c) for c in review_comment_nodes],
+		comments_truncated=pr["comments"]["pageInfo"]["hasPreviousPage"],
+	)
+
+
+def review_comment_payload(comment: PrReviewComment) -> dict[str, Any]:
+	payload: dict[str, Any] = {
+		"body": comment.body(),
+		"path": comment.file,
+		"line": comment.end_line,
+		"side": "RIGHT",
+	}
+	if comment.start_line:
+		payload["start_line"] = comment.start_line
+		payload["start_side"] = "RIGHT"
+	return payload
+
+
+def review_batches(
+	comments: list[PrReviewComment], batch_size: int
+) -> list[tuple[int, list[dict[str, Any]]]]:
+	"""Group comments per PR into chunks of at most ``batch_size`` review comment payloads."""
+	by_pr: dict[int, list[dict[str, Any]]] = {}
+	for comment in comments:
+		by_pr.setdefault(comment.pr_number, []).append(review_comment_payload(comment))
+	return [
+		(pr_number, payloads[i : i + batch_size])
+		for pr_number, payloads in by_pr.items()
+		for i in range(0, len(payloads), batch_size)
+	]
+
+
+class GithubBotComments(CiBotBackendBase):
+	"""
+	Bot comment upserts shared by both GitHub backends.
+
+	Subclasses send REST calls through ``_rest`` from the calling thread, so storage
+	lookups never run on an event loop.
+	"""
+
+	BOT_COMMENT_ID: ClassVar[str] = "878ae1db-766f-49c7-a1a8-59f7be1fee8f"
+
+	changes_storage: BaseStorage
+	_scanned_prs: set[int]
+	_lock: threading.RLock
+
+	@abstractmethod
+	def _rest(self, verb: str, path: str, *, missing_ok: bool = False, **payload: Any) -> Any:  # noqa: ANN401
+		"""Send a REST call relative to the repository, None on 404 with ``missing_ok``."""
+
+	@override
+	def upsert_pr_comment(self, content: str, comment_id: str) -> None:
+		"""
+		Edit the bot comment carrying ``comment_id`` in place, or create it.
+
+		The PR context holds the latest bot comments. When older comments were cut off
+		the id remembered in storage is tried next and only if that is stale too are
+		all comments scanned, at most once per run.
+		"""
+		assert self.pr_number is not None, "pr_number is not set"
+		context = self.get_pr_context(self.pr_number)
+		content += f"\n<!--{COMMENT_MARKER} {comment_id} -->"
+		ref_key = comment_ref_key(self.pr_number, comment_id)
+
+		for existing in self._bot_comment_candidates(context, comment_id, ref_key):
+			if existing.body == content:
+				return
+			path = f"/issues/comments/{existing.id}"
+			if (edited := self._rest("PATCH", path, missing_ok=True, body=content)) is None:
+				logger.info(f"Bot comment {existing.id} no longer exists")
+				with self._lock:
+					context.bot_comments = [c for c in context.bot_comments if c.id != existing.id]
+				continue
+			self._remember_bot_comment(context, ref_key, edited)
+			return
+		created = self._rest("POST", f"/issues/{self.pr_number}/comments", body=content)
+		self._remember_bot_comment(context, ref_key, created)
+
+	@override
+	def get_pr_comment(self, comment_id: str) -> str | None:
+		assert self.pr_number is not None, "pr_number is not set"
+		context = self.get_pr_context(self.pr_number)
+		ref_key = comment_ref_key(self.pr_number, comment_id)
+		existing = next(self._bot_comment_candidates(context, comment_id, ref_key), None)
+		return existing.body if existing else None
+
+	@override
+	def forget_pr(self, pr_number: int) -> None:
+		self.changes_storage.delete_prefix(comment_ref_prefix(pr_number))
+
+	def _bot_comment_candidates(
+		self, context: PrContext, comment_id: str, ref_key: str
+	) -> Iterator[PrCommentSnapshot]:
+		"""Yield where the bot comment may be, cheapest lookup first."""
+		tried: set[int] = set()
+		if found := latest_bot_comment(context, comment_id):
+			tried.add(found.id)
+			yield found
+		if not context.comments_truncated:
+			return
+		# the comment may be older than the snapshot window
+		if (ref := self.changes_storage.get(ref_key, PrCommentRef)) and ref.id not in tried:
+			tried.add(ref.id)
+			if stored := self._fetch_bot_comment(context, ref.id):
+				yield stored
+		self._scan_bot_comments(context)
+		if (found := latest_bot_comment(context, comment_id)) and found.id not in tried:
+			yield found
+
+	def _fetch_bot_comment(self, context: PrContext, id_: int) -> PrCommentSnapshot | None:
+		"""Load a comment remembered in storage, so its body is compared before editing it."""
+		if (fetched := self._rest("GET", f"/issues/comments/{id_}", missing_ok=True)) is None:
+			logger.info(f"Bot comment {id_} no longer exists")
+			return None
+		snapshot = PrCommentSnapshot(id=fetched["id"], body=fetched["body"])
+		with self._lock:
+			context.bot_comments.append(snapshot)
+		return snapshot
+
+	def _scan_bot_comments(self, context: PrContext) -> None:
+		with self._lock:
+			if context.pr_number in self._scanned_prs:
+				return
+			bot_comments: list[PrCommentSnapshot] = []
+			page = 1
+			while comments := self._rest(
+				"GET", f"/issues/{context.pr_number}/comments?per_page=100&page={page}"
+			):
+				bot_comments.extend(
+					PrCommentSnapshot(id=c["id"], body=c["body"])
+					for c in comments
+					if COMMENT_MARKER in c["body"]
+				)
+				page += 1
+			context.bot_comments = bot_comments
+			self._scanned_prs.add(context.pr_number)
+
+	def _remember_bot_comment(
+		self, context: PrContext, ref_key: str, comment: dict[str, Any]
+	) -> None:
+		snapshot = PrCommentSnapshot(id=comment["id"], body=comment["body"])
+		with self._lock:
+			context.bot_comments = [c for c in context.bot_comments if c.id != snapshot.id]
+			context.bot_comments.append(snapshot)
+		if not context.comments_truncated:
+			# the snapshot will find it again, no need to write storage
+			return
+		ref = self.changes_storage.get(ref_key, PrCommentRef)
+		if ref is None or ref.id != snapshot.id:
+			self.changes_storage.set(ref_key, PrCommentRef(id=snapshot.id))
+
+
+class GithubBackend(GithubBotComments):
 	def __init__(
 		self,
 		repo: Repository,
 		storage: BaseStorage,
 		pr_number: int | None,
 		settings: GithubSettings,
+		scheduler: RequestScheduler | None = None,
 	) -> None:
 		self.repo = repo
 		self.changes_storage = storage
 		self.pr_number = pr_number
 		self.settings = settings
-
-	BOT_COMMENT_ID: ClassVar[str] = "878ae1db-766f-49c7-a1a8-59f7be1fee8f"
+		self.scheduler = scheduler or RequestScheduler()
+		self._pr_contexts: dict[int, PrContext] = {}
+		self._scanned_prs: set[int] = set()
+		self._lock = threading.RLock()
 
 	@override
 	def name(self):
@@ -50,93 +340,146 @@ class GithubBackend(CiBotBackendBase):
 		self.git("config", "user.email", "cibot@no.reply")
 
 	@override
-	def upsert_pr_comment(self, content: str, comment_id: str) -> None:
-		pr = self._pr
-		content += f"\n<!--CIBOT-COMMENT-ID {comment_id} -->"
-
-		for comment in pr.get_issue_comments().reversed:
-			if comment_id in comment.body:
-				if comment.body == content:
-					return
-				comment.delete()
-				break
-		# If no comment was found, create a new one
-		pr.create_issue_comment(content)
+	def reset(self, pr_number: int | None) -> None:
+		with self._lock:
+			super().reset(pr_number)
+			self._pr_contexts.clear()
+			self._scanned_prs.clear()
 
 	@override
 	def create_pr_review_comment(self, comment: PrReviewComment) -> None:
-		latest_commit = self._pr.get_commits().reversed[0]
-		content = f"""
-[//]: {comment.content_id}
-{comment.content}
-"""
-		start, end = comment.start_line, comment.end_line
-		if start:
-			self._pr.create_review_comment(
-				body=content, path=comment.file, start_line=start, line=end, commit=latest_commit
+		head_sha = self.get_pr_context(comment.pr_number).head_sha
+		created = self._request(
+			"POST",
+			f"/pulls/{comment.pr_number}/comments",
+			commit_id=head_sha,
+			**review_comment_payload(comment),
+		)
+		with self._lock:
+			self.get_pr_context(comment.pr_number).review_comments.append(
+				PrReviewCommentSnapshot(
+					id=created["id"],
+					file=comment.file,
+					start_line=comment.start_line,
+					end_line=comment.end_line,
+					body=created["body"],
+				)
 			)
-		else:
-			self._pr.create_review_comment(
-				body=content, path=comment.file, line=end, commit=latest_commit
+
+	@override
+	def create_pr_review_comments(self, comments: list[PrReviewComment]) -> None:
+		"""Submit the comments as pull request reviews of ``REVIEW_BATCH_SIZE`` comments each."""
+		batches = review_batches(comments, self.settings.REVIEW_BATCH_SIZE)
+		for pr_number, batch in batches:
+			head_sha = self.get_pr_context(pr_number).head_sha
+			logger.info(f"Submitting review with {len(batch)} comments on PR #{pr_number}")
+			self._request(
+				"POST",
+				f"/pulls/{pr_number}/reviews",
+				commit_id=head_sha,
+				event="COMMENT",
+				body=REVIEW_BODY,
+				comments=batch,
 			)
+		with self._lock:
+			for pr_number, _ in batches:
+				# the review response has no comment ids, reload on next access
+				self._pr_contexts.pop(pr_number, None)
 
 	@override
 	def get_review_comments_for_content_id(self, id: str) -> list[tuple[int, PrReviewComment]]:
-		review_comments = self._pr.get_review_comments()
-		ret = []
-		for comment in review_comments:
-			if id in comment.body:
-				pr_comment = PrReviewComment(
-					content_id=id,
-					file=comment.path,
-					start_line=comment.start_line,
-					end_line=comment.line,
-					content=comment.body,
-					pr_number=self._pr.number,
-				)
-				ret.append((comment.id, pr_comment))
-		return ret
+		assert self.pr_number is not None, "pr_number is not set"
+		return review_comments_for_content_id(self.get_pr_context(self.pr_number), id)
 
 	@override
 	def delete_pr_review_comment(self, comment_id: int) -> None:
-		self._pr.get_review_comment(comment_id).delete()
+		self._request("DELETE", f"/pulls/comments/{comment_id}")
+		with self._lock:
+			if self.pr_number in self._pr_contexts:
+				context = self._pr_contexts[self.pr_number]
+				context.review_comments = [c for c in context.review_comments if c.id != comment_id]
 
 	@override
 	def publish_release(self, release_info: ReleaseInfo):
-		release = self.repo.create_git_release(
-			name=release_info.header,
-			tag=release_info.version,
-			generate_release_notes=False,
-			message=release_info.note,
+		release = self.scheduler.call(
+			lambda: self.repo.create_git_release(
+				name=release_info.header,
+				tag=release_info.version,
+				generate_release_notes=False,
+				message=release_info.note,
+			),
+			mutation=True,
+			idempotent=False,
+			requester=self.repo.requester,
+			name="POST /releases",
 		)
 		logger.info(f"Published release {release_info.version} at {release.html_url}")
 
 	@override
-	def get_pr_description(self, pr_number):
-		pr = self.repo.get_pull(pr_number)
-		return self._pr_desc_from_pr(pr)
-
-	def _pr_desc_from_pr(self, pr: github.PullRequest.PullRequest) -> PrDescription:
-		return PrDescription(
-			contributor=PRContributor(
-				pr_number=pr.number,
-				pr_author_username=pr.user.login,
-				pr_author_fullname=pr.user.name,
+	def get_pr_context(self, pr_number: int) -> PrContext:
+		with self._lock:
+			if (context := self._pr_contexts.get(pr_number)) is None:
+				context = self._pr_contexts[pr_number] = self._fetch_pr_context(pr_number)
+			return context
+
+	def _fetch_pr_context(self, pr_number: int) -> PrContext:
+		owner, name = self.repo.full_name.split("/")
+		variables: dict[str, Any] = {"owner": owner, "name": name, "number": pr_number}
+		pr = self._graphql(PR_CONTEXT_QUERY, variables)["repository"]["pullRequest"]
+		threads = pr["reviewThreads"]
+		review_comment_nodes = thread_comment_nodes(threads)
+		while threads["pageInfo"]["hasNextPage"]:
+			variables["threadsCursor"] = threads["pageInfo"]["endCursor"]
+			data = self._graphql(PR_CONTEXT_QUERY, variables)
+			threads = data["repository"]["pullRequest"]["reviewThreads"]
+			review_comment_nodes.extend(thread_comment_nodes(threads))
+
+		context = pr_context_from_graphql(pr, review_comment_nodes)
+		logger.info(f"Loaded context of PR #{pr_number}")
+		return context
+
+	def _graphql(self, query: str, variables: dict[str, Any]) -> dict[str, Any]:
+		requester = self.repo.requester
+		_, data = self.scheduler.call(
+			lambda: requester.graphql_query(query, variables),
+			mutation=False,
+			idempotent=True,
+			requester=requester,
+			name="POST /graphql",
+		)
+		return data["data"]
+
+	def _request(self, verb: str, path: str, **payload: Any) -> Any:  # noqa: ANN401
+		requester = self.repo.requester
+		_, data = self.scheduler.call(
+			lambda: requester.requestJsonAndCheck(
+				verb, f"{self.repo.url}{path}", input=payload or None
 			),
-			header=pr.title,
-			description=pr.body,
-			pr_number=pr.number,
+			mutation=is_mutation(verb),
+			idempotent=is_idempotent(verb),
+			requester=requester,
+			name=f"{verb} {path}",
 		)
+		return data
+
+	@override
+	def _rest(self, verb: str, path: str, *, missing_ok: bool = False, **payload: Any) -> Any:
+		try:
+			return self._request(verb, path, **payload)
+		except UnknownObjectException:
+			if not missing_ok:
+				raise
+			return None
+
+	@override
+	def get_pr_description(self, pr_number):
+		return self.get_pr_context(pr_number).description()
 
 	@override
 	def get_commit_associated_pr(self, commit_hash) -> PrDescription:
-		return self._pr_desc_from_pr(self.repo.get_commit(commit_hash).get_pulls()[0])
+		pulls = self._request("GET", f"/commits/{commit_hash}/pulls")
+		return self.get_pr_description(pulls[0]["number"])
 
 	@override
 	def get_pr_labels(self, pr_number):
-		return [label.name for label in self.repo.get_pull(pr_number).labels]
-
-	@cached_property
-	def _pr(self) -> github.PullRequest.PullRequest:
-		assert self.pr_number is not None, "pr_number is not set"
-		return self.repo.get_pull(self.pr_number)
+		return self.get_pr_context(pr_number).labels
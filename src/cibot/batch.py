@@ -0,0 +1,296 @@
+import contextvars
+import statistics
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import override
+
+import msgspec
+from loguru import logger
+
+from cibot.backends.github_backend import GithubSettings
+from cibot.cli import (
+	NoCheckoutRunner,
+	get_backend,
+	get_github_repo,
+	get_plugins,
+	get_scheduler,
+	get_storage,
+	refuse_checkout_plugins,
+)
+from cibot.settings import CiBotSettings
+from cibot.storage_layers.base import BaseStorage
+
+
+@dataclass(frozen=True)
+class Target:
+	repo: str
+	pr: int
+
+	def __str__(self) -> str:
+		return f"{self.repo}#{self.pr}"
+
+
+def parse_target(value: str, default_repo: str | None = None) -> Target:
+	"""``owner/repo#12``, or ``12`` for a PR of ``default_repo``."""
+	repo, _, number = value.rpartition("#")
+	repo = repo or default_repo or GithubSettings().REPO_SLUG or ""
+	if not repo or not number.isdigit():
+		msg = f"Expected owner/repo#number or a PR number, got {value}"
+		raise ValueError(msg)
+	return Target(repo, int(number))
+
+
+def open_prs(slug: str, label: str | None = None) -> list[Target]:
+	"""Open PRs of ``slug``, oldest first, only those labeled ``label`` if given."""
+	repo = get_github_repo(slug)
+
+	def list_pulls() -> list[Target]:
+		return [
+			Target(slug, pull.number)
+			for pull in repo.get_pulls(state="open", sort="created", direction="asc")
+			if label is None or label in {pr_label.name for pr_label in pull.labels}
+		]
+
+	return get_scheduler().call(
+		list_pulls, mutation=False, idempotent=True, requester=repo.requester, name="list PRs"
+	)
+
+
+def _decode[T](value: msgspec.Struct, type_: type[T]) -> T:
+	return msgspec.msgpack.decode(msgspec.msgpack.encode(value), type=type_)
+
+
+class PrStorage(BaseStorage):
+	"""
+	Buffer the writes of one PR on top of its repository's storage.
+
+	``commit`` hands them to the repository's storage, which the batch commits once,
+	``rollback`` drops them so a failed PR leaves nothing behind.
+	"""
+
+	def __init__(self, storage: BaseStorage) -> None:
+		self.storage = storage
+		self._values: dict[str, msgspec.Struct | None] = {}
+		"""key -> value set by this PR, None once deleted"""
+		self._prefixes: list[str] = []
+		self._lock = threading.RLock()
+
+	def _deleted_by_prefix(self, key: str) -> bool:
+		return any(key.startswith(prefix) for prefix in self._prefixes)
+
+	@override
+	def get[T](self, key: str, type_: type[T]) -> T | None:
+		with self._lock:
+			if key in self._values:
+				value = self._values[key]
+				return (
+					None if value is None else msgspec.convert(value, type_, from_attributes=True)
+				)
+			if self._deleted_by_prefix(key):
+				return None
+			return self.storage.get(key, type_)
+
+	@override
+	def set(self, key: str, value: msgspec.Struct) -> None:
+		with self._lock:
+			self._values[key] = value
+
+	@override
+	def delete(self, key: str) -> None:
+		with self._lock:
+			self._values[key] = None
+
+	@override
+	def items[T](self, prefix: str, type_: type[T]) -> dict[str, T]:
+		with self._lock:
+			items = {
+				key: value
+				for key, value in self.storage.items(prefix, type_).items()
+				if key not in self._values and not self._deleted_by_prefix(key)
+			}
+			items.update(
+				(key, _decode(value, type_))
+				for key, value in self._values.items()
+				if key.startswith(prefix) and value is not None
+			)
+			return dict(sorted(items.items()))
+
+	@override
+	def delete_prefix(self, prefix: str) -> None:
+		with self._lock:
+			self._prefixes.append(prefix)
+			self._values = {
+				key: value for key, value in self._values.items() if not key.startswith(prefix)
+			}
+
+	@override
+	def commit(self) -> None:
+		with self._lock:
+			for prefix in self._prefixes:
+				self.storage.delete_prefix(prefix)
+			for key, value in self._values.items():
+				if value is None:
+					self.storage.delete(key)
+				else:
+					self.storage.set(key, value)
+			self.rollback()
+
+	@override
+	def rollback(self) -> None:
+		with self._lock:
+			self._values.clear()
+			self._prefixes.clear()
+
+
+class BatchRunner(NoCheckoutRunner):
+	"""Run one PR of a batch, its storage is a ``PrStorage``."""
+
+
+@dataclass
+class PrResult:
+	target: Target
+	wall_ms: float
+	error: str | None = None
+
+
+@dataclass
+class BatchReport:
+	results: list[PrResult] = field(default_factory=list)
+	wall_s: float = 0.0
+	failed_commits: dict[str, str] = field(default_factory=dict)
+
+	@property
+	def failed(self) -> list[PrResult]:
+		return [result for result in self.results if result.error]
+
+	def summary(self) -> str:
+		lines = [f"{'PR':<40} {'ms':>8}  result"]
+		lines.extend(
+			f"{result.target!s:<40} {result.wall_ms:>8.0f}  {result.error or 'ok'}"
+			for result in self.results
+		)
+		lines.extend(
+			f"{repo}: storage commit failed: {error}" for repo, error in self.failed_commits.items()
+		)
+		if self.results:
+			durations = [result.wall_ms for result in self.results]
+			lines.append(
+				f"{len(self.results)} PRs, {len(self.failed)} failed in {self.wall_s:.1f}s, "
+				f"median {statistics.median(durations):.0f}ms, max {max(durations):.0f}ms per PR"
+			)
+		return "\n".join(lines)
+
+
+class Batch:
+	"""
+	Run ``on_pr_changed`` over many PRs, possibly of several repositories.
+
+	Mutations are spaced by the scheduler anyway, so the parallel part of a PR is
+	fetching its context: up to ``concurrency`` PRs are fetched ahead while the hooks
+	of each repository's PRs run one after the other, which keeps plugins that
+	read-modify-write a shared storage key correct. Storages are write-behind and
+	committed once per repository, the writes of a failed PR are rolled back. A
+	write-behind SQLite transaction locks the whole database file until it is
+	committed, so with the sqlite storage the repositories run one after the other.
+
+	No PR's head is checked out, so plugins reading the working tree are refused
+	and release PRs are commented on but not prepared.
+	"""
+
+	def __init__(self, plugins: list[str], concurrency: int) -> None:
+		refuse_checkout_plugins(plugins)
+		self.plugins = plugins
+		self.concurrency = max(concurrency, 1)
+
+	def run(self, targets: list[Target]) -> BatchReport:
+		order = {target: index for index, target in enumerate(dict.fromkeys(targets))}
+		by_repo: dict[str, list[int]] = {}
+		for target in order:
+			by_repo.setdefault(target.repo, []).append(target.pr)
+		repo_workers = min(self.concurrency, len(by_repo)) or 1
+		if CiBotSettings().STORAGE == "sqlite":
+			repo_workers = 1
+		report = BatchReport()
+		start = time.perf_counter()
+		with (
+			ThreadPoolExecutor(self.concurrency, thread_name_prefix="cibot-fetch") as fetch,
+			ThreadPoolExecutor(repo_workers, thread_name_prefix="cibot-repo") as repos,
+		):
+			futures = [
+				repos.submit(
+					contextvars.copy_context().run, self._run_repo, slug, prs, fetch, report
+				)
+				for slug, prs in by_repo.items()
+			]
+			for future in futures:
+				future.result()
+		report.wall_s = time.perf_counter() - start
+		report.results.sort(key=lambda result: order[result.target])
+		return report
+
+	def _run_repo(
+		self, slug: str, prs: list[int], fetch: ThreadPoolExecutor, report: BatchReport
+	) -> None:
+		try:
+			storage = get_storage(slug, write_behind=True)
+		except Exception as e:  # noqa: BLE001
+			logger.exception(f"Opening the storage of {slug} failed")
+			error = f"{type(e).__name__}: {e}"
+			report.results.extend(PrResult(Target(slug, pr), 0.0, error) for pr in prs)
+			return
+		for pr, prepared in self._prefetch(slug, prs, storage, fetch):
+			start = time.perf_counter()
+			error = None
+			try:
+				runner = prepared.result()
+				try:
+					runner.on_pr_changed(pr)
+				finally:
+					runner.backend.close()
+			except Exception as e:  # noqa: BLE001
+				logger.exception(f"{slug}#{pr} failed")
+				error = f"{type(e).__name__}: {e}"
+			report.results.append(
+				PrResult(Target(slug, pr), (time.perf_counter() - start) * 1000, error)
+			)
+		try:
+			storage.commit()
+		except Exception as e:  # noqa: BLE001
+			logger.exception(f"Committing the storage of {slug} failed")
+			report.failed_commits[slug] = f"{type(e).__name__}: {e}"
+
+	def _prefetch(
+		self, slug: str, prs: list[int], storage: BaseStorage, fetch: ThreadPoolExecutor
+	) -> Iterator[tuple[int, "Future[BatchRunner]"]]:
+		"""Yield the PRs in order, each with its runner prepared up to ``concurrency`` ahead."""
+		window: deque[tuple[int, Future[BatchRunner]]] = deque()
+		remaining = iter(prs)
+		while True:
+			while len(window) < self.concurrency and (pr := next(remaining, None)) is not None:
+				future = fetch.submit(
+					contextvars.copy_context().run, self._prepare, slug, pr, storage
+				)
+				window.append((pr, future))
+			if not window:
+				return
+			yield window.popleft()
+
+	def _prepare(self, slug: str, pr: int, storage: BaseStorage) -> BatchRunner:
+		pr_storage = PrStorage(storage)
+		backend = get_backend(pr, slug, pr_storage)
+		try:
+			runner = BatchRunner(
+				get_plugins(self.plugins, backend, pr_storage),
+				backend,
+				pr_storage,
+				configure_git=False,
+			)
+			backend.get_pr_context(pr)
+		except BaseException:
+			backend.close()
+			raise
+		return runner
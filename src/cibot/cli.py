@@ -1,36 +1,44 @@
+import contextvars
+import importlib
 import itertools
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import cache
 from pathlib import Path
-from typing import TYPE_CHECKING, Annotated
+from typing import TYPE_CHECKING, Annotated, override
 
-import jinja2
 import msgspec
 import typer
 from loguru import logger
 from typer import Typer
 
 from cibot.backends.base import CiBotBackendBase
-from cibot.plugins.base import CiBotPlugin, VersionBumpPlugin
-from cibot.plugins.diffcov import DiffCovPlugin
-from cibot.plugins.semver import SemverPlugin
+from cibot.comment_sections import parse_sections, render_sections, without_run_links
+from cibot.plugins.base import BumpType, CiBotPlugin, VersionBumpPlugin
 from cibot.settings import CiBotSettings
 from cibot.storage_layers.base import BaseStorage
-
-from .plugins.deferred_release import DeferredReleasePlugin
+from cibot.tracing import span, trace_to
 
 if TYPE_CHECKING:
+	from github import Github
 	from github.Repository import Repository
 
+	from cibot.ratelimit import RequestScheduler
+
 
 app = Typer(name="management")
-template_env = jinja2.Environment(
-	loader=jinja2.FileSystemLoader(Path(__file__).parent / "templates"),
-	autoescape=jinja2.select_autoescape(),
-)
 
 
 @cache
-def get_github_repo() -> "Repository":
+def get_scheduler() -> "RequestScheduler":
+	from cibot.ratelimit import RequestScheduler
+
+	return RequestScheduler()
+
+
+@cache
+def get_github_client() -> "Github":
 	from github import Github
 
 	from cibot.backends.github_backend import GithubSettings
@@ -38,26 +46,57 @@ def get_github_repo() -> "Repository":
 	settings = GithubSettings()
 	if not settings.TOKEN:
 		raise ValueError("missing GITHUB_TOKEN")
-	if not settings.REPO_SLUG:
+	# pacing and retries are left to the scheduler
+	return Github(
+		settings.TOKEN,
+		base_url=settings.API_URL,
+		retry=None,
+		seconds_between_requests=None,
+		seconds_between_writes=None,
+	)
+
+
+@cache
+def get_github_repo(slug: str | None = None) -> "Repository":
+	"""Return the repository ``slug``, ``GITHUB_REPO_SLUG`` by default."""
+	from cibot.backends.github_backend import GithubSettings
+
+	slug = slug or GithubSettings().REPO_SLUG
+	if not slug:
 		raise ValueError("missing GITHUB_REPO_SLUG")
-	client = Github(settings.TOKEN)
-	return client.get_repo(settings.REPO_SLUG)
+	return get_github_client().get_repo(slug)
 
 
-def get_storage() -> BaseStorage:
+@cache
+def get_storage(slug: str | None = None, *, write_behind: bool | None = None) -> BaseStorage:
+	"""Open the storage of ``slug``, ``write_behind`` overrides the storage's own setting."""
 	settings = CiBotSettings()
 	match settings.STORAGE:
 		case "github_issue":
 			from cibot.storage_layers.github_issue import GithubIssueStorage
 
-			repo = get_github_repo()
-			return GithubIssueStorage(repo)
+			repo = get_github_repo(slug)
+			return GithubIssueStorage(repo, get_scheduler(), write_behind=write_behind)
+		case "github_sharded":
+			from cibot.storage_layers.github_sharded import GithubShardedIssueStorage
+
+			repo = get_github_repo(slug)
+			return GithubShardedIssueStorage(repo, get_scheduler(), write_behind=write_behind)
+		case "sqlite":
+			from cibot.backends.github_backend import GithubSettings
+			from cibot.storage_layers.sqlite import SqliteStorage
+
+			repo = slug or GithubSettings().REPO_SLUG
+			return SqliteStorage(repo=repo, write_behind=write_behind)
 		case _:
 			raise ValueError(f"Unknown storage {settings.STORAGE}")
 
 
-def get_backend(pr_number: int | None) -> CiBotBackendBase:
+def get_backend(
+	pr_number: int | None, slug: str | None = None, storage: BaseStorage | None = None
+) -> CiBotBackendBase:
 	settings = CiBotSettings()
+	storage = storage or get_storage(slug)
 	backend_name = settings.BACKEND
 	if not backend_name:
 		raise ValueError("BACKEND environment variable is not set")
@@ -65,18 +104,48 @@ def get_backend(pr_number: int | None) -> CiBotBackendBase:
 		case "github":
 			from cibot.backends.github_backend import GithubBackend, GithubSettings
 
-			repo = get_github_repo()
-			storage = get_storage()
-			return GithubBackend(repo, storage, pr_number=pr_number, settings=GithubSettings())
+			repo = get_github_repo(slug)
+			return GithubBackend(
+				repo,
+				storage,
+				pr_number=pr_number,
+				settings=GithubSettings(),
+				scheduler=get_scheduler(),
+			)
+		case "github_async":
+			from cibot.backends.github_async_backend import AsyncGithubBackend
+			from cibot.backends.github_backend import GithubSettings
+
+			github_settings = GithubSettings()
+			if slug:
+				github_settings = github_settings.model_copy(update={"REPO_SLUG": slug})
+			return AsyncGithubBackend(
+				storage, pr_number=pr_number, settings=github_settings, scheduler=get_scheduler()
+			)
 		case _:
 			raise ValueError(f"Unknown backend {backend_name}")
 
 
 PLUGINS_REGISTRY = {
-	"deferred_release": DeferredReleasePlugin,
-	"semver": SemverPlugin,
-	"diffcov": DiffCovPlugin,
+	"deferred_release": "cibot.plugins.deferred_release:DeferredReleasePlugin",
+	"semver": "cibot.plugins.semver:SemverPlugin",
+	"diffcov": "cibot.plugins.diffcov:DiffCovPlugin",
 }
+"""Built-in plugins as ``module:Class``, only imported when requested"""
+
+PLUGINS_ENTRY_POINT_GROUP = "cibot.plugins"
+"""Entry point group other packages register their plugin classes under"""
+
+
+def load_plugin(name: str) -> type[CiBotPlugin]:
+	if target := PLUGINS_REGISTRY.get(name):
+		module, _, attr = target.partition(":")
+		return getattr(importlib.import_module(module), attr)
+	from importlib.metadata import entry_points
+
+	for entry_point in entry_points(group=PLUGINS_ENTRY_POINT_GROUP, name=name):
+		return entry_point.load()
+	raise ValueError(f"Unknown plugin {name}")
 
 
 def get_plugins(
@@ -85,12 +154,13 @@ def get_plugins(
 	out = []
 	for name in plugins:
 		logger.info(f"Loading plugin {name}")
-		out.append(PLUGINS_REGISTRY[name](backend, storage))
-		if name not in PLUGINS_REGISTRY:
-			raise ValueError(f"Unknown plugin {name}")
+		out.append(load_plugin(name)(backend, storage))
 	return out
 
 
+CONSOLIDATED_COMMENT_ID = "cibot-consolidated-comment"
+
+
 class ReleasePrMarker(msgspec.Struct):
 	"""Mark a release PR workflow as already ran"""
 
@@ -107,53 +177,136 @@ class PluginRunner:
 		plugins: list[CiBotPlugin],
 		backend: CiBotBackendBase,
 		storage: BaseStorage,
+		max_workers: int | None = None,
+		*,
+		configure_git: bool = True,
 	) -> None:
 		self.backend = backend
 		self.storage = storage
 		self.plugins = plugins
-		self.backend.configure_git()
+		self.max_workers = max_workers or CiBotSettings().MAX_WORKERS
+		self.stages = self._plan_stages()
+		if configure_git:
+			self.backend.configure_git()
+
+	def _plan_stages(self) -> list[list[CiBotPlugin]]:
+		"""Group plugins into stages that only depend on plugins of earlier stages."""
+		loaded = {plugin.plugin_name() for plugin in self.plugins}
+		done: set[str] = set()
+		remaining = list(self.plugins)
+		stages: list[list[CiBotPlugin]] = []
+		while remaining:
+			stage = [
+				plugin
+				for plugin in remaining
+				if all(dep in done or dep not in loaded for dep in plugin.depends_on())
+			]
+			if not stage:
+				names = [plugin.plugin_name() for plugin in remaining]
+				msg = f"Circular plugin dependencies between {names}"
+				raise ValueError(msg)
+			stages.append(stage)
+			done.update(plugin.plugin_name() for plugin in stage)
+			remaining = [plugin for plugin in remaining if plugin not in stage]
+		return stages
+
+	def _map[T, R](self, fn: Callable[[T], R], items: list[T]) -> list[R]:
+		if self.max_workers <= 1 or len(items) <= 1:
+			return [fn(item) for item in items]
+		with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+			# run each item in a copy of the caller's context so trace spans keep their plugin
+			futures = [executor.submit(contextvars.copy_context().run, fn, item) for item in items]
+			return [future.result() for future in futures]
+
+	def run_hook[R](self, name: str, hook: Callable[[CiBotPlugin], R]) -> list[R]:
+		"""
+		Run ``hook`` for every plugin, plugins of the same stage run concurrently.
+
+		Results are returned in plugin order regardless of completion order.
+		"""
+
+		def run(plugin: CiBotPlugin) -> R:
+			with span(name, "hook", plugin=plugin.plugin_name()):
+				return hook(plugin)
+
+		results: dict[int, R] = {}
+		for stage in self.stages:
+			for plugin, result in zip(stage, self._map(run, stage), strict=True):
+				results[id(plugin)] = result
+		return [results[id(plugin)] for plugin in self.plugins]
+
+	@contextmanager
+	def transaction(self) -> Iterator[None]:
+		"""Commit buffered storage mutations if the run succeeds, roll them back otherwise."""
+		try:
+			yield
+		except BaseException:
+			self.rollback()
+			raise
+		self.commit()
+
+	def commit(self) -> None:
+		self.storage.commit()
+
+	def rollback(self) -> None:
+		self.storage.rollback()
 
 	def on_pr_changed(self, pr: int):
-		results = [plugin.on_pr_changed(pr) for plugin in self.plugins]
+		with self.transaction():
+			results = self.run_hook("on_pr_changed", lambda plugin: plugin.on_pr_changed(pr))
 
-		if release_type := next((res for res in results if res is not None), None):
-			# find plugin for release_type
-			version_bump_plugin = next(
-				plugin for plugin in self.plugins if isinstance(plugin, VersionBumpPlugin)
-			)
-			logger.info(f"Found version bump plugin: {version_bump_plugin.plugin_name()}")
-			next_version = version_bump_plugin.next_version(release_type)
-			release_marker = ReleasePrMarker(pr, bump_type=release_type.name)
-			if self.storage.get(release_marker.as_key(), ReleasePrMarker):
-				logger.info(f"Release workflow for PR #{pr} already ran")
+			release_type = next((res for res in results if res is not None), None)
+			if release_type and not self.prepare_release_pr(pr, release_type):
 				return
+			self.comment_on_pr(pr)
+		self.check_for_errors()
 
-			logger.info(f"next version is {next_version}")
-			git_changes = list(
-				itertools.chain(
-					*[plugin.prepare_release(release_type, next_version) for plugin in self.plugins]
+	def prepare_release_pr(self, pr: int, release_type: BumpType) -> bool:
+		"""Commit and push the release files of ``pr``, False if that was done already."""
+		# find plugin for release_type
+		version_bump_plugin = next(
+			plugin for plugin in self.plugins if isinstance(plugin, VersionBumpPlugin)
+		)
+		logger.info(f"Found version bump plugin: {version_bump_plugin.plugin_name()}")
+		next_version = version_bump_plugin.next_version(release_type)
+		release_marker = ReleasePrMarker(pr, bump_type=release_type.name)
+		if self.storage.get(release_marker.as_key(), ReleasePrMarker):
+			logger.info(f"Release workflow for PR #{pr} already ran")
+			return False
+
+		logger.info(f"next version is {next_version}")
+		git_changes = list(
+			itertools.chain(
+				*self.run_hook(
+					"prepare_release",
+					lambda plugin: plugin.prepare_release(release_type, next_version),
 				)
 			)
-			logger.info(f"commiting {git_changes} changes")
-			if git_changes:
-				for change in git_changes:
-					self.backend.git("add", str(change))
-				self.backend.git("commit", "-m", f"Prepare release for PR #{pr}")
-				self.backend.git("push")
-
-			self.storage.set(release_marker.as_key(), release_marker)
-		self.comment_on_pr(pr)
+		)
+		logger.info(f"commiting {git_changes} changes")
+		if git_changes:
+			for change in git_changes:
+				self.backend.git("add", str(change))
+			self.backend.git("commit", "-m", f"Prepare release for PR #{pr}")
+			self.backend.git("push")
+
+		self.storage.set(release_marker.as_key(), release_marker)
+		return True
+
+	def on_commit_to_main(self, commit_hash: str | None = None):
+		with self.transaction():
+			commit_hash = commit_hash or self.backend.get_current_commit_hash()
+			release_infos = self.run_hook(
+				"on_commit_to_main", lambda plugin: plugin.on_commit_to_main(commit_hash)
+			)
+			release_info = next((info for info in release_infos if info), None)
+			if release_info:
+				self.backend.publish_release(release_info)
 		self.check_for_errors()
 
-	def on_commit_to_main(self):
-		release_infos = [
-			plugin.on_commit_to_main(self.backend.get_current_commit_hash())
-			for plugin in self.plugins
-		]
-		release_info = next((info for info in release_infos if info), None)
-		if release_info:
-			self.backend.publish_release(release_info)
-		self.check_for_errors()
+	def on_pr_closed(self, pr: int) -> None:
+		with self.transaction():
+			self.backend.forget_pr(pr)
 
 	def check_for_errors(self):
 		for plugin in self.plugins:
@@ -161,33 +314,171 @@ class PluginRunner:
 				raise ValueError(f"Plugin {plugin.plugin_name()} failed")
 
 	def comment_on_pr(self, pr: int):  # sourcery skip: use-join
-		plugin_comments = {
-			plugin.plugin_name(): plugin.provide_comment_for_pr() for plugin in self.plugins
-		}
-		for plugin_name, comment in plugin_comments.items():
+		plugin_comments = {}
+		for plugin in self.plugins:
+			with span("provide_comment_for_pr", "hook", plugin=plugin.plugin_name()):
+				plugin_comments[plugin.plugin_name()] = plugin.provide_comment_for_pr()
+		settings = CiBotSettings()
+		if settings.CONSOLIDATE_COMMENTS:
+			self._upsert_consolidated_comment(plugin_comments, settings.COMMENT_MAX_CHARS)
+			return
+		self._map(
+			lambda comment: self.backend.upsert_pr_comment(comment[0], comment_id=comment[1]),
+			[comment for comment in plugin_comments.values() if comment],
+		)
+
+	def _upsert_consolidated_comment(
+		self, plugin_comments: dict[str, tuple[str, str] | None], max_chars: int
+	) -> None:
+		"""
+		Merge the plugin comments into the sections of the single bot comment.
+
+		Plugins without a comment this run keep their previous section, sections of
+		plugins that no longer run are dropped. Nothing is written unless the
+		rendered, possibly truncated, sections changed, ignoring the workflow run their
+		truncation notices link to.
+		"""
+		previous = parse_sections(self.backend.get_pr_comment(CONSOLIDATED_COMMENT_ID) or "")
+		sections = {name: content for name, content in previous.items() if name in plugin_comments}
+		for name, comment in plugin_comments.items():
 			if comment:
-				self.backend.upsert_pr_comment(comment[0], comment_id=comment[1])
+				sections[name] = comment[0]
+		body = render_sections(sections, max_chars)
+		if without_run_links(parse_sections(body)) == without_run_links(previous):
+			logger.info("Bot comment is up to date")
+			return
+		self.backend.upsert_pr_comment(body, comment_id=CONSOLIDATED_COMMENT_ID)
+
+
+class NoCheckoutRunner(PluginRunner):
+	"""Run hooks away from the PR's checkout, release PRs are commented on but not prepared."""
+
+	@override
+	def prepare_release_pr(self, pr: int, release_type: BumpType) -> bool:
+		logger.warning(
+			f"Not preparing the {release_type.value} release of PR #{pr}: there is no checkout "
+			"of its head, the PR's own CI run prepares it"
+		)
+		return True
+
+
+def refuse_checkout_plugins(plugins: list[str]) -> None:
+	"""Raise if one of ``plugins`` reads the PR's checkout, for runs that have none."""
+	if checkout := [name for name in plugins if load_plugin(name).READS_CHECKOUT]:
+		msg = f"Plugins {checkout} read the PR's checkout, run them in the PR's CI job"
+		raise ValueError(msg)
+
+
+def get_runner(
+	plugins: list[str],
+	pr_number: int | None = None,
+	slug: str | None = None,
+	backend: CiBotBackendBase | None = None,
+	*,
+	checkout: bool = True,
+) -> PluginRunner:
+	"""
+	Build the runner of one event, on ``backend`` if given, which must belong to ``slug``.
+
+	Without ``checkout`` the working directory is not the PR's, so git is left alone
+	and release PRs are not prepared.
+	"""
+	storage = get_storage(slug)
+	backend = backend or get_backend(pr_number, slug, storage)
+	runner = PluginRunner if checkout else NoCheckoutRunner
+	return runner(get_plugins(plugins, backend, storage), backend, storage, configure_git=checkout)
 
 
-def get_runner(plugins: list[str], pr_number: int | None = None) -> PluginRunner:
-	backend = get_backend(pr_number)
-	storage = get_storage()
-	return PluginRunner(get_plugins(plugins, backend, storage), backend, storage)
+EMPTY_LIST = []
 
 
-EMPTY_LIST = []
+TraceOption = Annotated[
+	Path | None,
+	typer.Option(help="Write a Chrome trace of the run to this file and log a timing summary"),
+]
+
+
+@app.command()
+def on_pr_changed(pr: int, plugin: Annotated[list[str], typer.Option()], trace: TraceOption = None):
+	with trace_to(trace):
+		runner = get_runner(plugin, pr_number=pr)
+		try:
+			runner.on_pr_changed(pr)
+		finally:
+			logger.info(get_scheduler().summary())
+
+
+@app.command()
+def on_commit_to_main(plugin: Annotated[list[str], typer.Option()], trace: TraceOption = None):
+	with trace_to(trace):
+		runner = get_runner(plugin)
+		try:
+			runner.on_commit_to_main()
+		finally:
+			logger.info(get_scheduler().summary())
 
 
 @app.command()
-def on_pr_changed(pr: int, plugin: Annotated[list[str], typer.Option()]):
-	runner = get_runner(plugin, pr_number=pr)
-	runner.on_pr_changed(pr)
+def on_pr_closed(pr: int, trace: TraceOption = None) -> None:
+	"""Drop what cibot stored about a merged or closed PR."""
+	with trace_to(trace):
+		get_runner([], pr_number=pr).on_pr_closed(pr)
+
+
+@app.command()
+def batch(
+	plugin: Annotated[list[str], typer.Option()],
+	target: Annotated[
+		list[str] | None, typer.Argument(help="PRs as owner/repo#number, or numbers")
+	] = None,
+	repo: Annotated[
+		list[str] | None, typer.Option(help="Repositories of --open, GITHUB_REPO_SLUG by default")
+	] = None,
+	open_prs: Annotated[bool, typer.Option("--open", help="Add every open PR")] = False,  # noqa: FBT002 typer flag
+	label: Annotated[str | None, typer.Option(help="Only the open PRs with this label")] = None,
+	concurrency: int = 4,
+	trace: TraceOption = None,
+) -> None:
+	"""Run on_pr_changed over many PRs with shared clients and one storage commit per repo."""
+	from cibot import batch as batch_module
+
+	with trace_to(trace):
+		targets = [batch_module.parse_target(value) for value in target or []]
+		if open_prs:
+			for slug in repo or [get_github_repo().full_name]:
+				targets.extend(batch_module.open_prs(slug, label))
+		report = batch_module.Batch(plugin, concurrency).run(targets)
+		typer.echo(report.summary())
+		logger.info(get_scheduler().summary())
+	if report.failed or report.failed_commits:
+		raise typer.Exit(1)
+
+
+@app.command()
+def serve(plugin: Annotated[list[str], typer.Option()], port: int | None = None) -> None:
+	"""Run the plugins on GitHub webhook deliveries, configured by the CIBOT_SERVE_ variables."""
+	from cibot.serve import ServeSettings
+	from cibot.serve import serve as serve_webhooks
+
+	settings = ServeSettings()
+	if port is not None:
+		settings.PORT = port
+	serve_webhooks(plugin, settings)
 
 
 @app.command()
-def on_commit_to_main(plugin: Annotated[list[str], typer.Option()]):
-	runner = get_runner(plugin)
-	runner.on_commit_to_main()
+def replay(
+	payload: list[Path],
+	url: str = "http://127.0.0.1:8080",
+	event: Annotated[
+		str | None, typer.Option(help="pull_request or push, guessed by default")
+	] = None,
+	secret: Annotated[str | None, typer.Option(envvar="CIBOT_SERVE_WEBHOOK_SECRET")] = None,
+) -> None:
+	"""Post recorded webhook payloads to a running ``cibot serve``."""
+	from cibot.serve import replay as replay_payloads
+
+	replay_payloads(url, payload, event, secret)
 
 
 def main():
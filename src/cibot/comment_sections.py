@@ -0,0 +1,72 @@
+import os
+import re
+
+from loguru import logger
+
+SECTION_PATTERN = re.compile(
+	r"<!-- cibot-section (?P<name>.+?) -->\n(?P<content>.*?)\n<!-- /cibot-section (?P=name) -->",
+	re.DOTALL,
+)
+RUN_LINK_PATTERN = re.compile(r"\[(workflow run logs)\]\([^)]*\)")
+"""Link of a truncation notice, which changes with every workflow run"""
+SEPARATOR = "\n\n---\n\n"
+MARKER_RESERVE = 200
+"""Room left for the comment id marker the backend appends"""
+
+
+def parse_sections(body: str) -> dict[str, str]:
+	"""Plugin name -> section content of a consolidated comment, in order."""
+	return {match["name"]: match["content"] for match in SECTION_PATTERN.finditer(body)}
+
+
+def without_run_links(sections: dict[str, str]) -> dict[str, str]:
+	"""
+	Drop the workflow run links of truncation notices, to compare sections across runs.
+
+	An unchanged section was logged in full by the earlier run as well, so its link
+	stays valid.
+	"""
+	return {name: RUN_LINK_PATTERN.sub(r"\1", content) for name, content in sections.items()}
+
+
+def _render_section(name: str, content: str) -> str:
+	return f"<!-- cibot-section {name} -->\n{content}\n<!-- /cibot-section {name} -->"
+
+
+def _workflow_run_url() -> str | None:
+	if (run_id := os.getenv("GITHUB_RUN_ID")) and (repo := os.getenv("GITHUB_REPOSITORY")):
+		server = os.getenv("GITHUB_SERVER_URL", "https://github.com")
+		return f"{server}/{repo}/actions/runs/{run_id}"
+	return None
+
+
+def _truncate(name: str, content: str, limit: int) -> str:
+	run_url = _workflow_run_url()
+	where = f"the [workflow run logs]({run_url})" if run_url else "the workflow run logs"
+	notice = f"\n\n_… {{}} characters of this section were cut, see {where}._"
+	keep = max(limit - len(notice.format(len(content))), 0)
+	logger.info(f"Section {name} exceeds the comment size limit, full content:\n{content}")
+	return content[:keep] + notice.format(len(content) - keep)
+
+
+def render_sections(sections: dict[str, str], max_chars: int) -> str:
+	"""
+	Join the sections into one comment body of at most ``max_chars`` characters.
+
+	Sections share the space fairly, the smallest first, so only the sections
+	exceeding their share are truncated.
+	"""
+	overhead = sum(len(_render_section(name, "")) for name in sections)
+	overhead += len(SEPARATOR) * max(len(sections) - 1, 0) + MARKER_RESERVE
+	available = max_chars - overhead
+	limits: dict[str, int] = {}
+	for index, (name, content) in enumerate(sorted(sections.items(), key=lambda s: len(s[1]))):
+		limits[name] = min(len(content), available // (len(sections) - index))
+		available -= limits[name]
+	return SEPARATOR.join(
+		_render_section(
+			name,
+			content if len(content) <= limits[name] else _truncate(name, content, limits[name]),
+		)
+		for name, content in sections.items()
+	)
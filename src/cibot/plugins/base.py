@@ -1,6 +1,7 @@
 import enum
 from abc import ABC, abstractmethod
 from pathlib import Path
+from typing import ClassVar
 
 from cibot.backends.base import CiBotBackendBase, ReleaseInfo
 from cibot.storage_layers.base import BaseStorage
@@ -18,6 +19,9 @@ class BumpType(enum.Enum):
 
 
 class CiBotPlugin(ABC):
+	READS_CHECKOUT: ClassVar[bool] = False
+	"""``on_pr_changed`` reads the working tree, which only a CI job on the PR's head has"""
+
 	def __init__(self, backend: CiBotBackendBase, storage: BaseStorage) -> None:
 		self.backend = backend
 		self.storage = storage
@@ -42,6 +46,10 @@ class CiBotPlugin(ABC):
 	@abstractmethod
 	def supported_backends(self) -> tuple[str, ...]: ...
 
+	def depends_on(self) -> tuple[str, ...]:
+		"""Names of plugins whose hooks must finish before this plugin's hooks run."""
+		return ()
+
 	def pr_comment_id(self) -> str:
 		return f"popo kaka baba jojo {self.plugin_name()}"
 
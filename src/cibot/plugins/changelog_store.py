@@ -0,0 +1,198 @@
+import json
+import os
+import shutil
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+from typing import BinaryIO
+
+import msgspec
+from loguru import logger
+
+
+def prepend_section(path: Path, header: str, section: str) -> None:
+	"""
+	Insert ``section`` right below ``header`` at the top of ``path``.
+
+	The existing body is streamed into a temporary file behind the new section,
+	byte for byte, which then replaces ``path`` atomically.
+	"""
+	fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+	try:
+		with os.fdopen(fd, "wb") as out:
+			out.write(header.encode())
+			out.write(section.encode())
+			if path.exists():
+				with path.open("rb") as current:
+					if current.read(len(header.encode())) != header.encode():
+						current.seek(0)
+					if first := current.read(1):
+						out.write(b"\n\n" + first)
+						shutil.copyfileobj(current, out)
+					else:
+						out.write(b"\n")
+				shutil.copymode(path, tmp)
+			else:
+				out.write(b"\n")
+			out.flush()
+			os.fsync(out.fileno())
+		Path(tmp).replace(path)
+	except BaseException:
+		Path(tmp).unlink(missing_ok=True)
+		raise
+
+
+class ChangelogRecord[T](msgspec.Struct):
+	version: str
+	release: T
+
+
+class _Version(msgspec.Struct):
+	version: str
+
+
+class _StaleIndexError(Exception):
+	"""The index points a version at a record of another version, or at no record."""
+
+
+class ChangelogStore:
+	"""
+	Append-only changelog data, one JSON line per released version.
+
+	``CHANGELOG.jsonl`` holds the records and ``CHANGELOG.index`` one
+	``version offset length`` line per record, so adding a release appends a line
+	to each and reading a version seeks straight to its record. A version released
+	twice resolves to its last record. The index is rebuilt from the records when
+	it does not cover them, e.g. after a merge touched only one of the files, or
+	when a seeked record is not the version indexed there, e.g. after git rewrote
+	the line endings of the records.
+	"""
+
+	def __init__(self, root: Path) -> None:
+		self.records_path = root / "CHANGELOG.jsonl"
+		self.index_path = root / "CHANGELOG.index"
+		self.legacy_path = root / "CHANGELOG.json"
+		self._index: dict[str, tuple[int, int]] | None = None
+
+	def paths(self) -> list[Path]:
+		return [self.records_path, self.index_path]
+
+	def versions(self) -> list[str]:
+		"""Released versions, oldest first."""
+		return list(self._load_index())
+
+	def append(self, version: str, release: msgspec.Struct | dict) -> None:
+		index = self._load_index()
+		line = msgspec.json.encode(ChangelogRecord(version=version, release=release)) + b"\n"
+		with self.records_path.open("ab") as records:
+			offset = records.tell()
+			records.write(line)
+		with self.index_path.open("a", encoding="utf-8") as index_file:
+			index_file.write(f"{version} {offset} {len(line)}\n")
+		index.pop(version, None)
+		index[version] = (offset, len(line))
+
+	def get[T](self, version: str, type_: type[T]) -> T | None:
+		if version not in self._load_index():
+			return None
+
+		def read(records: BinaryIO, index: dict[str, tuple[int, int]]) -> T | None:
+			if (entry := index.get(version)) is None:
+				return None
+			return self._read(records, version, entry, type_)
+
+		return self._seeking(read)
+
+	def between[T](self, start: str | None, end: str | None, type_: type[T]) -> dict[str, T]:
+		"""Releases after ``start`` up to and including ``end``, in release order."""
+
+		def read(records: BinaryIO, index: dict[str, tuple[int, int]]) -> dict[str, T]:
+			versions = list(index)
+			first = versions.index(start) + 1 if start in index else 0
+			last = versions.index(end) + 1 if end in index else len(versions)
+			return {
+				version: self._read(records, version, index[version], type_)
+				for version in versions[first:last]
+			}
+
+		if not self.records_path.exists():
+			return {}
+		return self._seeking(read)
+
+	def migrate(self) -> bool:
+		"""Move the releases of a legacy ``CHANGELOG.json`` over, True if there was one."""
+		if not self.legacy_path.exists():
+			return False
+		legacy = json.loads(self.legacy_path.read_text(encoding="utf-8"))
+		known = set(self._load_index())
+		for version, release in legacy.items():
+			if version not in known:
+				self.append(version, release)
+		self.legacy_path.unlink()
+		logger.info(
+			f"Migrated {len(legacy)} releases from {self.legacy_path} to {self.records_path}"
+		)
+		return True
+
+	def _seeking[R](self, read: Callable[[BinaryIO, dict[str, tuple[int, int]]], R]) -> R:
+		"""Run ``read`` over the records, rebuilding the index once if it is stale."""
+		index = self._load_index()
+		try:
+			with self.records_path.open("rb") as records:
+				return read(records, index)
+		except _StaleIndexError as e:
+			logger.warning(f"{self.index_path} is out of date: {e}")
+		self._index = self._rebuild_index()
+		with self.records_path.open("rb") as records:
+			return read(records, self._index)
+
+	@staticmethod
+	def _read[T](records: BinaryIO, version: str, entry: tuple[int, int], type_: type[T]) -> T:
+		offset, length = entry
+		records.seek(offset)
+		try:
+			record = msgspec.json.decode(records.read(length), type=ChangelogRecord[msgspec.Raw])
+		except msgspec.DecodeError:
+			record = None
+		if record is None or record.version != version:
+			msg = f"no record of {version} at offset {offset}"
+			raise _StaleIndexError(msg)
+		return msgspec.json.decode(record.release, type=type_)
+
+	def _load_index(self) -> dict[str, tuple[int, int]]:
+		if self._index is not None:
+			return self._index
+		size = self.records_path.stat().st_size if self.records_path.exists() else 0
+		index: dict[str, tuple[int, int]] = {}
+		end = 0
+		if self.index_path.exists():
+			for line in self.index_path.read_text(encoding="utf-8").splitlines():
+				version, offset, length = line.rsplit(" ", 2)
+				index.pop(version, None)
+				index[version] = (int(offset), int(length))
+				end = max(end, int(offset) + int(length))
+		if end != size:
+			index = self._rebuild_index()
+		self._index = index
+		return index
+
+	def _rebuild_index(self) -> dict[str, tuple[int, int]]:
+		logger.info(f"Rebuilding {self.index_path}")
+		index: dict[str, tuple[int, int]] = {}
+		lines: list[str] = []
+		offset = 0
+		if self.records_path.exists():
+			with self.records_path.open("rb") as records:
+				for number, line in enumerate(records, 1):
+					try:
+						version = msgspec.json.decode(line, type=_Version).version
+					except msgspec.DecodeError as e:
+						logger.warning(f"Skipping line {number} of {self.records_path}: {e}")
+						offset += len(line)
+						continue
+					index.pop(version, None)
+					index[version] = (offset, len(line))
+					lines.append(f"{version} {offset} {len(line)}\n")
+					offset += len(line)
+		self.index_path.write_text("".join(lines), encoding="utf-8")
+		return index
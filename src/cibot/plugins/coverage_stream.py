@@ -0,0 +1,155 @@
+import xml.etree.ElementTree as ET
+from collections.abc import Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from diff_cover.diff_reporter import GitDiffReporter
+from diff_cover.git_diff import GitDiffTool
+from diff_cover.git_path import GitPathTool
+from loguru import logger
+
+if TYPE_CHECKING:
+	from cibot.plugins.diffcov import FileStats, Report
+
+# line number -> hit count
+type LineHits = dict[int, int]
+
+
+def _relative_to_cwd(path: str) -> str:
+	candidate = Path(path)
+	if candidate.is_absolute():
+		try:
+			candidate = candidate.relative_to(Path.cwd())
+		except ValueError:
+			return candidate.as_posix()
+	return candidate.as_posix()
+
+
+def _resolve(filename: str, sources: list[str], changed: set[str]) -> str | None:
+	"""Map a report path onto a changed file, trying each ``<source>`` root."""
+	for source in [*sources, ""]:
+		candidate = _relative_to_cwd(str(Path(source) / filename) if source else filename)
+		if candidate in changed:
+			return candidate
+	return None
+
+
+def _record_line(elem: ET.Element, hits: LineHits) -> None:
+	"""Keep the highest hit count of a line listed by several ``<class>`` blocks."""
+	number = int(elem.get("number", 0))
+	hits[number] = max(hits.get(number, 0), int(elem.get("hits", 0)))
+
+
+def stream_cobertura(path: Path, changed: set[str]) -> Iterator[tuple[str, LineHits]]:
+	sources: list[str] = []
+	current: str | None = None
+	hits: LineHits = {}
+	for event, elem in ET.iterparse(path, events=("start", "end")):  # noqa: S314
+		match event, elem.tag:
+			case "start", "class":
+				current = _resolve(elem.get("filename", ""), sources, changed)
+				hits = {}
+			case "end", "source" if elem.text:
+				sources.append(elem.text.strip())
+			case "end", "line":
+				if current is not None:
+					_record_line(elem, hits)
+				elem.clear()
+			case "end", "class":
+				if current is not None:
+					yield current, hits
+				current = None
+				elem.clear()
+			case "end", "package":
+				elem.clear()
+
+
+def stream_lcov(path: Path, changed: set[str]) -> Iterator[tuple[str, LineHits]]:
+	current: str | None = None
+	hits: LineHits = {}
+	with path.open(encoding="utf-8") as f:
+		for raw in f:
+			line = raw.strip()
+			if line.startswith("SF:"):
+				current = _resolve(line[3:], [], changed)
+				hits = {}
+			elif current is None:
+				continue
+			elif line.startswith("DA:"):
+				number, count, *_ = line[3:].split(",")
+				hits[int(number)] = hits.get(int(number), 0) + int(count)
+			elif line == "end_of_record":
+				yield current, hits
+				current = None
+
+
+def merge_coverage(cov_files: list[Path], changed: set[str]) -> dict[str, LineHits]:
+	"""Union the line hits of every report, a line is covered if any shard hit it."""
+	merged: dict[str, LineHits] = {}
+	for cov_file in cov_files:
+		stream = stream_cobertura if cov_file.suffix == ".xml" else stream_lcov
+		for file, hits in stream(cov_file, changed):
+			target = merged.setdefault(file, {})
+			for number, count in hits.items():
+				target[number] = target.get(number, 0) + count
+	return merged
+
+
+def build_report(
+	lines_changed: dict[str, list[int]],
+	coverage: dict[str, LineHits],
+	report_name: str,
+	diff_name: str,
+) -> "Report":
+	"""Compute the same statistics as diff-cover's JSON report."""
+	src_stats: dict[str, FileStats] = {}
+	for file, changed in lines_changed.items():
+		hits = coverage.get(file, {})
+		measured = sorted(set(changed).intersection(hits))
+		if not measured:
+			continue
+		violations = [line for line in measured if hits[line] == 0]
+		src_stats[file] = {
+			"percent_covered": 100 - float(len(violations)) / len(measured) * 100,
+			"violation_lines": violations,
+			"covered_lines": [line for line in measured if hits[line] > 0],
+		}
+	total_num_lines = sum(
+		len(s["violation_lines"]) + len(s["covered_lines"]) for s in src_stats.values()
+	)
+	total_num_violations = sum(len(s["violation_lines"]) for s in src_stats.values())
+	return {
+		"report_name": report_name,
+		"diff_name": diff_name,
+		"src_stats": src_stats,
+		"total_num_lines": total_num_lines,
+		"total_num_violations": total_num_violations,
+		"total_percent_covered": (
+			int((total_num_lines - total_num_violations) / total_num_lines * 100)
+			if total_num_lines
+			else 100
+		),
+		"num_changed_lines": sum(len(lines) for lines in lines_changed.values()),
+	}
+
+
+def create_streamed_report(cov_files: list[Path], compare_branch: str) -> "Report":
+	"""
+	Build the diff coverage report from streamed Cobertura XML and LCOV reports.
+
+	Only blocks of files changed against ``compare_branch`` are kept and line hits of
+	all shards are unioned, so memory depends on the diff rather than the reports.
+	"""
+	GitPathTool.set_cwd(Path.cwd())
+	diff = GitDiffReporter(
+		compare_branch, git_diff=GitDiffTool(range_notation="...", ignore_whitespace=False)
+	)
+	lines_changed = {
+		_relative_to_cwd(src): diff.lines_changed(src) for src in diff.src_paths_changed()
+	}
+	coverage = merge_coverage(cov_files, set(lines_changed))
+	logger.info(
+		f"Loaded coverage of {len(coverage)} of {len(lines_changed)} changed files "
+		f"from {len(cov_files)} reports"
+	)
+	return build_report(lines_changed, coverage, "Cobertura/LCOV", diff.name())
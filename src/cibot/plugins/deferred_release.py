@@ -1,10 +1,10 @@
 import datetime
 import enum
-import json
-import textwrap
+import os
 from collections import defaultdict
+from functools import cache, cached_property
 from pathlib import Path
-from typing import override
+from typing import TYPE_CHECKING, override
 
 import msgspec
 from loguru import logger
@@ -12,6 +12,10 @@ from pydantic_settings import BaseSettings
 
 from cibot.backends.base import ERROR_GIF, PrDescription, ReleaseInfo
 from cibot.plugins.base import BumpType, CiBotPlugin
+from cibot.plugins.changelog_store import ChangelogStore, prepend_section
+
+if TYPE_CHECKING:
+	import jinja2
 
 
 class ChangeType(enum.Enum):
@@ -32,11 +36,18 @@ class ReleasePrDesc(PrDescription):
 
 
 class ReleaseNoteBucket(msgspec.Struct):
+	"""Pending change notes as a single key, only read for changes merged before per-PR keys."""
+
 	notes: dict[int, ChangeNote]
 
 
 class PendingRelease(ReleasePrDesc):
 	version: str
+	notes: str = ""
+	"""Release notes rendered when the release was prepared"""
+
+
+CHANGELOG_HEADER = "CHANGELOG\n=========\n"
 
 
 class DefferedReleaseSettings(BaseSettings):
@@ -44,6 +55,27 @@ class DefferedReleaseSettings(BaseSettings):
 		"env_prefix": "DEFERRED_RELEASE_",
 	}
 	PROJECT_NAME: str = ""
+	RELEASE_NOTES_TEMPLATE: Path | None = None
+	"""
+	Jinja template replacing ``templates/release_notes.jinja.md``, rendered with
+	``release``, ``version``, ``changes_by_type``, ``server_url`` and ``repo_url``
+	"""
+
+
+@cache
+def release_notes_template(path: Path | None = None) -> "jinja2.Template":
+	"""Compile the release notes template at ``path``, the bundled one by default."""
+	import jinja2
+
+	if path is None:
+		path = Path(__file__).parent / "templates" / "release_notes.jinja.md"
+	template_env = jinja2.Environment(
+		loader=jinja2.FileSystemLoader(path.parent),
+		autoescape=jinja2.select_autoescape(),
+		trim_blocks=True,
+		keep_trailing_newline=True,
+	)
+	return template_env.get_template(path.name)
 
 
 class DeferredReleasePlugin(CiBotPlugin):
@@ -77,6 +109,8 @@ class DeferredReleasePlugin(CiBotPlugin):
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
 		self._release_desc: ReleasePrDesc | None = None
+		self.settings = DefferedReleaseSettings()
+		self._rendered_notes: dict[tuple[int, str | None], str] = {}
 
 	@override
 	def plugin_name(self) -> str:
@@ -97,40 +131,32 @@ Description:
 {note.description}
 """
 			case ReleasePrDesc():
+				# rendered on demand, with the version once the release is prepared
 				self._release_desc = note
-				self._pr_comment = self._get_release_repr(note)
 				return note.release_type
 
+	@override
+	def provide_comment_for_pr(self) -> tuple[str, str] | None:
+		if self._release_desc and self._pr_comment is None:
+			self._pr_comment = self._release_notes(self._release_desc)
+		return super().provide_comment_for_pr()
+
 	@override
 	def prepare_release(self, release_type: BumpType, next_version: str) -> list[Path]:
 		changelog_readable = Path.cwd() / "CHANGELOG.md"
-		changelog_json = Path.cwd() / "CHANGELOG.json"
-		if not changelog_json.exists():
-			changelog_json.write_text("{}", encoding="utf-8")
-		if not changelog_readable.exists():
-			changelog_readable.write_text("", encoding="utf-8")
-
-		def update_change_log(current_changes: str, version: str) -> None:
-			main_header = "CHANGELOG\n=========\n"
-
-			this_header = textwrap.dedent(
-				f"""{version} - {datetime.datetime.now(tz=datetime.UTC).date().isoformat()}\n--------------------\n""",
-			)
-			previous = changelog_readable.read_text(encoding="utf-8").strip(main_header)
-			changelog_readable.write_text(
-				textwrap.dedent(
-					f"{main_header}{this_header}{current_changes}\n\n{previous}\n",
-				),
-				encoding="utf-8",
-			)
+		changelog_data = ChangelogStore(Path.cwd())
 
 		if self._release_desc:
-			update_change_log(
-				self._get_release_repr(self._release_desc, next_version), next_version
+			notes = self._pr_comment = self._release_notes(self._release_desc, next_version)
+			today = datetime.datetime.now(tz=datetime.UTC).date().isoformat()
+			prepend_section(
+				changelog_readable,
+				CHANGELOG_HEADER,
+				f"{next_version} - {today}\n--------------------\n{notes}",
 			)
-			existing_changes_json = json.loads(changelog_json.read_text(encoding="utf-8"))
-			existing_changes_json[next_version] = msgspec.to_builtins(self._release_desc)
-			changelog_json.write_text(json.dumps(existing_changes_json, indent=2), encoding="utf-8")
+			# the deleted legacy file is staged along with the migrated records
+			migrated = [changelog_data.legacy_path] if changelog_data.migrate() else []
+			changelog_data.append(next_version, self._release_desc)
 			pr = self._release_desc.pr_number
 			self.storage.set(
 				f"{self.plugin_name()}-pending-release-{pr}",
@@ -142,48 +168,45 @@ Description:
 					description=self._release_desc.description,
 					header=self._release_desc.header,
 					pr_number=pr,
+					notes=notes,
 				),
 			)
-			return [changelog_readable, changelog_json]
+			return [changelog_readable, *changelog_data.paths(), *migrated]
 		return []
 
 	@override
 	def on_commit_to_main(self, commit_hash: str) -> None | ReleaseInfo:
 		pr = self.backend.get_commit_associated_pr(commit_hash)
-		pending_changes_key = f"{self.plugin_name()}-pending-changes"
 		match res := self._parse_pr(pr.pr_number):
 			case ChangeNote():
-				if current_bucket := self.storage.get(pending_changes_key, ReleaseNoteBucket):
-					current_bucket.notes[pr.pr_number] = res
 				logger.info(f"Adding change note to pending changes: {res}")
-				self.storage.set(
-					pending_changes_key,
-					current_bucket or ReleaseNoteBucket(notes={pr.pr_number: res}),
-				)
+				self.storage.set(f"{self._pending_change_prefix}{pr.pr_number}", res)
 
 			case ReleasePrDesc():
-				settings = DefferedReleaseSettings()
-				# wipe pending changes
-				self.storage.delete(pending_changes_key)
-				res = self.storage.get(
-					f"{self.plugin_name()}-pending-release-{pr.pr_number}", PendingRelease
-				)
-				self.storage.delete(f"{self.plugin_name()}-pending-release-{pr.pr_number}")
+				release_key = f"{self.plugin_name()}-pending-release-{pr.pr_number}"
+				res = self.storage.get(release_key, PendingRelease)
 				assert res, f"Pending release not found for PR {pr.pr_number}"
+				# drop only the notes that went into the changelog, PRs merged since the
+				# release was prepared stay pending for the next one; nothing writes the
+				# legacy key anymore so all of its notes were released
+				self.storage.delete(self._legacy_pending_changes_key)
+				for number in res.changes:
+					self.storage.delete(f"{self._pending_change_prefix}{number}")
+				self.storage.delete(release_key)
 				return ReleaseInfo(
 					version=res.version,
-					note=self._get_release_repr(res),
-					header=f"{settings.PROJECT_NAME} {res.version}",
+					note=res.notes or self._release_notes(res, res.version),
+					header=f"{self.settings.PROJECT_NAME} {res.version}",
 				)
 
 	def _parse_pr(self, pr_id: int) -> ChangeNote | ReleasePrDesc | None:
-		pr_description = self.backend.get_pr_description(pr_id)
-		if release := self._get_release_desc_for_pr(pr_description):
+		context = self.backend.get_pr_context(pr_id)
+		pr_description = context.description()
+		labels = context.labels
+		if release := self._get_release_desc_for_pr(pr_description, labels):
 			logger.info(f"prased pr as a release pr: {release}")
 			return release
 
-		labels = self.backend.get_pr_labels(pr_id)
-
 		def find_change_type(label: str) -> ChangeType | None:
 			for change_type in ChangeType:
 				if change_type.value.lower() == label.lower():
@@ -211,7 +234,9 @@ Description:
 		self._pr_comment = f"Couldn't parse PR\n {ERROR_GIF} \n {self.__doc__}"
 		self._should_fail_work_flow = True
 
-	def _get_release_desc_for_pr(self, pr_description: PrDescription) -> ReleasePrDesc | None:
+	def _get_release_desc_for_pr(
+		self, pr_description: PrDescription, labels: list[str]
+	) -> ReleasePrDesc | None:
 		def find_release_type(label: str) -> BumpType | None:
 			lower = label.lower()
 			if "release" not in lower:
@@ -221,7 +246,6 @@ Description:
 					return release_type
 			return None
 
-		labels = self.backend.get_pr_labels(pr_description.pr_number)
 		release_type = None
 		logger.info(f"searching for a release label in: {labels}")
 		for label in labels:
@@ -234,7 +258,7 @@ Description:
 
 		logger.info(f"Found release label: {release_type}")
 		logger.info("Checking for pending changes")
-		if changes := self.storage.get(f"{self.plugin_name()}-pending-changes", ReleaseNoteBucket):
+		if changes := self._pending_changes():
 			logger.info(f"Found pending changes: {changes}")
 			return ReleasePrDesc(
 				contributor=pr_description.contributor,
@@ -242,34 +266,49 @@ Description:
 				description=self._parse_pr_description(pr_description.description),
 				pr_number=pr_description.pr_number,
 				release_type=release_type,
-				changes=changes.notes,
+				changes=changes,
 			)
 
-	def _get_release_repr(self, release: ReleasePrDesc, version: str | None = None) -> str:
-		def repr_change_note_suffix(change_note: ChangeNote) -> str:
-			from cibot.backends.github_backend import GithubSettings
-
-			settings = GithubSettings()
-			return (
-				f"Contributed by [{change_note.contributor.pr_author_fullname or change_note.contributor.pr_author_fullname}]"
-				f"(https://github.com/{change_note.contributor.pr_author_fullname}) via [PR #{change_note.pr_number}]"
-				f"(https://github.com/{settings.REPO_SLUG}/pull/{change_note.pr_number}/)"
+	@property
+	def _pending_change_prefix(self) -> str:
+		return f"{self.plugin_name()}-pending-change-"
+
+	@property
+	def _legacy_pending_changes_key(self) -> str:
+		return f"{self.plugin_name()}-pending-changes"
+
+	def _pending_changes(self) -> dict[int, ChangeNote]:
+		"""Change notes merged since the last release, each stored under its own key."""
+		changes = {}
+		if legacy := self.storage.get(self._legacy_pending_changes_key, ReleaseNoteBucket):
+			changes.update(legacy.notes)
+		prefix = self._pending_change_prefix
+		for key, note in self.storage.items(prefix, ChangeNote).items():
+			changes[int(key.removeprefix(prefix))] = note
+		return dict(sorted(changes.items()))
+
+	def _release_notes(self, release: ReleasePrDesc, version: str | None = None) -> str:
+		"""Render the release notes, once per release and version."""
+		key = (release.pr_number, version)
+		if (notes := self._rendered_notes.get(key)) is None:
+			changes_by_type: dict[ChangeType, list[ChangeNote]] = defaultdict(list)
+			for change in release.changes.values():
+				changes_by_type[change.change_type].append(change)
+			template = release_notes_template(self.settings.RELEASE_NOTES_TEMPLATE)
+			notes = self._rendered_notes[key] = template.render(
+				release=release,
+				version=version or release.release_type.value,
+				changes_by_type=changes_by_type,
+				**self._links,
 			)
+		return notes
 
-		changelogs_by_type: dict[ChangeType, list[ChangeNote]] = defaultdict(list)
-		for change in release.changes.values():
-			changelogs_by_type[change.change_type].append(change)
-
-		comment = f"### Release: {version or release.release_type.value}\n"
-		comment += f"#### {release.header}\n"
-		comment += f"{release.description}\n"
-		comment += "#### Changes\n"
-		for change_type, changes in changelogs_by_type.items():
-			comment += f"##### {change_type.value}(es)\n"
-			for change in changes:
-				comment += f"- **{change.header}** - {change.description}\n {repr_change_note_suffix(change)}\n"
+	@cached_property
+	def _links(self) -> dict[str, str]:
+		from cibot.backends.github_backend import GithubSettings
 
-		return comment
+		server_url = os.getenv("GITHUB_SERVER_URL", "https://github.com")
+		return {"server_url": server_url, "repo_url": f"{server_url}/{GithubSettings().REPO_SLUG}"}
 
 	def _parse_pr_description(self, pr_description: str) -> str:
-		return pr_description.split("___")[0].strip()
+		return pr_description.split("___", maxsplit=1)[0].strip()
@@ -1,34 +1,49 @@
-import json
-import subprocess
+import fnmatch
+import hashlib
+import os
+import time
+import xml.etree.ElementTree as ET
 from dataclasses import dataclass
+from functools import cache
 from io import BytesIO
 from pathlib import Path
-from typing import TypedDict, override
-
-import jinja2
-from diff_cover.diff_reporter import GitDiffReporter
-from diff_cover.report_generator import MarkdownReportGenerator
-from diff_cover.violationsreporters.violations_reporter import (
-	XmlCoverageReporter,
-)
+from typing import TYPE_CHECKING, TypedDict, cast, override
+
+import msgspec
 from loguru import logger
 from pydantic_settings import BaseSettings
 
 from cibot.backends.base import PrReviewComment
 from cibot.plugins.base import BumpType, CiBotPlugin
+from cibot.plugins.result_cache import DirResultCache, ResultCache, StorageResultCache
+from cibot.storage_layers.sqlite import SqliteStorage
+from cibot.tracing import run_process, span
+
+# diff_cover and jinja2 are only imported once a report has to be built, a cached
+# report or a run without this plugin never pays for them
+if TYPE_CHECKING:
+	import jinja2
+	from diff_cover.diff_reporter import GitDiffReporter
+	from diff_cover.violationsreporters.violations_reporter import XmlCoverageReporter
 
-template_env = jinja2.Environment(
-	loader=jinja2.FileSystemLoader(Path(__file__).parent / "templates"),
-	autoescape=jinja2.select_autoescape(),
-)
 
-COVERAGE_TEMPLATE = template_env.get_template("coverage.jinja.md")
+@cache
+def coverage_template() -> "jinja2.Template":
+	import jinja2
+
+	template_env = jinja2.Environment(
+		loader=jinja2.FileSystemLoader(Path(__file__).parent / "templates"),
+		autoescape=jinja2.select_autoescape(),
+	)
+	return template_env.get_template("coverage.jinja.md")
 
 
 def _generate_section_report(
-	reporter: XmlCoverageReporter, git_diff_reporter: GitDiffReporter, compare_branch: str
+	reporter: "XmlCoverageReporter", git_diff_reporter: "GitDiffReporter", compare_branch: str
 ) -> str:
 	"""Generate report for a single section."""
+	from diff_cover.report_generator import MarkdownReportGenerator
+
 	with BytesIO() as buffer:
 		markdown_gen = MarkdownReportGenerator(reporter, git_diff_reporter)
 		markdown_gen.generate_report(buffer)
@@ -44,9 +59,138 @@ class DiffCovSettings(BaseSettings):
 	}
 	COMPARE_BRANCH: str = "main"
 	FAIL_UNDER: float = 100.0
+	SEARCH_ROOTS: list[Path] = [Path()]
+	COVERAGE_PATTERNS: list[str] = ["coverage.xml", "lcov.info"]
+	MAX_DEPTH: int | None = None
+	"""How many directory levels below a search root to search, unlimited by default"""
+	STREAMING: bool = True
+	"""Use the streaming ingestion instead of diff-cover's DOM based reporters"""
+	RESPECT_GITIGNORE: bool = False
+	"""
+	Don't descend into gitignored directories, matching files are found even if ignored.
+
+	Off by default: reports usually live in an ignored directory, like ``coverage/``.
+	"""
+	EXCLUDE_DIRS: list[str] = [
+		".git",
+		".venv",
+		"venv",
+		"node_modules",
+		"__pycache__",
+		".tox",
+		".nox",
+		".mypy_cache",
+		".pytest_cache",
+		".ruff_cache",
+	]
+	CACHE: str = "dir"
+	"""
+	Where to cache reports between runs: ``dir``, ``storage`` or ``none``.
+
+	``storage`` only works with the sqlite storage, the GitHub issue storages
+	would spend API mutations on every report.
+	"""
+	CACHE_DIR: Path = Path.home() / ".cache" / "cibot" / "diffcov"
+	CACHE_MAX_ENTRIES: int = 32
+	CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+
+
+def _git_output(*args: str) -> bytes | None:
+	result = run_process(["git", *args], check=False, capture_output=True)
+	return result.stdout if result.returncode == 0 else None
+
+
+def report_cache_key(cov_files: list[Path], settings: DiffCovSettings) -> str | None:
+	"""
+	Hash everything the report depends on.
+
+	That is the head and merge-base commits, uncommitted changes, the coverage
+	inputs and the settings. Coverage files are keyed by their path relative to
+	the checkout, so the key survives moving it. Returns None outside of a git checkout.
+	"""
+	head = _git_output("rev-parse", "HEAD")
+	base = _git_output("merge-base", "HEAD", settings.COMPARE_BRANCH)
+	uncommitted = _git_output("diff", "HEAD")
+	if head is None or base is None or uncommitted is None:
+		return None
+	digest = hashlib.sha256()
+	for part in (head, base, uncommitted):
+		digest.update(hashlib.sha256(part).digest())
+	digest.update(settings.model_dump_json(exclude={"CACHE", "CACHE_DIR", "SEARCH_ROOTS"}).encode())
+	checkout = Path.cwd().resolve()
+	for cov_file in cov_files:
+		path = cov_file.resolve()
+		if path.is_relative_to(checkout):
+			path = path.relative_to(checkout)
+		digest.update(path.as_posix().encode())
+		with cov_file.open("rb") as f:
+			digest.update(hashlib.file_digest(f, "sha256").digest())
+	return digest.hexdigest()
+
+
+def _gitignored_dirs() -> set[Path]:
+	result = run_process(
+		["git", "ls-files", "--others", "--ignored", "--exclude-standard", "--directory", "-z"],
+		check=False,
+		capture_output=True,
+	)
+	if result.returncode != 0:
+		return set()
+	return {
+		(Path.cwd() / entry).resolve()
+		for entry in result.stdout.decode().split("\0")
+		if entry.endswith("/")
+	}
+
+
+def discover_coverage_files(settings: DiffCovSettings) -> list[Path]:
+	"""
+	Find coverage reports in a single bounded walk over ``SEARCH_ROOTS``.
+
+	Excluded and (optionally) gitignored directories are never entered. With
+	``MAX_DEPTH`` set the walk stops that many levels below each root, the
+	directories it did not enter are logged.
+	"""
+	started = time.perf_counter()
+	ignored = _gitignored_dirs() if settings.RESPECT_GITIGNORE else set()
+	excluded = set(settings.EXCLUDE_DIRS)
+	found: set[Path] = set()
+	too_deep: list[Path] = []
+	for search_root in settings.SEARCH_ROOTS:
+		root = search_root.resolve()
+		root_depth = len(root.parts)
+		for dirpath, dirnames, filenames in os.walk(root):
+			current = Path(dirpath)
+			dirnames[:] = [
+				name
+				for name in dirnames
+				if name not in excluded and (current / name) not in ignored
+			]
+			if (
+				settings.MAX_DEPTH is not None
+				and len(current.parts) - root_depth >= settings.MAX_DEPTH
+			):
+				too_deep.extend(current / name for name in dirnames)
+				dirnames.clear()
+			found.update(
+				current / name
+				for name in filenames
+				if any(fnmatch.fnmatch(name, pattern) for pattern in settings.COVERAGE_PATTERNS)
+			)
+	if too_deep:
+		logger.warning(
+			f"Not searching {len(too_deep)} directories below DIFF_COV_MAX_DEPTH="
+			f"{settings.MAX_DEPTH}, coverage files in them are skipped: "
+			+ ", ".join(str(path) for path in too_deep[:10])
+		)
+	elapsed_ms = (time.perf_counter() - started) * 1000
+	logger.info(f"Discovered {len(found)} coverage files in {elapsed_ms:.1f}ms")
+	return sorted(found)
 
 
 class DiffCovPlugin(CiBotPlugin):
+	READS_CHECKOUT = True
+
 	@override
 	def plugin_name(self) -> str:
 		return "Diff Coverage"
@@ -62,19 +206,16 @@ class DiffCovPlugin(CiBotPlugin):
 	@override
 	def on_pr_changed(self, pr: int) -> BumpType | None:
 		settings = self.settings
-		cov_files = list(Path.cwd().rglob("coverage.xml"))
-		cov_files.extend(list(Path.cwd().rglob("lcov.info")))
+		cov_files = discover_coverage_files(settings)
 
 		if not cov_files:
 			logger.error("No coverage files found")
-			self._pr_comment = (
-				f"{self._pr_comment or ''}\n#### 🔴 No coverage files found"
-			)
+			self._pr_comment = f"{self._pr_comment or ''}\n#### 🔴 No coverage files found"
 			self._should_fail_work_flow = True
 			return None
 
 		grouped_lines_per_file: dict[str, list[tuple[int, int | None]]] = {}
-		report = create_report_for_cov_files(cov_files, settings.COMPARE_BRANCH)
+		report = self._get_report(cov_files, settings)
 		logger.info(f"Processing combined coverage report\n report is {report}")
 		for file, stats in report["src_stats"].items():
 			grouped_lines_per_file[file] = self._group_violations(stats["violation_lines"])
@@ -88,30 +229,88 @@ class DiffCovPlugin(CiBotPlugin):
 			)
 			self._should_fail_work_flow = True
 
-		valid_comments: list[tuple[PrReviewComment, tuple[int, int | None]]] = []
-		for id_, comment in self.backend.get_review_comments_for_content_id(
-			DIFF_COV_REVIEW_COMMENT_ID
+		self._reconcile_review_comments(pr, grouped_lines_per_file)
+
+		if not self._should_fail_work_flow:
+			self._pr_comment = "### ✅ Coverage passed"
+
+	def _result_cache(self, settings: DiffCovSettings) -> ResultCache | None:
+		match settings.CACHE:
+			case "dir":
+				return DirResultCache(
+					settings.CACHE_DIR, settings.CACHE_MAX_ENTRIES, settings.CACHE_MAX_BYTES
+				)
+			case "storage":
+				if not isinstance(self.storage, SqliteStorage):
+					logger.warning(
+						"DIFF_COV_CACHE=storage needs the sqlite storage, not caching the report"
+					)
+					return None
+				return StorageResultCache(
+					self.storage, f"{self.plugin_name()}-cache", settings.CACHE_MAX_ENTRIES
+				)
+			case "none":
+				return None
+			case _:
+				msg = f"Unknown cache {settings.CACHE}"
+				raise ValueError(msg)
+
+	def _get_report(self, cov_files: list[Path], settings: DiffCovSettings) -> "Report":
+		cache = self._result_cache(settings)
+		key = report_cache_key(cov_files, settings) if cache else None
+		if cache and key and (cached := cache.get(key, CachedReport)):
+			logger.info(f"Using cached diff coverage report {key}")
+			return cached.report
+
+		from cibot.plugins.coverage_stream import create_streamed_report
+
+		create_report = (
+			create_streamed_report if settings.STREAMING else create_report_for_cov_files
+		)
+		with span(
+			"coverage-report", "report", cov_files=len(cov_files), streaming=settings.STREAMING
 		):
-			# for now we'll recreate all comments on every run due to complexity management
-			self.backend.delete_pr_review_comment(id_)
+			report = create_report(cov_files, settings.COMPARE_BRANCH)
+		if cache and key:
+			cache.set(key, CachedReport(report=report))
+		return report
+
+	def _reconcile_review_comments(
+		self, pr: int, grouped_lines_per_file: dict[str, list[tuple[int, int | None]]]
+	) -> None:
+		"""
+		Sync the violation review comments with the current report.
 
+		Comments are keyed by ``(file, start_line, end_line)``; only stale comments are
+		deleted and only missing ones are created, so an unchanged report costs no writes.
+		"""
+		desired: dict[tuple[str, int | None, int], PrReviewComment] = {}
 		for file, violations in grouped_lines_per_file.items():
-			for violation in violations:
-				start_line, end_line = violation
-				self.backend.create_pr_review_comment(
-					PrReviewComment(
-						content=f"⛔ Missing coverage from line {start_line} to line {end_line}"  # noqa: ISC003
-						+ "\n<sup>**Don't comment here, it will be deleted**</sup>",
-						content_id=DIFF_COV_REVIEW_COMMENT_ID,
-						start_line=start_line if end_line != start_line else None,
-						end_line=end_line or start_line,
-						file=file,
-						pr_number=pr,
-					)
+			for start_line, end_line in violations:
+				comment = PrReviewComment(
+					content=f"⛔ Missing coverage from line {start_line} to line {end_line}"  # noqa: ISC003
+					+ "\n<sup>**Don't comment here, it will be deleted**</sup>",
+					content_id=DIFF_COV_REVIEW_COMMENT_ID,
+					start_line=start_line if end_line != start_line else None,
+					end_line=end_line or start_line,
+					file=file,
+					pr_number=pr,
 				)
+				desired[(comment.file, comment.start_line, comment.end_line)] = comment
 
-		if not self._should_fail_work_flow:
-			self._pr_comment = "### ✅ Coverage passed"
+		stale: list[int] = []
+		for id_, comment in self.backend.get_review_comments_for_content_id(
+			DIFF_COV_REVIEW_COMMENT_ID
+		):
+			key = (comment.file, comment.start_line, comment.end_line)
+			# a popped key is kept, duplicates and outdated comments are stale
+			if comment.outdated or desired.pop(key, None) is None:
+				stale.append(id_)
+
+		logger.info(f"Deleting {len(stale)} stale and creating {len(desired)} new review comments")
+		self.backend.delete_pr_review_comments(stale)
+		if desired:
+			self.backend.create_pr_review_comments(list(desired.values()))
 
 	def _group_violations(self, violation_lines: list[int]) -> list[tuple[int, int | None]]:
 		"""
@@ -157,15 +356,40 @@ class Report(TypedDict):
 	num_changed_lines: int
 
 
-
 def create_report_for_cov_files(cov_files: list[Path], compare_branch: str) -> Report:
-	cov_args = " ".join(str(f) for f in cov_files)
-	cmd = f"diff-cover {cov_args} --compare-branch={compare_branch} --format=json:report.json"
-	logger.info(f"Running command: {cmd}")
-	subprocess.run(cmd, shell=True, check=True)  # noqa: S602
-
-	report: Report = json.loads((Path.cwd() / "report.json").read_text())
-	return report
+	"""Build the diff coverage report in-process through the diff_cover library."""
+	from diff_cover.diff_reporter import GitDiffReporter
+	from diff_cover.git_diff import GitDiffTool
+	from diff_cover.git_path import GitPathTool
+	from diff_cover.report_generator import JsonReportGenerator
+	from diff_cover.violationsreporters.violations_reporter import (
+		LcovCoverageReporter,
+		XmlCoverageReporter,
+	)
+
+	logger.info(f"Computing diff coverage of {cov_files} against {compare_branch}")
+	GitPathTool.set_cwd(Path.cwd())
+	diff = GitDiffReporter(
+		compare_branch, git_diff=GitDiffTool(range_notation="...", ignore_whitespace=False)
+	)
+	xml_files = [f for f in cov_files if f.suffix == ".xml"]
+	lcov_files = [f for f in cov_files if f.suffix != ".xml"]
+	if xml_files and lcov_files:
+		msg = "Mixing LCov and XML reports is not supported yet"
+		raise ValueError(msg)
+	if xml_files:
+		coverage = XmlCoverageReporter([ET.parse(f) for f in xml_files])  # noqa: S314
+	else:
+		coverage = LcovCoverageReporter([LcovCoverageReporter.parse(str(f)) for f in lcov_files])
+	report = JsonReportGenerator(coverage, diff).report_dict()
+	for stats in report["src_stats"].values():
+		# raw violation tuples are not part of ``FileStats``
+		stats.pop("violations", None)
+	return cast("Report", report)
+
+
+class CachedReport(msgspec.Struct):
+	report: Report
 
 
 @dataclass
@@ -0,0 +1,94 @@
+import os
+import tempfile
+from pathlib import Path
+from typing import Protocol
+
+import msgspec
+from loguru import logger
+
+from cibot.storage_layers.base import BaseStorage
+
+
+class ResultCache(Protocol):
+	def get[T](self, key: str, type_: type[T]) -> T | None: ...
+	def set(self, key: str, value: msgspec.Struct) -> None: ...
+
+
+class DirResultCache(ResultCache):
+	"""
+	One msgpack file per key in a local directory, e.g. one restored by ``actions/cache``.
+
+	Reads refresh the file's mtime and writes evict the least recently used entries
+	until the directory holds at most ``max_entries`` files and ``max_bytes`` bytes.
+	"""
+
+	def __init__(self, directory: Path, max_entries: int, max_bytes: int) -> None:
+		self.directory = directory
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+
+	def _path(self, key: str) -> Path:
+		return self.directory / f"{key}.msgpack"
+
+	def get[T](self, key: str, type_: type[T]) -> T | None:
+		path = self._path(key)
+		try:
+			data = path.read_bytes()
+		except FileNotFoundError:
+			return None
+		os.utime(path)
+		return msgspec.msgpack.decode(data, type=type_)
+
+	def set(self, key: str, value: msgspec.Struct) -> None:
+		self.directory.mkdir(parents=True, exist_ok=True)
+		with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as f:
+			f.write(msgspec.msgpack.encode(value))
+		Path(f.name).replace(self._path(key))
+		self._evict()
+
+	def _evict(self) -> None:
+		entries = sorted(
+			((p, p.stat()) for p in self.directory.glob("*.msgpack")),
+			key=lambda entry: entry[1].st_mtime,
+			reverse=True,
+		)
+		total = 0
+		for index, (path, stat) in enumerate(entries):
+			total += stat.st_size
+			if index >= self.max_entries or total > self.max_bytes:
+				logger.info(f"Evicting cached result {path.name}")
+				path.unlink(missing_ok=True)
+
+
+class CacheIndex(msgspec.Struct):
+	keys: list[str]
+	"""most recently used first"""
+
+
+class StorageResultCache(ResultCache):
+	"""
+	Keep cached results in the configured storage, bounded to ``max_entries`` keys.
+
+	Only meant for the sqlite storage: every ``set`` writes up to three keys.
+	"""
+
+	def __init__(self, storage: BaseStorage, prefix: str, max_entries: int) -> None:
+		self.storage = storage
+		self.prefix = prefix
+		self.max_entries = max_entries
+
+	@property
+	def _index_key(self) -> str:
+		return f"{self.prefix}-index"
+
+	def get[T](self, key: str, type_: type[T]) -> T | None:
+		return self.storage.get(f"{self.prefix}-{key}", type_)
+
+	def set(self, key: str, value: msgspec.Struct) -> None:
+		index = self.storage.get(self._index_key, CacheIndex) or CacheIndex(keys=[])
+		keys = [key, *(k for k in index.keys if k != key)]
+		for evicted in keys[self.max_entries :]:
+			logger.info(f"Evicting cached result {evicted}")
+			self.storage.delete(f"{self.prefix}-{evicted}")
+		self.storage.set(f"{self.prefix}-{key}", value)
+		self.storage.set(self._index_key, CacheIndex(keys=keys[: self.max_entries]))
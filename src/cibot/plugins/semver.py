@@ -38,6 +38,11 @@ class SemverPlugin(VersionBumpPlugin):
 	def supported_backends(self) -> tuple[str, ...]:
 		return ("*",)
 
+	@override
+	def depends_on(self) -> tuple[str, ...]:
+		# bump the version only once the changelog writers are done
+		return ("Deferred Release",)
+
 	@override
 	def next_version(self, bump_type: BumpType) -> str:
 		current_version = self._current_version_from_pyproject()
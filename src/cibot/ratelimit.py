@@ -0,0 +1,300 @@
+import asyncio
+import random
+import threading
+import time
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, override
+
+import httpx
+from github import GithubException
+from loguru import logger
+from pydantic_settings import BaseSettings
+
+from cibot.tracing import span
+
+if TYPE_CHECKING:
+	from github.Requester import Requester
+
+
+class SchedulerSettings(BaseSettings):
+	model_config = {
+		"env_prefix": "CIBOT_GITHUB_SCHEDULER_",
+	}
+	MUTATION_INTERVAL: float = 1.0
+	"""
+	GitHub asks for at least one second between mutative requests.
+
+	The spacing holds across all threads, so concurrent hooks and the async backend
+	only overlap reads: deleting 300 review comments takes at least 300s. Lowering it
+	speeds up such runs at the risk of secondary rate limits, which are then waited
+	out after ``Retry-After``.
+	"""
+	MAX_RETRIES: int = 5
+	RETRY_BUDGET: float = 300.0
+	"""Total seconds a run may spend waiting on rate limits and backoff"""
+	BACKOFF_BASE: float = 1.0
+	BACKOFF_MAX: float = 60.0
+	SECONDARY_LIMIT_WAIT: float = 60.0
+	"""Wait after a secondary rate limit response that carries no ``Retry-After``"""
+
+
+@dataclass
+class SchedulerStats:
+	calls: int = 0
+	"""Logical API calls, a call retried twice counts once"""
+	attempts: int = 0
+	"""Requests sent, retries included"""
+	retries: int = 0
+	rate_limited: int = 0
+	sleep_seconds: float = 0.0
+
+
+SAFE_VERBS = frozenset({"GET", "HEAD", "OPTIONS"})
+IDEMPOTENT_VERBS = SAFE_VERBS | {"PUT", "DELETE"}
+RETRYABLE_STATUS = frozenset({500, 502, 503, 504})
+
+
+def is_mutation(verb: str) -> bool:
+	return verb.upper() not in SAFE_VERBS
+
+
+def is_idempotent(verb: str) -> bool:
+	return verb.upper() in IDEMPOTENT_VERBS
+
+
+def _is_rate_limited(status: int | None, headers: Mapping[str, str], message: str) -> bool:
+	if status == httpx.codes.TOO_MANY_REQUESTS:
+		return True
+	return status == httpx.codes.FORBIDDEN and (
+		"retry-after" in headers
+		or headers.get("x-ratelimit-remaining") == "0"
+		or "rate limit" in message.lower()
+	)
+
+
+class RequestScheduler:
+	"""
+	Pace and retry GitHub API calls of one run.
+
+	Mutations are spaced ``MUTATION_INTERVAL`` apart across threads to stay under the
+	secondary rate limits and requests wait for the primary limit to reset once the
+	``X-RateLimit-Remaining`` header runs out. Rate limited responses are retried after
+	``Retry-After`` whatever the verb since GitHub rejected them without applying them,
+	server and connection errors are only retried for idempotent calls, with jittered
+	exponential backoff. All waiting for retries comes out of a per-run budget.
+	"""
+
+	def __init__(self, settings: SchedulerSettings | None = None) -> None:
+		self.settings = settings or SchedulerSettings()
+		self.stats = SchedulerStats()
+		self._lock = threading.Lock()
+		self._next_mutation = 0.0
+		self._remaining: int | None = None
+		self._reset = 0.0
+		self._budget = self.settings.RETRY_BUDGET
+
+	def acquire(self, *, mutation: bool) -> float:
+		"""Reserve a slot for the next request and return how long to wait before sending it."""
+		with self._lock:
+			self.stats.attempts += 1
+			now = time.monotonic()
+			delay = 0.0
+			if mutation:
+				slot = max(now, self._next_mutation)
+				self._next_mutation = slot + self.settings.MUTATION_INTERVAL
+				delay = slot - now
+			if self._remaining == 0 and 0 < (reset_in := self._reset - time.time()) <= self._budget:
+				logger.warning(f"GitHub rate limit exhausted, waiting {reset_in:.0f}s for reset")
+				self._budget -= reset_in
+				self._remaining = None
+				delay = max(delay, reset_in)
+			return delay
+
+	def count_call(self) -> None:
+		"""Count a logical call, before its first attempt."""
+		with self._lock:
+			self.stats.calls += 1
+
+	def reset_budget(self) -> None:
+		"""Start a new run's retry budget, the pacing state carries over."""
+		with self._lock:
+			self._budget = self.settings.RETRY_BUDGET
+
+	def observe(self, remaining: int | None, reset: float | None) -> None:
+		with self._lock:
+			if remaining is not None and remaining >= 0:
+				self._remaining = remaining
+			if reset:
+				self._reset = reset
+
+	def observe_headers(self, headers: Mapping[str, str]) -> None:
+		remaining = headers.get("x-ratelimit-remaining")
+		reset = headers.get("x-ratelimit-reset")
+		self.observe(int(remaining) if remaining else None, float(reset) if reset else None)
+
+	def observe_requester(self, requester: "Requester") -> None:
+		remaining, _ = requester.rate_limiting
+		self.observe(remaining, requester.rate_limiting_resettime)
+
+	def retry_delay(
+		self,
+		attempt: int,
+		status: int | None,
+		headers: Mapping[str, str],
+		message: str,
+		*,
+		idempotent: bool,
+	) -> float | None:
+		"""
+		Return how long to wait before retrying a failed request, None to give up.
+
+		``status`` is None for connection errors, ``headers`` must have lowercase keys.
+		"""
+		self.observe_headers(headers)
+		if _is_rate_limited(status, headers, message):
+			with self._lock:
+				self.stats.rate_limited += 1
+			if retry_after := headers.get("retry-after"):
+				delay = float(retry_after)
+			elif headers.get("x-ratelimit-remaining") == "0":
+				delay = max(float(headers.get("x-ratelimit-reset", 0)) - time.time(), 0) + 1
+			else:
+				delay = self.settings.SECONDARY_LIMIT_WAIT + self._backoff(attempt)
+		elif idempotent and (status is None or status in RETRYABLE_STATUS):
+			delay = self._backoff(attempt)
+		else:
+			return None
+		if attempt >= self.settings.MAX_RETRIES:
+			return None
+		with self._lock:
+			if delay > self._budget:
+				logger.warning(f"Retry budget exhausted, not waiting {delay:.0f}s")
+				return None
+			self._budget -= delay
+			self.stats.retries += 1
+		logger.warning(f"Retrying GitHub request in {delay:.1f}s (status {status})")
+		return delay
+
+	def _backoff(self, attempt: int) -> float:
+		cap = min(self.settings.BACKOFF_MAX, self.settings.BACKOFF_BASE * 2**attempt)
+		return random.uniform(0, cap)  # noqa: S311
+
+	def sleep(self, seconds: float) -> None:
+		if seconds > 0:
+			self._slept(seconds)
+			time.sleep(seconds)
+
+	async def asleep(self, seconds: float) -> None:
+		if seconds > 0:
+			self._slept(seconds)
+			await asyncio.sleep(seconds)
+
+	def _slept(self, seconds: float) -> None:
+		with self._lock:
+			self.stats.sleep_seconds += seconds
+
+	def call[R](
+		self,
+		send: Callable[[], R],
+		*,
+		mutation: bool,
+		idempotent: bool,
+		requester: "Requester | None" = None,
+		name: str = "github",
+	) -> R:
+		"""Run a PyGithub call under the scheduler, ``requester`` reports its rate limit."""
+		with span(name, "api"):
+			return self._call(send, mutation=mutation, idempotent=idempotent, requester=requester)
+
+	def _call[R](
+		self,
+		send: Callable[[], R],
+		*,
+		mutation: bool,
+		idempotent: bool,
+		requester: "Requester | None",
+	) -> R:
+		self.count_call()
+		attempt = 0
+		while True:
+			self.sleep(self.acquire(mutation=mutation))
+			try:
+				result = send()
+			except GithubException as e:
+				headers = {k.lower(): v for k, v in (e.headers or {}).items()}
+				message = e.data.get("message", "") if isinstance(e.data, dict) else str(e.data)
+				delay = self.retry_delay(
+					attempt, e.status, headers, str(message), idempotent=idempotent
+				)
+				if delay is None:
+					raise
+			except OSError:
+				# requests' connection errors and timeouts
+				delay = self.retry_delay(attempt, None, {}, "", idempotent=idempotent)
+				if delay is None:
+					raise
+			else:
+				if requester is not None:
+					self.observe_requester(requester)
+				return result
+			self.sleep(delay)
+			attempt += 1
+
+	def summary(self) -> str:
+		stats = self.stats
+		return (
+			f"GitHub API: {stats.calls} calls ({stats.attempts} attempts), {stats.retries} retries, "
+			f"{stats.rate_limited} rate limited, {stats.sleep_seconds:.1f}s waiting"
+		)
+
+
+class ScheduledTransport(httpx.AsyncBaseTransport):
+	"""Run every request of an ``httpx.AsyncClient`` under a ``RequestScheduler``."""
+
+	def __init__(self, transport: httpx.AsyncBaseTransport, scheduler: RequestScheduler) -> None:
+		self.transport = transport
+		self.scheduler = scheduler
+
+	@override
+	async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+		# GraphQL queries are POSTs but neither mutate nor change on retry
+		query = request.url.path.endswith("/graphql")
+		mutation = not query and is_mutation(request.method)
+		idempotent = query or is_idempotent(request.method)
+		with span(f"{request.method} {request.url.path}", "api"):
+			return await self._handle(request, mutation=mutation, idempotent=idempotent)
+
+	async def _handle(
+		self, request: httpx.Request, *, mutation: bool, idempotent: bool
+	) -> httpx.Response:
+		self.scheduler.count_call()
+		attempt = 0
+		while True:
+			await self.scheduler.asleep(self.scheduler.acquire(mutation=mutation))
+			try:
+				response = await self.transport.handle_async_request(request)
+			except httpx.TransportError:
+				delay = self.scheduler.retry_delay(attempt, None, {}, "", idempotent=idempotent)
+				if delay is None:
+					raise
+			else:
+				headers = {k.lower(): v for k, v in response.headers.items()}
+				if response.status_code < httpx.codes.BAD_REQUEST:
+					self.scheduler.observe_headers(headers)
+					return response
+				message = ""
+				if response.status_code == httpx.codes.FORBIDDEN:
+					message = (await response.aread()).decode(errors="replace")
+				delay = self.scheduler.retry_delay(
+					attempt, response.status_code, headers, message, idempotent=idempotent
+				)
+				if delay is None:
+					return response
+				await response.aclose()
+			await self.scheduler.asleep(delay)
+			attempt += 1
+
+	@override
+	async def aclose(self) -> None:
+		await self.transport.aclose()
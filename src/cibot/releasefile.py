@@ -1,16 +1,22 @@
 from __future__ import annotations
 
-import os
 import re
 from dataclasses import dataclass
 from enum import Enum
 from typing import TYPE_CHECKING
 
-import requests
+from github import UnknownObjectException
+
+from cibot.ratelimit import RequestScheduler
+from cibot.tracing import run_process
 
 if TYPE_CHECKING:
+	import subprocess
+
 	from github.PullRequest import PullRequest
 
+RELEASE_FILE = "RELEASE.md"
+
 RELEASE_TYPE_REGEX = re.compile(
 	r"(?i)^Release type: (minor|major|patch)$",
 	flags=re.MULTILINE,
@@ -51,17 +57,76 @@ def parse_release_file(contents: str) -> ReleasePreview:
 	)
 
 
-def get_release_preview(pr: PullRequest) -> ReleasePreview:
-	for f in pr.get_files():
-		if f.filename == "RELEASE.md":
-			headers = {"authorization": f"token {os.getenv('BOT_TOKEN', '')}"}
-			download_url = requests.get(f.contents_url, timeout=10, headers=headers).json()[
-				"download_url"
-			]
-			contents = requests.get(download_url, timeout=10, headers=headers).content.decode(
-				"utf-8",
-			)
-			return parse_release_file(contents)
+def _git(*args: str) -> subprocess.CompletedProcess[bytes]:
+	return run_process(["git", *args], check=False, capture_output=True)
+
+
+def _is_checkout_of(head_sha: str) -> bool:
+	"""Whether HEAD is the PR head or a commit on top of it, like the merge commit CI checks out."""
+	result = _git("rev-list", "--parents", "-n", "1", "HEAD")
+	return result.returncode == 0 and head_sha in result.stdout.decode().split()
+
+
+def _changed_locally(bases: list[str]) -> bool | None:
+	"""Whether the release file changed since the merge base, None if no base is available."""
+	for base in bases:
+		result = _git("diff", "--quiet", f"{base}...HEAD", "--", RELEASE_FILE)
+		if result.returncode in {0, 1}:
+			return result.returncode == 1
+	return None
+
+
+def _read_local() -> str | None:
+	result = _git("show", f"HEAD:{RELEASE_FILE}")
+	return result.stdout.decode() if result.returncode == 0 else None
+
+
+def _fetch(pr: PullRequest, scheduler: RequestScheduler) -> str | None:
+	"""
+	Fetch the release file at the PR head if the PR diff touches it.
+
+	One compare call replaces paging through the PR files, it lists the first 300
+	changed files only.
+	"""
+	repo = pr.base.repo
+
+	def changed() -> bool:
+		files = repo.compare(pr.base.sha, pr.head.sha).files
+		return any(f.filename == RELEASE_FILE and f.status != "removed" for f in files)
+
+	def fetch() -> str | None:
+		try:
+			content = repo.get_contents(RELEASE_FILE, ref=pr.head.sha)
+		except UnknownObjectException:
+			return None
+		return None if isinstance(content, list) else content.decoded_content.decode()
+
+	if not scheduler.call(
+		changed, mutation=False, idempotent=True, requester=pr.requester, name="compare PR"
+	):
+		return None
+	return scheduler.call(
+		fetch, mutation=False, idempotent=True, requester=pr.requester, name="get release file"
+	)
+
+
+def get_release_preview(
+	pr: PullRequest, scheduler: RequestScheduler | None = None
+) -> ReleasePreview:
+	"""
+	Parse the ``RELEASE.md`` changed by ``pr``, read from the checkout when it is one of the PR.
+
+	Without such a checkout the PR diff is compared through the API instead.
+	"""
+	changed = None
+	if _is_checkout_of(pr.head.sha):
+		changed = _changed_locally([pr.base.sha, f"origin/{pr.base.ref}"])
+	if changed is None:
+		contents = _fetch(pr, scheduler or RequestScheduler())
+	else:
+		contents = _read_local() if changed else None
+	if contents is not None:
+		return parse_release_file(contents)
 
 	msg = "Could not find `RELEASE.md`. Please provide a RELEASE.md file in the project root."
 	raise InvalidReleaseFileError(
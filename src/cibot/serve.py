@@ -0,0 +1,332 @@
+import hashlib
+import hmac
+import json
+import queue
+import threading
+from collections import Counter, defaultdict
+from collections.abc import Callable
+from dataclasses import dataclass
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, override
+
+import httpx
+from loguru import logger
+from pydantic_settings import BaseSettings
+
+from cibot.backends.base import CiBotBackendBase
+from cibot.backends.github_backend import GithubSettings
+from cibot.cli import (
+	get_backend,
+	get_runner,
+	get_scheduler,
+	get_storage,
+	refuse_checkout_plugins,
+)
+
+
+class ServeSettings(BaseSettings):
+	model_config = {
+		"env_prefix": "CIBOT_SERVE_",
+	}
+	HOST: str = "127.0.0.1"
+	PORT: int = 8080
+	WEBHOOK_SECRET: str | None = None
+	"""Secret of the GitHub webhook, deliveries without a valid signature are rejected"""
+	WORKERS: int = 4
+	QUEUE_SIZE: int = 256
+	"""Events waiting for a worker, further deliveries are answered with 503"""
+	REPOS: list[str] = []
+	"""Repositories to handle events of, only ``GITHUB_REPO_SLUG`` by default"""
+
+
+PR_ACTIONS = frozenset(
+	{"opened", "reopened", "synchronize", "edited", "labeled", "unlabeled", "ready_for_review"}
+)
+
+
+@dataclass(frozen=True)
+class Event:
+	repo: str
+	pr: int | None = None
+	"""Set for PR events, which run ``on_pr_changed``"""
+	commit: str | None = None
+	"""Set for pushes to the default branch, which run ``on_commit_to_main``"""
+	closed: bool = False
+	"""The PR was merged or closed, which runs ``on_pr_closed``"""
+	delivery: str = ""
+
+	@property
+	def key(self) -> tuple[str, int | None, str | None, bool]:
+		"""Events with the same key are redundant while one of them is still queued."""
+		return (self.repo, self.pr, self.commit, self.closed)
+
+
+def parse_event(name: str, payload: dict[str, Any], delivery: str = "") -> Event | None:
+	"""Map a webhook delivery to the event to run, None when cibot has nothing to do on it."""
+	repo = payload.get("repository", {}).get("full_name")
+	if not repo:
+		return None
+	match name:
+		case "pull_request" if payload.get("action") in PR_ACTIONS:
+			return Event(repo, pr=payload["number"], delivery=delivery)
+		case "pull_request" if payload.get("action") == "closed":
+			return Event(repo, pr=payload["number"], closed=True, delivery=delivery)
+		case "push" if not payload.get("deleted"):
+			default_ref = f"refs/heads/{payload['repository'].get('default_branch')}"
+			if payload.get("ref") == default_ref:
+				return Event(repo, commit=payload["after"], delivery=delivery)
+	return None
+
+
+def sign(secret: str, body: bytes) -> str:
+	return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret: str, body: bytes, signature: str | None) -> bool:
+	return signature is not None and hmac.compare_digest(sign(secret, body), signature)
+
+
+class RepoBackends:
+	"""
+	One backend per repository, reused by its events to keep its connections warm.
+
+	Events of a repository run one at a time, so a backend is never shared by two
+	events at once.
+	"""
+
+	def __init__(self) -> None:
+		self._backends: dict[str, CiBotBackendBase] = {}
+		self._lock = threading.Lock()
+
+	def get(self, slug: str, pr_number: int | None) -> CiBotBackendBase:
+		with self._lock:
+			if (backend := self._backends.get(slug)) is None:
+				backend = self._backends[slug] = get_backend(None, slug)
+		backend.reset(pr_number)
+		return backend
+
+	def close(self) -> None:
+		with self._lock:
+			for backend in self._backends.values():
+				backend.close()
+			self._backends.clear()
+
+
+def run_event(event: Event, plugins: list[str], backends: RepoBackends) -> None:
+	"""
+	Run the plugins on ``event`` with the process wide clients, backends and storages.
+
+	The storage is reloaded first since other writers, like the CI jobs preparing
+	release PRs, may have changed it since the last event.
+	"""
+	get_scheduler().reset_budget()
+	get_storage(event.repo).reload()
+	backend = backends.get(event.repo, event.pr)
+	runner = get_runner(
+		plugins, pr_number=event.pr, slug=event.repo, backend=backend, checkout=False
+	)
+	if event.pr is not None and event.closed:
+		runner.on_pr_closed(event.pr)
+	elif event.pr is not None:
+		runner.on_pr_changed(event.pr)
+	else:
+		runner.on_commit_to_main(event.commit)
+
+
+class Dispatcher:
+	"""
+	Run queued events on a pool of worker threads.
+
+	Events of one repository run one at a time since they share its storage, an
+	event is dropped while an identical one is still waiting in the queue.
+	"""
+
+	def __init__(self, handle: Callable[[Event], None], workers: int, queue_size: int) -> None:
+		self.handle = handle
+		self.stats: Counter[str] = Counter()
+		self._queue: queue.Queue[Event | None] = queue.Queue(queue_size)
+		self._pending: set[tuple[str, int | None, str | None, bool]] = set()
+		self._lock = threading.Lock()
+		self._repo_locks: defaultdict[str, threading.Lock] = defaultdict(threading.Lock)
+		self._threads = [
+			threading.Thread(target=self._work, name=f"cibot-worker-{i}", daemon=True)
+			for i in range(workers)
+		]
+
+	def start(self) -> None:
+		for thread in self._threads:
+			thread.start()
+
+	def submit(self, event: Event) -> bool:
+		"""Queue ``event``, False if it was coalesced. Raises ``queue.Full``."""
+		with self._lock:
+			if event.key in self._pending:
+				self.stats["coalesced"] += 1
+				return False
+			self._queue.put_nowait(event)
+			self._pending.add(event.key)
+			self.stats["queued"] += 1
+			return True
+
+	def join(self) -> None:
+		"""Wait until every queued event ran."""
+		self._queue.join()
+
+	def stop(self) -> None:
+		for _ in self._threads:
+			self._queue.put(None)
+		for thread in self._threads:
+			thread.join()
+
+	def snapshot(self) -> dict[str, int]:
+		with self._lock:
+			return {**self.stats, "waiting": self._queue.qsize()}
+
+	def _work(self) -> None:
+		while (event := self._queue.get()) is not None:
+			try:
+				with self._lock:
+					repo_lock = self._repo_locks[event.repo]
+				with repo_lock:
+					with self._lock:
+						self._pending.discard(event.key)
+					self._run(event)
+			finally:
+				self._queue.task_done()
+		self._queue.task_done()
+
+	def _run(self, event: Event) -> None:
+		with logger.contextualize(delivery=event.delivery):
+			logger.info(f"Handling {event}")
+			try:
+				self.handle(event)
+			except Exception:  # noqa: BLE001
+				logger.exception(f"Event {event} failed")
+				outcome = "failed"
+			else:
+				outcome = "done"
+		with self._lock:
+			self.stats[outcome] += 1
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+	server: "WebhookServer"
+
+	def do_GET(self) -> None:
+		if self.path != "/healthz":
+			self._reply(HTTPStatus.NOT_FOUND, {"error": "not found"})
+			return
+		self._reply(HTTPStatus.OK, self.server.dispatcher.snapshot())
+
+	def do_POST(self) -> None:
+		body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+		secret = self.server.settings.WEBHOOK_SECRET
+		if secret and not verify_signature(secret, body, self.headers.get("X-Hub-Signature-256")):
+			self._reply(HTTPStatus.UNAUTHORIZED, {"error": "bad signature"})
+			return
+		name = self.headers.get("X-GitHub-Event", "")
+		if name == "ping":
+			self._reply(HTTPStatus.OK, {"pong": True})
+			return
+		try:
+			payload = json.loads(body)
+		except ValueError:
+			self._reply(HTTPStatus.BAD_REQUEST, {"error": "payload is not JSON"})
+			return
+		event = parse_event(name, payload, self.headers.get("X-GitHub-Delivery", ""))
+		if event is None or event.repo not in self.server.repos:
+			self._reply(HTTPStatus.ACCEPTED, {"queued": False, "ignored": True})
+			return
+		try:
+			queued = self.server.dispatcher.submit(event)
+		except queue.Full:
+			self._reply(HTTPStatus.SERVICE_UNAVAILABLE, {"error": "queue is full"})
+			return
+		self._reply(HTTPStatus.ACCEPTED, {"queued": queued})
+
+	def _reply(self, status: HTTPStatus, body: dict[str, Any]) -> None:
+		raw = json.dumps(body).encode()
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(raw)))
+		self.end_headers()
+		self.wfile.write(raw)
+
+	@override
+	def log_message(self, format: str, *args: Any) -> None:
+		logger.debug(format % args)
+
+
+class WebhookServer(ThreadingHTTPServer):
+	def __init__(self, settings: ServeSettings, dispatcher: Dispatcher, repos: set[str]) -> None:
+		super().__init__((settings.HOST, settings.PORT), WebhookHandler)
+		self.settings = settings
+		self.dispatcher = dispatcher
+		self.repos = repos
+
+
+def serve(plugins: list[str], settings: ServeSettings | None = None) -> None:
+	"""
+	Receive GitHub webhooks and run the plugins on them until interrupted.
+
+	The GitHub client, one backend per repository and the storages stay warm across
+	events, so an event only pays for its own API calls. The server has no checkout
+	of the PRs' heads: plugins reading it, like diffcov, are refused and release PRs
+	are commented on but prepared by their own CI run.
+	"""
+	settings = settings or ServeSettings()
+	repos = set(settings.REPOS) or {slug for slug in [GithubSettings().REPO_SLUG] if slug}
+	if not repos:
+		msg = "missing CIBOT_SERVE_REPOS or GITHUB_REPO_SLUG"
+		raise ValueError(msg)
+	refuse_checkout_plugins(plugins)
+	if not settings.WEBHOOK_SECRET:
+		logger.warning("CIBOT_SERVE_WEBHOOK_SECRET is not set, deliveries are not verified")
+
+	backends = RepoBackends()
+	dispatcher = Dispatcher(
+		lambda event: run_event(event, plugins, backends), settings.WORKERS, settings.QUEUE_SIZE
+	)
+	dispatcher.start()
+	server = WebhookServer(settings, dispatcher, repos)
+	logger.info(f"Serving {sorted(repos)} on http://{settings.HOST}:{server.server_port}")
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		logger.info("Shutting down, finishing queued events")
+	finally:
+		server.server_close()
+		dispatcher.stop()
+		backends.close()
+		logger.info(f"{dispatcher.snapshot()}, {get_scheduler().summary()}")
+
+
+def guess_event_name(payload: dict[str, Any]) -> str:
+	if "pull_request" in payload:
+		return "pull_request"
+	if "pusher" in payload:
+		return "push"
+	msg = "cannot tell the event of the payload, pass its name"
+	raise ValueError(msg)
+
+
+def replay(
+	url: str, payloads: list[Path], event_name: str | None = None, secret: str | None = None
+) -> None:
+	"""Post recorded webhook payloads to a running ``cibot serve``, signed like GitHub does."""
+	with httpx.Client() as client:
+		for path in payloads:
+			body = path.read_bytes()
+			name = event_name or guess_event_name(json.loads(body))
+			headers = {
+				"Content-Type": "application/json",
+				"X-GitHub-Event": name,
+				"X-GitHub-Delivery": f"replay-{path.name}",
+			}
+			if secret:
+				headers["X-Hub-Signature-256"] = sign(secret, body)
+			response = client.post(url, content=body, headers=headers)
+			logger.info(f"{path}: {response.status_code} {response.text}")
+			response.raise_for_status()
@@ -8,3 +8,9 @@ class CiBotSettings(BaseSettings):
 
 	BACKEND: str = "github"
 	STORAGE: str = "github_issue"
+	MAX_WORKERS: int = 4
+	"""How many plugin hooks may run concurrently, 1 runs them sequentially"""
+	CONSOLIDATE_COMMENTS: bool = False
+	"""Post one bot comment with a section per plugin instead of one comment per plugin"""
+	COMMENT_MAX_CHARS: int = 65_000
+	"""Consolidated comments are truncated to stay below GitHub's 65536 character limit"""
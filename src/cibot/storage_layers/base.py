@@ -7,3 +7,20 @@ class BaseStorage(Protocol):
 	def get[T](self, key: str, type_: type[T]) -> T | None: ...
 	def set(self, key: str, value: msgspec.Struct) -> None: ...
 	def delete(self, key: str) -> None: ...
+
+	def items[T](self, prefix: str, type_: type[T]) -> dict[str, T]:
+		"""Every key starting with ``prefix`` and its value, read in bulk."""
+		...
+
+	def delete_prefix(self, prefix: str) -> None:
+		"""Delete every key starting with ``prefix`` in one write."""
+		...
+
+	def commit(self) -> None:
+		"""Flush buffered mutations, storages that write through have nothing to do."""
+
+	def rollback(self) -> None:
+		"""Drop buffered mutations that were not committed yet."""
+
+	def reload(self) -> None:
+		"""Forget what was read so far, for storages reused across events."""
@@ -1,5 +1,6 @@
 import json
 import textwrap
+import threading
 from typing import override
 
 import msgspec
@@ -7,7 +8,9 @@ from github.Repository import Repository
 from loguru import logger
 from pydantic_settings import BaseSettings
 
+from cibot.ratelimit import RequestScheduler
 from cibot.storage_layers.base import BaseStorage
+from cibot.tracing import traced
 
 
 class Settings(BaseSettings):
@@ -15,6 +18,7 @@ class Settings(BaseSettings):
 		"env_prefix": "CIBOT_STORAGE_GH_ISSUE_",
 	}
 	number: int | None = None
+	write_behind: bool = False
 
 
 class Bucket(msgspec.Struct):
@@ -31,46 +35,162 @@ COMMENT_BASE = """
 """
 
 
+def _apply(bucket: Bucket, changes: dict[str, str | None]) -> None:
+	for key, raw in changes.items():
+		if raw is None:
+			bucket.plugin_srorage.pop(key, None)
+		else:
+			bucket.plugin_srorage[key] = raw
+
+
 class GithubIssueStorage(BaseStorage):
-	def __init__(self, repo: Repository) -> None:
+	"""
+	Store every key as JSON inside the body of a single issue.
+
+	With ``write_behind`` enabled mutations are buffered in memory and reads are
+	served from that buffer; nothing is written until ``commit`` which edits the
+	issue once. ``rollback`` discards the buffer. Writes refresh the issue first and
+	only replay the keys this storage changed, so concurrent runs keep each other's keys.
+	"""
+
+	def __init__(
+		self,
+		repo: Repository,
+		scheduler: RequestScheduler | None = None,
+		*,
+		write_behind: bool | None = None,
+	) -> None:
 		settings = Settings()
 		if not settings.number:
 			raise ValueError("missing STORAGE_ISSUE_NUMBER")
-		issue = repo.get_issue(settings.number)
+		self.scheduler = scheduler or RequestScheduler()
+		self.requester = repo.requester
+		number = settings.number
+		issue = self.scheduler.call(
+			lambda: repo.get_issue(number),
+			mutation=False,
+			idempotent=True,
+			requester=self.requester,
+		)
 		logger.info(f"Found issue {issue.title}")
 		self.issue = issue
+		self.write_behind = settings.write_behind if write_behind is None else write_behind
+		self._buffer: Bucket | None = None
+		self._pending: dict[str, str | None] = {}
+		"""key -> raw value to write, None to delete it"""
+		self._lock = threading.RLock()
 
 	def get_json_part_from_comment(self) -> Bucket | None:
 		if body := self.issue.body:
 			body = body.split("```json")[1].split("```")[0].strip()
 			return msgspec.json.decode(body, type=Bucket)
 
+	def _current_bucket(self) -> Bucket | None:
+		if not self.write_behind:
+			return self.get_json_part_from_comment()
+		if self._buffer is None:
+			self._buffer = self.get_json_part_from_comment()
+		return self._buffer
+
+	def _change(self, changes: dict[str, str | None]) -> None:
+		self._pending.update(changes)
+		if not self.write_behind:
+			self._flush()
+			return
+		bucket = self._current_bucket() or Bucket(plugin_srorage={})
+		_apply(bucket, changes)
+		self._buffer = bucket
+
+	def _flush(self) -> None:
+		"""Replay the pending mutations on the bucket as GitHub holds it now."""
+		self.scheduler.call(
+			self.issue.update, mutation=False, idempotent=True, requester=self.requester
+		)
+		bucket = self.get_json_part_from_comment() or Bucket(plugin_srorage={})
+		_apply(bucket, self._pending)
+		new_comment = COMMENT_BASE.format(json.dumps(msgspec.to_builtins(bucket), indent=2))
+		self.scheduler.call(
+			lambda: self.issue.edit(body=textwrap.dedent(new_comment)),
+			mutation=True,
+			idempotent=True,
+			requester=self.requester,
+		)
+		self._pending.clear()
+		if self.write_behind:
+			self._buffer = bucket
+
+	@traced("storage")
 	def get[T](self, key: str, type_: type[T]) -> T | None:
-		logger.info(f"Getting key {key}")
-		if (bucket := self.get_json_part_from_comment()) and (
-			exists := bucket.plugin_srorage.get(key, None)
-		):
-			return msgspec.json.decode(exists, type=type_)
-		return None
-
+		with self._lock:
+			logger.info(f"Getting key {key}")
+			if (bucket := self._current_bucket()) and (
+				exists := bucket.plugin_srorage.get(key, None)
+			):
+				return msgspec.json.decode(exists, type=type_)
+			return None
+
+	@traced("storage")
 	def set(self, key: str, value: msgspec.Struct) -> None:
-		raw = msgspec.json.encode(value).decode()
+		with self._lock:
+			raw = msgspec.json.encode(value).decode()
+			logger.info(f"Setting key {key} with value {raw}")
+			self._change({key: raw})
 
-		if bucket := self.get_json_part_from_comment():
-			logger.info(f"Updating key {key} with value {raw}")
-			bucket.plugin_srorage[key] = raw
-			new_comment = COMMENT_BASE.format(json.dumps(msgspec.to_builtins(bucket), indent=2))
-		else:
-			logger.info(f"Creating new bucket with key {key} with value {raw}")
-			new_comment = COMMENT_BASE.format(
-				json.dumps(msgspec.to_builtins(Bucket(plugin_srorage={key: raw})), indent=2)
+	@override
+	@traced("storage")
+	def delete(self, key: str) -> None:
+		with self._lock:
+			if (bucket := self._current_bucket()) and key in bucket.plugin_srorage:
+				logger.info(f"Deleting key {key}")
+				self._change({key: None})
+
+	@override
+	@traced("storage")
+	def items[T](self, prefix: str, type_: type[T]) -> dict[str, T]:
+		with self._lock:
+			logger.info(f"Listing keys under {prefix}")
+			if not (bucket := self._current_bucket()):
+				return {}
+			return {
+				key: msgspec.json.decode(raw, type=type_)
+				for key, raw in bucket.plugin_srorage.items()
+				if key.startswith(prefix)
+			}
+
+	@override
+	@traced("storage")
+	def delete_prefix(self, prefix: str) -> None:
+		with self._lock:
+			if not (bucket := self._current_bucket()):
+				return
+			if keys := [key for key in bucket.plugin_srorage if key.startswith(prefix)]:
+				logger.info(f"Deleting {len(keys)} keys under {prefix}")
+				self._change(dict.fromkeys(keys))
+
+	@override
+	@traced("storage")
+	def commit(self) -> None:
+		with self._lock:
+			if self._pending:
+				logger.info("Flushing buffered storage mutations")
+				self._flush()
+
+	@override
+	@traced("storage")
+	def reload(self) -> None:
+		with self._lock:
+			logger.info("Reloading the storage issue")
+			self.scheduler.call(
+				self.issue.update, mutation=False, idempotent=True, requester=self.requester
 			)
-		self.issue.edit(body=textwrap.dedent(new_comment))
+			self._buffer = None
+			self._pending.clear()
 
 	@override
-	def delete(self, key: str) -> None:
-		if bucket := self.get_json_part_from_comment():
-			logger.info(f"Deleting key {key}")
-			del bucket.plugin_srorage[key]
-			new_comment = COMMENT_BASE.format(json.dumps(msgspec.to_builtins(bucket), indent=2))
-			self.issue.edit(body=textwrap.dedent(new_comment))
+	@traced("storage")
+	def rollback(self) -> None:
+		with self._lock:
+			if self._pending:
+				logger.info("Discarding buffered storage mutations")
+			self._buffer = None
+			self._pending.clear()
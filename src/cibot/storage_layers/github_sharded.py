@@ -0,0 +1,259 @@
+import hashlib
+import threading
+from collections import defaultdict
+from collections.abc import Callable
+from functools import partial
+from typing import TYPE_CHECKING, override
+
+import msgspec
+from github.Repository import Repository
+from loguru import logger
+from pydantic_settings import BaseSettings
+
+from cibot.ratelimit import RequestScheduler
+from cibot.storage_layers.base import BaseStorage
+from cibot.storage_layers.github_issue import Bucket
+from cibot.tracing import traced
+
+if TYPE_CHECKING:
+	from github.Issue import Issue
+	from github.IssueComment import IssueComment
+
+
+class Settings(BaseSettings):
+	model_config = {
+		"env_prefix": "CIBOT_STORAGE_GH_SHARDED_",
+	}
+	number: int | None = None
+	shards: int = 16
+	write_behind: bool = False
+
+
+class ShardIndex(msgspec.Struct):
+	shards: dict[int, int]
+	"""shard number -> id of the issue comment holding it"""
+	keys: dict[str, int]
+	"""key -> shard number"""
+
+
+INDEX_BASE = """
+### CIBot Storage Layer (sharded index)
+### Do not edit this issue
+
+```json
+{}
+```
+"""
+
+SHARD_BASE = """
+### CIBot Storage Shard {}
+### Do not edit this comment
+
+```json
+{}
+```
+"""
+
+
+def _json_block(body: str | None) -> str | None:
+	if body and "```json" in body:
+		return body.split("```json")[1].split("```")[0].strip()
+	return None
+
+
+class GithubShardedIssueStorage(BaseStorage):
+	"""
+	Spread keys over several comments of one issue to stay below the issue body size limit.
+
+	The issue body only holds a small index mapping every key to its shard and every
+	shard to the comment storing it. Keys hash into ``shards`` comments, so reading or
+	writing a key only fetches and rewrites the one comment it lives in.
+
+	Writers are not serialized: a flush re-reads the index and the shards it touches
+	and replays only this storage's own mutations on them, which narrows but does not
+	close the window in which a concurrent writer's keys are lost. Use the sqlite
+	storage when several writers must never race.
+	"""
+
+	def __init__(
+		self,
+		repo: Repository,
+		scheduler: RequestScheduler | None = None,
+		*,
+		write_behind: bool | None = None,
+	) -> None:
+		settings = Settings()
+		if not settings.number:
+			msg = "missing STORAGE_GH_SHARDED_NUMBER"
+			raise ValueError(msg)
+		self.scheduler = scheduler or RequestScheduler()
+		self.requester = repo.requester
+		number = settings.number
+		issue = self._call(lambda: repo.get_issue(number), mutation=False, idempotent=True)
+		logger.info(f"Found issue {issue.title}")
+		self.issue: Issue = issue
+		self.shard_count = settings.shards
+		self.write_behind = settings.write_behind if write_behind is None else write_behind
+		self._lock = threading.RLock()
+		self._load_index()
+
+	def _call[R](self, send: Callable[[], R], *, mutation: bool, idempotent: bool) -> R:
+		return self.scheduler.call(
+			send, mutation=mutation, idempotent=idempotent, requester=self.requester
+		)
+
+	def _load_index(self) -> None:
+		raw = _json_block(self.issue.body)
+		self._index = (
+			msgspec.json.decode(raw, type=ShardIndex) if raw else ShardIndex(shards={}, keys={})
+		)
+		self._comments: dict[int, IssueComment] = {}
+		self._shards: dict[int, Bucket] = {}
+		self._pending: dict[str, str | None] = {}
+		"""key -> raw value to write, None to delete it"""
+
+	def _shard_for(self, key: str) -> int:
+		if (shard := self._index.keys.get(key)) is not None:
+			return shard
+		digest = hashlib.sha1(key.encode(), usedforsecurity=False).digest()
+		return int.from_bytes(digest[:8]) % self.shard_count
+
+	def _load_shard(self, shard: int) -> Bucket:
+		if (bucket := self._shards.get(shard)) is not None:
+			return bucket
+		bucket = Bucket(plugin_srorage={})
+		if (comment_id := self._index.shards.get(shard)) is not None:
+			logger.info(f"Fetching storage shard {shard}")
+			comment = self._call(
+				lambda: self.issue.get_comment(comment_id), mutation=False, idempotent=True
+			)
+			self._comments[shard] = comment
+			if raw := _json_block(comment.body):
+				bucket = msgspec.json.decode(raw, type=Bucket)
+		self._shards[shard] = bucket
+		return bucket
+
+	def _flush(self) -> None:
+		"""Replay the pending mutations on the index and shards as GitHub holds them now."""
+		pending = self._pending
+		self._call(self.issue.update, mutation=False, idempotent=True)
+		self._load_index()
+		changes: defaultdict[int, dict[str, str | None]] = defaultdict(dict)
+		for key, raw in pending.items():
+			changes[self._shard_for(key)][key] = raw
+		index_dirty = False
+		for shard, shard_changes in sorted(changes.items()):
+			storage = self._load_shard(shard).plugin_srorage
+			for key, raw in shard_changes.items():
+				if raw is None:
+					storage.pop(key, None)
+					index_dirty |= self._index.keys.pop(key, None) is not None
+				else:
+					storage[key] = raw
+					index_dirty |= self._index.keys.get(key) != shard
+					self._index.keys[key] = shard
+			body = SHARD_BASE.format(shard, msgspec.json.encode(self._shards[shard]).decode())
+			if comment := self._comments.get(shard):
+				self._call(partial(comment.edit, body), mutation=True, idempotent=True)
+			else:
+				comment = self._call(
+					partial(self.issue.create_comment, body), mutation=True, idempotent=False
+				)
+				self._comments[shard] = comment
+				self._index.shards[shard] = comment.id
+				index_dirty = True
+		if index_dirty:
+			body = INDEX_BASE.format(msgspec.json.encode(self._index).decode())
+			self._call(lambda: self.issue.edit(body=body), mutation=True, idempotent=True)
+
+	def _mutated(self) -> None:
+		if not self.write_behind:
+			self._flush()
+
+	@override
+	@traced("storage")
+	def get[T](self, key: str, type_: type[T]) -> T | None:
+		with self._lock:
+			logger.info(f"Getting key {key}")
+			if key not in self._index.keys:
+				return None
+			if exists := self._load_shard(self._shard_for(key)).plugin_srorage.get(key):
+				return msgspec.json.decode(exists, type=type_)
+			return None
+
+	@override
+	@traced("storage")
+	def set(self, key: str, value: msgspec.Struct) -> None:
+		with self._lock:
+			raw = msgspec.json.encode(value).decode()
+			shard = self._shard_for(key)
+			logger.info(f"Setting key {key} in shard {shard} with value {raw}")
+			self._load_shard(shard).plugin_srorage[key] = raw
+			self._index.keys[key] = shard
+			self._pending[key] = raw
+			self._mutated()
+
+	@override
+	@traced("storage")
+	def delete(self, key: str) -> None:
+		with self._lock:
+			if key not in self._index.keys:
+				return
+			shard = self._shard_for(key)
+			logger.info(f"Deleting key {key} from shard {shard}")
+			self._load_shard(shard).plugin_srorage.pop(key, None)
+			del self._index.keys[key]
+			self._pending[key] = None
+			self._mutated()
+
+	@override
+	@traced("storage")
+	def items[T](self, prefix: str, type_: type[T]) -> dict[str, T]:
+		"""Only the shards holding a matching key are fetched, found through the index."""
+		with self._lock:
+			logger.info(f"Listing keys under {prefix}")
+			out = {}
+			for key, shard in self._index.keys.items():
+				if key.startswith(prefix) and (
+					raw := self._load_shard(shard).plugin_srorage.get(key)
+				):
+					out[key] = msgspec.json.decode(raw, type=type_)
+			return out
+
+	@override
+	@traced("storage")
+	def delete_prefix(self, prefix: str) -> None:
+		"""Delete the matching keys this storage knows of, not ones written since by others."""
+		with self._lock:
+			if not (keys := [key for key in self._index.keys if key.startswith(prefix)]):
+				return
+			logger.info(f"Deleting {len(keys)} keys under {prefix}")
+			for key in keys:
+				shard = self._index.keys.pop(key)
+				self._load_shard(shard).plugin_srorage.pop(key, None)
+				self._pending[key] = None
+			self._mutated()
+
+	@override
+	@traced("storage")
+	def commit(self) -> None:
+		with self._lock:
+			if self._pending:
+				logger.info("Flushing buffered storage shards")
+				self._flush()
+
+	@override
+	@traced("storage")
+	def reload(self) -> None:
+		with self._lock:
+			logger.info("Reloading the storage index")
+			self._call(self.issue.update, mutation=False, idempotent=True)
+			self._load_index()
+
+	@override
+	@traced("storage")
+	def rollback(self) -> None:
+		with self._lock:
+			if self._pending:
+				logger.info("Discarding buffered storage shards")
+				self._load_index()
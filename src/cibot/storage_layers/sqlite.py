@@ -0,0 +1,120 @@
+import sqlite3
+import threading
+from pathlib import Path
+from typing import override
+
+import msgspec
+from loguru import logger
+from pydantic_settings import BaseSettings
+
+from cibot.storage_layers.base import BaseStorage
+from cibot.tracing import traced
+
+
+class Settings(BaseSettings):
+	model_config = {
+		"env_prefix": "CIBOT_STORAGE_SQLITE_",
+	}
+	path: Path = Path.home() / ".local" / "share" / "cibot" / "storage.sqlite3"
+	"""Kept outside the checkout, which CI runners clean between runs"""
+	write_behind: bool = False
+
+
+class SqliteStorage(BaseStorage):
+	"""
+	Store keys in a local SQLite database, values are msgpack encoded.
+
+	Meant for self-hosted runners (or benchmarks) where the database file survives
+	between runs. With ``write_behind`` enabled the whole run is one SQLite transaction.
+	Keys are stored under ``repo``, so repositories can share the database file.
+	"""
+
+	def __init__(
+		self, path: Path | None = None, *, repo: str | None = None, write_behind: bool | None = None
+	) -> None:
+		settings = Settings()
+		self.path = path or settings.path
+		self._namespace = f"{repo}:" if repo else ""
+		self.write_behind = settings.write_behind if write_behind is None else write_behind
+		self._lock = threading.RLock()
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		logger.info(f"Using sqlite storage at {self.path}")
+		self._conn = sqlite3.connect(self.path, check_same_thread=False)
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL)"
+		)
+		self._conn.commit()
+
+	def _mutated(self) -> None:
+		if not self.write_behind:
+			self._conn.commit()
+
+	@override
+	@traced("storage")
+	def get[T](self, key: str, type_: type[T]) -> T | None:
+		with self._lock:
+			logger.info(f"Getting key {key}")
+			row = self._conn.execute(
+				"SELECT value FROM kv WHERE key = ?", (self._namespace + key,)
+			).fetchone()
+			if row is None:
+				return None
+			return msgspec.msgpack.decode(row[0], type=type_)
+
+	@override
+	@traced("storage")
+	def set(self, key: str, value: msgspec.Struct) -> None:
+		with self._lock:
+			logger.info(f"Setting key {key}")
+			self._conn.execute(
+				"INSERT INTO kv (key, value) VALUES (?, ?) "
+				"ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+				(self._namespace + key, msgspec.msgpack.encode(value)),
+			)
+			self._mutated()
+
+	@override
+	@traced("storage")
+	def delete(self, key: str) -> None:
+		with self._lock:
+			logger.info(f"Deleting key {key}")
+			self._conn.execute("DELETE FROM kv WHERE key = ?", (self._namespace + key,))
+			self._mutated()
+
+	@override
+	@traced("storage")
+	def items[T](self, prefix: str, type_: type[T]) -> dict[str, T]:
+		with self._lock:
+			logger.info(f"Listing keys under {prefix}")
+			prefix = self._namespace + prefix
+			rows = self._conn.execute(
+				"SELECT key, value FROM kv WHERE substr(key, 1, length(?)) = ? ORDER BY key",
+				(prefix, prefix),
+			).fetchall()
+			return {
+				key.removeprefix(self._namespace): msgspec.msgpack.decode(value, type=type_)
+				for key, value in rows
+			}
+
+	@override
+	@traced("storage")
+	def delete_prefix(self, prefix: str) -> None:
+		with self._lock:
+			logger.info(f"Deleting keys under {prefix}")
+			prefix = self._namespace + prefix
+			self._conn.execute(
+				"DELETE FROM kv WHERE substr(key, 1, length(?)) = ?", (prefix, prefix)
+			)
+			self._mutated()
+
+	@override
+	@traced("storage")
+	def commit(self) -> None:
+		with self._lock:
+			self._conn.commit()
+
+	@override
+	@traced("storage")
+	def rollback(self) -> None:
+		with self._lock:
+			self._conn.rollback()
@@ -0,0 +1,159 @@
+import os
+import subprocess
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import AbstractContextManager, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+from typing import Any
+
+import msgspec
+from loguru import logger
+
+
+class Span(msgspec.Struct):
+	name: str
+	category: str
+	plugin: str | None
+	start_ns: int
+	end_ns: int
+	thread: int
+	args: dict[str, str]
+
+
+_current_plugin: ContextVar[str | None] = ContextVar("cibot_trace_plugin", default=None)
+
+
+class Tracer:
+	"""
+	Collect timed spans of a run.
+
+	Spans are attributed to the plugin whose hook they run under, which follows the
+	hook into worker threads as long as they run in a copy of its context.
+	Disabled tracers only cost an attribute lookup per span.
+	"""
+
+	def __init__(self) -> None:
+		self.enabled = False
+		self.spans: list[Span] = []
+		self._lock = threading.Lock()
+		self._origin_ns = time.perf_counter_ns()
+
+	def enable(self) -> None:
+		self.enabled = True
+		self._origin_ns = time.perf_counter_ns()
+
+	@contextmanager
+	def span(
+		self, name: str, category: str, plugin: str | None = None, **args: object
+	) -> Iterator[None]:
+		if not self.enabled:
+			yield
+			return
+		token = _current_plugin.set(plugin) if plugin else None
+		start = time.perf_counter_ns()
+		try:
+			yield
+		finally:
+			recorded = Span(
+				name=name,
+				category=category,
+				plugin=_current_plugin.get(),
+				start_ns=start,
+				end_ns=time.perf_counter_ns(),
+				thread=threading.get_ident(),
+				args={key: str(value) for key, value in args.items()},
+			)
+			if token is not None:
+				_current_plugin.reset(token)
+			with self._lock:
+				self.spans.append(recorded)
+
+	def chrome_trace(self) -> dict[str, Any]:
+		"""Complete events of the Chrome trace event format, loadable in Perfetto."""
+		pid = os.getpid()
+		return {
+			"traceEvents": [
+				{
+					"name": span.name,
+					"cat": span.category,
+					"ph": "X",
+					"ts": (span.start_ns - self._origin_ns) / 1000,
+					"dur": (span.end_ns - span.start_ns) / 1000,
+					"pid": pid,
+					"tid": span.thread,
+					"args": {"plugin": span.plugin or "cibot", **span.args},
+				}
+				for span in self.spans
+			],
+			"displayTimeUnit": "ms",
+		}
+
+	def write_chrome_trace(self, path: Path) -> None:
+		path.write_bytes(msgspec.json.encode(self.chrome_trace()))
+		logger.info(f"Wrote {len(self.spans)} spans to {path}")
+
+	def summary(self) -> str:
+		"""Wall time and call count per plugin and span category."""
+		totals: dict[tuple[str, str], tuple[int, int]] = {}
+		for span in self.spans:
+			key = (span.plugin or "cibot", span.category)
+			calls, duration = totals.get(key, (0, 0))
+			totals[key] = (calls + 1, duration + span.end_ns - span.start_ns)
+		lines = [f"{'plugin':<20} {'category':<12} {'calls':>7} {'wall ms':>10}"]
+		lines.extend(
+			f"{plugin:<20} {category:<12} {calls:>7} {duration / 1e6:>10.1f}"
+			for (plugin, category), (calls, duration) in sorted(totals.items())
+		)
+		return "\n".join(lines)
+
+
+TRACER = Tracer()
+
+
+def span(
+	name: str, category: str, plugin: str | None = None, **args: object
+) -> AbstractContextManager[None]:
+	return TRACER.span(name, category, plugin, **args)
+
+
+def traced[**P, R](
+	category: str, name: str | None = None
+) -> Callable[[Callable[P, R]], Callable[P, R]]:
+	"""Record every call of the decorated function as a span, named after it by default."""
+
+	def decorator(fn: Callable[P, R]) -> Callable[P, R]:
+		span_name = name or fn.__qualname__
+
+		@wraps(fn)
+		def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+			if not TRACER.enabled:
+				return fn(*args, **kwargs)
+			with TRACER.span(span_name, category):
+				return fn(*args, **kwargs)
+
+		return wrapper
+
+	return decorator
+
+
+def run_process(args: list[str], **kwargs: Any) -> subprocess.CompletedProcess[bytes]:  # noqa: ANN401
+	"""``subprocess.run`` recorded as a span named after the command."""
+	with span(" ".join(args[:2]), "subprocess", command=" ".join(args)):
+		return subprocess.run(args, **kwargs)  # noqa: PLW1510
+
+
+@contextmanager
+def trace_to(path: Path | None) -> Iterator[None]:
+	"""Trace the enclosed run into ``path`` and log the summary, a no-op without a path."""
+	if path is None:
+		yield
+		return
+	TRACER.enable()
+	try:
+		yield
+	finally:
+		TRACER.write_chrome_trace(path)
+		logger.info(f"Trace summary\n{TRACER.summary()}")
@@ -0,0 +1,16 @@
+import pytest
+
+from cibot.ratelimit import RequestScheduler, SchedulerSettings
+from tests.fakes import FakeRepo
+
+
+@pytest.fixture
+def scheduler() -> RequestScheduler:
+	return RequestScheduler(SchedulerSettings(MUTATION_INTERVAL=0))
+
+
+@pytest.fixture
+def repo(monkeypatch: pytest.MonkeyPatch) -> FakeRepo:
+	monkeypatch.setenv("CIBOT_STORAGE_GH_ISSUE_NUMBER", "1")
+	monkeypatch.setenv("CIBOT_STORAGE_GH_SHARDED_NUMBER", "1")
+	return FakeRepo()
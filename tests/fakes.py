@@ -0,0 +1,159 @@
+import itertools
+from dataclasses import dataclass, field
+from typing import override
+
+from cibot.backends.base import (
+	CiBotBackendBase,
+	PrContext,
+	PrDescription,
+	PrReviewComment,
+	ReleaseInfo,
+)
+from cibot.storage_layers.base import BaseStorage
+
+
+@dataclass
+class FakeRequester:
+	rate_limiting: tuple[int, int] = (5000, 5000)
+	rate_limiting_resettime: int = 0
+
+
+@dataclass
+class RemoteIssue:
+	"""What GitHub holds for the storage issue, counting the writes it received."""
+
+	body: str | None = None
+	comments: dict[int, str] = field(default_factory=dict)
+	"""comment id -> body"""
+	writes: int = 0
+	ids: itertools.count = field(default_factory=lambda: itertools.count(1))
+
+
+@dataclass
+class FakeComment:
+	id: int
+	body: str
+	remote: RemoteIssue
+
+	def edit(self, body: str) -> None:
+		self.body = self.remote.comments[self.id] = body
+		self.remote.writes += 1
+
+
+class FakeIssue:
+	"""The parts of a PyGithub ``Issue`` the storages use, a snapshot like PyGithub's."""
+
+	title = "cibot storage"
+
+	def __init__(self, remote: RemoteIssue) -> None:
+		self.remote = remote
+		self.body = remote.body
+
+	def edit(self, body: str) -> None:
+		self.body = self.remote.body = body
+		self.remote.writes += 1
+
+	def update(self) -> bool:
+		self.body = self.remote.body
+		return True
+
+	def get_comment(self, comment_id: int) -> FakeComment:
+		return FakeComment(comment_id, self.remote.comments[comment_id], self.remote)
+
+	def create_comment(self, body: str) -> FakeComment:
+		comment_id = next(self.remote.ids)
+		self.remote.comments[comment_id] = body
+		self.remote.writes += 1
+		return FakeComment(comment_id, body, self.remote)
+
+
+@dataclass
+class FakeRepo:
+	remote: RemoteIssue = field(default_factory=RemoteIssue)
+	requester: FakeRequester = field(default_factory=FakeRequester)
+
+	def get_issue(self, number: int) -> FakeIssue:
+		return FakeIssue(self.remote)
+
+
+class FakeBackend(CiBotBackendBase):
+	"""In-memory backend for one PR, recording every write it receives."""
+
+	def __init__(
+		self, storage: BaseStorage | None = None, context: PrContext | None = None
+	) -> None:
+		self.context = context or PrContext(
+			pr_number=1,
+			title="Add a feature",
+			body="",
+			labels=[],
+			author_login="octocat",
+			author_name=None,
+			head_sha="abc",
+			bot_comments=[],
+			review_comments=[],
+		)
+		self.pr_number = self.context.pr_number
+		self.comments: dict[str, str] = {}
+		"""comment id -> body"""
+		self.review_comments: dict[int, PrReviewComment] = {}
+		self.releases: list[ReleaseInfo] = []
+		self.writes: list[str] = []
+		self._ids = itertools.count(1000)
+
+	@override
+	def name(self) -> str:
+		return "fake"
+
+	@override
+	def upsert_pr_comment(self, content: str, comment_id: str) -> None:
+		self.comments[comment_id] = content
+		self.writes.append(f"upsert {comment_id}")
+
+	@override
+	def get_pr_comment(self, comment_id: str) -> str | None:
+		return self.comments.get(comment_id)
+
+	@override
+	def forget_pr(self, pr_number: int) -> None:
+		self.writes.append(f"forget {pr_number}")
+
+	@override
+	def create_pr_review_comment(self, comment: PrReviewComment) -> None:
+		comment_id = next(self._ids)
+		self.review_comments[comment_id] = comment
+		self.writes.append(f"create {comment_id}")
+
+	@override
+	def get_review_comments_for_content_id(self, id: str) -> list[tuple[int, PrReviewComment]]:
+		return [(i, c) for i, c in self.review_comments.items() if c.content_id == id]
+
+	@override
+	def delete_pr_review_comment(self, comment_id: int) -> None:
+		del self.review_comments[comment_id]
+		self.writes.append(f"delete {comment_id}")
+
+	@override
+	def publish_release(self, release_info: ReleaseInfo) -> None:
+		self.releases.append(release_info)
+		self.writes.append(f"release {release_info.version}")
+
+	@override
+	def get_pr_context(self, pr_number: int) -> PrContext:
+		return self.context
+
+	@override
+	def get_pr_description(self, pr_number: int) -> PrDescription:
+		return self.context.description()
+
+	@override
+	def get_commit_associated_pr(self, commit_hash: str) -> PrDescription:
+		return self.context.description()
+
+	@override
+	def get_pr_labels(self, pr_number: int) -> list[str]:
+		return self.context.labels
+
+	@override
+	def configure_git(self) -> None:
+		pass
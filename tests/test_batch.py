@@ -0,0 +1,123 @@
+import time
+from pathlib import Path
+from typing import override
+
+import msgspec
+import pytest
+
+from cibot import batch, cli
+from cibot.backends.base import CiBotBackendBase
+from cibot.plugins.base import BumpType, CiBotPlugin
+from cibot.storage_layers.base import BaseStorage
+from cibot.storage_layers.sqlite import SqliteStorage
+from tests.fakes import FakeBackend
+
+
+class Value(msgspec.Struct):
+	value: int
+
+
+class WritingPlugin(CiBotPlugin):
+	"""Write a key per PR, then fail on PR 2."""
+
+	@override
+	def plugin_name(self) -> str:
+		return "writing"
+
+	@override
+	def supported_backends(self) -> tuple[str, ...]:
+		return ("*",)
+
+	@override
+	def on_pr_changed(self, pr: int) -> BumpType | None:
+		self.storage.set(f"pr-{pr}", Value(pr))
+		if pr == 2:
+			msg = "boom"
+			raise RuntimeError(msg)
+		return None
+
+
+@pytest.fixture
+def storage(tmp_path: Path) -> SqliteStorage:
+	return SqliteStorage(tmp_path / "storage.sqlite3", write_behind=True)
+
+
+def test_pr_storage_buffers_until_commit(storage: SqliteStorage) -> None:
+	storage.set("keep-a", Value(1))
+	storage.set("drop-b", Value(2))
+	pr_storage = batch.PrStorage(storage)
+
+	pr_storage.delete_prefix("drop-")
+	pr_storage.set("drop-c", Value(3))
+	pr_storage.delete("keep-a")
+	assert pr_storage.items("", Value) == {"drop-c": Value(3)}
+	assert storage.items("", Value) == {"drop-b": Value(2), "keep-a": Value(1)}
+
+	pr_storage.rollback()
+	assert pr_storage.items("", Value) == storage.items("", Value)
+
+	pr_storage.delete_prefix("drop-")
+	pr_storage.set("drop-c", Value(3))
+	pr_storage.commit()
+	assert storage.items("", Value) == {"drop-c": Value(3), "keep-a": Value(1)}
+
+
+def test_failed_prs_are_rolled_back(
+	storage: SqliteStorage, monkeypatch: pytest.MonkeyPatch
+) -> None:
+	def get_plugins(
+		plugins: list[str], backend: CiBotBackendBase, storage: BaseStorage
+	) -> list[CiBotPlugin]:
+		return [WritingPlugin(backend, storage)]
+
+	monkeypatch.setattr(cli, "load_plugin", lambda _name: WritingPlugin)
+	monkeypatch.setattr(batch, "get_plugins", get_plugins)
+	monkeypatch.setattr(batch, "get_storage", lambda _slug, **_: storage)
+	monkeypatch.setattr(batch, "get_backend", lambda _pr, _slug, storage: FakeBackend(storage))
+
+	report = batch.Batch(["writing"], 2).run([batch.Target("o/r", pr) for pr in (1, 2, 3)])
+
+	assert [result.error for result in report.results] == [None, "RuntimeError: boom", None]
+	assert storage.items("pr-", Value) == {"pr-1": Value(1), "pr-3": Value(3)}
+
+
+def test_plugins_reading_the_checkout_are_refused() -> None:
+	with pytest.raises(ValueError, match="diffcov"):
+		batch.Batch(["diffcov"], 1)
+
+
+class LastPrPlugin(WritingPlugin):
+	"""Record the last PR under the same key in every repository, and overlapping runs."""
+
+	running = 0
+	overlap = 0
+
+	@override
+	def on_pr_changed(self, pr: int) -> BumpType | None:
+		type(self).running += 1
+		type(self).overlap = max(self.overlap, self.running)
+		self.storage.set("last-pr", Value(pr))
+		time.sleep(0.05)
+		type(self).running -= 1
+		return None
+
+
+def test_repositories_share_the_sqlite_file(
+	tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+	path = tmp_path / "storage.sqlite3"
+	monkeypatch.setenv("CIBOT_STORAGE", "sqlite")
+	monkeypatch.setenv("CIBOT_STORAGE_SQLITE_PATH", str(path))
+	monkeypatch.setattr(cli, "load_plugin", lambda _name: LastPrPlugin)
+	monkeypatch.setattr(batch, "get_storage", cli.get_storage.__wrapped__)
+	monkeypatch.setattr(batch, "get_backend", lambda _pr, _slug, storage: FakeBackend(storage))
+
+	report = batch.Batch(["last-pr"], 2).run(
+		[batch.Target("o/a", 1), batch.Target("o/b", 3), batch.Target("o/a", 4)]
+	)
+
+	assert LastPrPlugin.overlap == 1
+	assert report.failed == []
+	assert report.failed_commits == {}
+	assert SqliteStorage(path, repo="o/a").get("last-pr", Value) == Value(4)
+	assert SqliteStorage(path, repo="o/b").items("", Value) == {"last-pr": Value(3)}
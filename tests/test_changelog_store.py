@@ -0,0 +1,147 @@
+import json
+import stat
+from pathlib import Path
+
+import msgspec
+import pytest
+
+from cibot.plugins import changelog_store
+from cibot.plugins.changelog_store import ChangelogStore, prepend_section
+
+HEADER = "CHANGELOG\n=========\n"
+
+
+class Release(msgspec.Struct):
+	notes: str
+
+
+def filled_store(root: Path, *versions: str) -> ChangelogStore:
+	store = ChangelogStore(root)
+	for version in versions:
+		store.append(version, Release(notes=f"notes {version}"))
+	return store
+
+
+def test_range_reads(tmp_path: Path) -> None:
+	filled_store(tmp_path, "1.0.0", "1.1.0", "1.2.0", "2.0.0")
+	store = ChangelogStore(tmp_path)
+
+	assert store.versions() == ["1.0.0", "1.1.0", "1.2.0", "2.0.0"]
+	assert store.get("1.1.0", Release) == Release(notes="notes 1.1.0")
+	assert store.get("3.0.0", Release) is None
+	assert list(store.between("1.0.0", "1.2.0", Release)) == ["1.1.0", "1.2.0"]
+	assert list(store.between(None, "1.1.0", Release)) == ["1.0.0", "1.1.0"]
+	assert list(store.between("1.2.0", None, Release)) == ["2.0.0"]
+
+
+def test_version_released_twice_resolves_to_last_record(tmp_path: Path) -> None:
+	store = filled_store(tmp_path, "1.0.0", "1.1.0")
+	store.append("1.0.0", Release(notes="again"))
+
+	reopened = ChangelogStore(tmp_path)
+	assert reopened.versions() == ["1.1.0", "1.0.0"]
+	assert reopened.get("1.0.0", Release) == Release(notes="again")
+
+
+def test_missing_index_is_rebuilt(tmp_path: Path) -> None:
+	store = filled_store(tmp_path, "1.0.0", "1.1.0")
+	store.index_path.unlink()
+
+	assert ChangelogStore(tmp_path).get("1.1.0", Release) == Release(notes="notes 1.1.0")
+	assert store.index_path.read_text().splitlines()[1].startswith("1.1.0 ")
+
+
+def test_index_pointing_at_other_records_is_rebuilt(tmp_path: Path) -> None:
+	store = filled_store(tmp_path, "1.0.0", "1.1.0")
+	# same lengths, so the index still covers the records exactly
+	first, second = store.index_path.read_text().splitlines()
+	store.index_path.write_text(
+		f"{first.split()[0]} {' '.join(second.split()[1:])}\n"
+		f"{second.split()[0]} {' '.join(first.split()[1:])}\n"
+	)
+
+	reopened = ChangelogStore(tmp_path)
+	assert reopened.get("1.0.0", Release) == Release(notes="notes 1.0.0")
+	assert reopened.between(None, None, Release) == {
+		"1.0.0": Release(notes="notes 1.0.0"),
+		"1.1.0": Release(notes="notes 1.1.0"),
+	}
+
+
+def test_malformed_record_lines_are_skipped(tmp_path: Path) -> None:
+	store = filled_store(tmp_path, "1.0.0")
+	with store.records_path.open("ab") as records:
+		records.write(b"\n{not json\n")
+	filled_store(tmp_path, "1.1.0")
+	store.index_path.unlink()
+
+	reopened = ChangelogStore(tmp_path)
+	assert reopened.versions() == ["1.0.0", "1.1.0"]
+	assert reopened.get("1.1.0", Release) == Release(notes="notes 1.1.0")
+
+
+def test_migrate_legacy_changelog(tmp_path: Path) -> None:
+	filled_store(tmp_path, "1.0.0")
+	legacy = {"1.0.0": {"notes": "legacy 1.0.0"}, "0.9.0": {"notes": "legacy 0.9.0"}}
+	(tmp_path / "CHANGELOG.json").write_text(json.dumps(legacy))
+	store = ChangelogStore(tmp_path)
+
+	assert store.migrate()
+	assert not store.migrate()
+	assert not (tmp_path / "CHANGELOG.json").exists()
+	assert store.versions() == ["1.0.0", "0.9.0"]
+	assert store.get("1.0.0", Release) == Release(notes="notes 1.0.0")
+	assert ChangelogStore(tmp_path).get("0.9.0", Release) == Release(notes="legacy 0.9.0")
+
+
+def test_prepend_section_creates_the_file(tmp_path: Path) -> None:
+	path = tmp_path / "CHANGELOG.md"
+	prepend_section(path, HEADER, "1.0.0\n-----\nfirst")
+
+	assert path.read_text() == f"{HEADER}1.0.0\n-----\nfirst\n"
+
+
+def test_prepend_section_keeps_the_body_byte_for_byte(tmp_path: Path) -> None:
+	path = tmp_path / "CHANGELOG.md"
+	body = "1.0.0\r\n-----\r\nfirst ünïcode\r\n".encode()
+	path.write_bytes(HEADER.encode() + body)
+	path.chmod(0o640)
+
+	prepend_section(path, HEADER, "1.1.0\n-----\nsecond")
+
+	assert path.read_bytes() == f"{HEADER}1.1.0\n-----\nsecond\n\n".encode() + body
+	assert stat.S_IMODE(path.stat().st_mode) == 0o640
+
+
+def test_prepend_section_adds_a_missing_header(tmp_path: Path) -> None:
+	path = tmp_path / "CHANGELOG.md"
+	path.write_text("old notes\n")
+	prepend_section(path, HEADER, "new")
+
+	assert path.read_text() == f"{HEADER}new\n\nold notes\n"
+
+
+def test_prepend_section_of_an_empty_file(tmp_path: Path) -> None:
+	path = tmp_path / "CHANGELOG.md"
+	path.write_text("")
+	prepend_section(path, HEADER, "new")
+
+	assert path.read_text() == f"{HEADER}new\n"
+
+
+def test_prepend_section_leaves_the_file_on_failure(
+	tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+	path = tmp_path / "CHANGELOG.md"
+	path.write_text(f"{HEADER}old\n")
+
+	def fail(*_: object) -> None:
+		msg = "disk full"
+		raise OSError(msg)
+
+	monkeypatch.setattr(changelog_store.shutil, "copyfileobj", fail)
+	with pytest.raises(OSError, match="disk full"):
+		prepend_section(path, HEADER, "new")
+
+	assert path.read_text() == f"{HEADER}old\n"
+	assert list(tmp_path.iterdir()) == [path]
@@ -0,0 +1,46 @@
+import pytest
+
+from cibot.cli import CONSOLIDATED_COMMENT_ID, PluginRunner
+from cibot.comment_sections import parse_sections
+from tests.fakes import FakeBackend
+
+
+@pytest.fixture
+def backend() -> FakeBackend:
+	return FakeBackend()
+
+
+@pytest.fixture
+def runner(backend: FakeBackend) -> PluginRunner:
+	return PluginRunner([], backend, storage=None)  # type: ignore[arg-type]
+
+
+def test_truncated_comment_is_not_rewritten(runner: PluginRunner, backend: FakeBackend) -> None:
+	comments = {"diffcov": ("x" * 5000, "id")}
+	runner._upsert_consolidated_comment(comments, max_chars=1000)
+	runner._upsert_consolidated_comment(comments, max_chars=1000)
+
+	assert backend.writes == [f"upsert {CONSOLIDATED_COMMENT_ID}"]
+
+
+def test_truncated_comment_is_not_rewritten_by_later_runs(
+	runner: PluginRunner, backend: FakeBackend, monkeypatch: pytest.MonkeyPatch
+) -> None:
+	monkeypatch.setenv("GITHUB_REPOSITORY", "octo/repo")
+	comments = {"diffcov": ("x" * 5000, "id")}
+	monkeypatch.setenv("GITHUB_RUN_ID", "1")
+	runner._upsert_consolidated_comment(comments, max_chars=1000)
+	monkeypatch.setenv("GITHUB_RUN_ID", "2")
+	runner._upsert_consolidated_comment(comments, max_chars=1000)
+
+	assert backend.writes == [f"upsert {CONSOLIDATED_COMMENT_ID}"]
+	assert "/octo/repo/actions/runs/1)" in backend.comments[CONSOLIDATED_COMMENT_ID]
+
+
+def test_sections_of_removed_plugins_are_dropped(
+	runner: PluginRunner, backend: FakeBackend
+) -> None:
+	runner._upsert_consolidated_comment({"a": ("A", "id"), "b": ("B", "id")}, max_chars=1000)
+	runner._upsert_consolidated_comment({"a": None}, max_chars=1000)
+
+	assert parse_sections(backend.comments[CONSOLIDATED_COMMENT_ID]) == {"a": "A"}
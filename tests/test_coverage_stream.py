@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from cibot.plugins.coverage_stream import merge_coverage
+
+COBERTURA = """<?xml version="1.0" ?>
+<coverage>
+	<sources><source>src</source></sources>
+	<packages><package name="pkg"><classes>
+		<class filename="pkg/mod.py"><lines>
+			<line number="1" hits="0"/>
+			<line number="2" hits="3"/>
+		</lines></class>
+		<class filename="pkg/mod.py"><lines>
+			<line number="1" hits="1"/>
+		</lines></class>
+		<class filename="pkg/other.py"><lines>
+			<line number="1" hits="0"/>
+		</lines></class>
+	</classes></package></packages>
+</coverage>
+"""
+
+LCOV = """SF:src/pkg/mod.py
+DA:1,0
+DA:3,0
+end_of_record
+SF:web/app.js
+DA:1,2
+end_of_record
+"""
+
+
+def test_merge_coverage_keeps_changed_files_only(tmp_path: Path) -> None:
+	(tmp_path / "coverage.xml").write_text(COBERTURA)
+	(tmp_path / "lcov.info").write_text(LCOV)
+
+	merged = merge_coverage([tmp_path / "coverage.xml", tmp_path / "lcov.info"], {"src/pkg/mod.py"})
+
+	assert merged == {"src/pkg/mod.py": {1: 1, 2: 3, 3: 0}}
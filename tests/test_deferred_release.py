@@ -0,0 +1,164 @@
+import datetime as dt
+from pathlib import Path
+from types import SimpleNamespace
+from typing import override
+
+import pytest
+
+from cibot.backends.base import PrContext, ReleaseInfo
+from cibot.plugins import deferred_release
+from cibot.plugins.base import BumpType
+from cibot.plugins.deferred_release import (
+	CHANGELOG_HEADER,
+	ChangeNote,
+	ChangeType,
+	DeferredReleasePlugin,
+	PendingRelease,
+	release_notes_template,
+)
+from cibot.storage_layers.sqlite import SqliteStorage
+from tests.fakes import FakeBackend
+
+PREFIX = "Deferred Release-pending-change-"
+
+
+class GithubFakeBackend(FakeBackend):
+	@override
+	def name(self) -> str:
+		return "github"
+
+
+def note(backend: FakeBackend, number: int) -> ChangeNote:
+	return ChangeNote(
+		contributor=backend.context.description().contributor,
+		header=f"Change {number}",
+		description="",
+		pr_number=number,
+		change_type=ChangeType.FEATURE,
+	)
+
+
+@pytest.fixture
+def storage(tmp_path: Path) -> SqliteStorage:
+	return SqliteStorage(tmp_path / "storage.sqlite3", write_behind=False)
+
+
+def release_backend() -> GithubFakeBackend:
+	"""Backend of release PR #10, labeled as a minor release."""
+	return GithubFakeBackend(
+		context=PrContext(
+			pr_number=10,
+			title="Release",
+			body="A release.\n___\nleft out",
+			labels=["release:minor"],
+			author_login="octocat",
+			author_name=None,
+			head_sha="abc",
+			bot_comments=[],
+			review_comments=[],
+		)
+	)
+
+
+def test_release_drops_only_released_notes(storage: SqliteStorage) -> None:
+	backend = release_backend()
+	for number in (1, 2, 3):
+		storage.set(f"{PREFIX}{number}", note(backend, number))
+	released = backend.context.description()
+	storage.set(
+		"Deferred Release-pending-release-10",
+		PendingRelease(
+			contributor=released.contributor,
+			header=released.header,
+			description="",
+			pr_number=10,
+			release_type=BumpType.MINOR,
+			changes={1: note(backend, 1), 2: note(backend, 2)},
+			version="1.1.0",
+			notes="notes",
+		),
+	)
+
+	info = DeferredReleasePlugin(backend, storage).on_commit_to_main("abc")
+
+	assert info is not None
+	assert info.version == "1.1.0"
+	assert list(storage.items(PREFIX, ChangeNote)) == [f"{PREFIX}3"]
+	assert storage.get("Deferred Release-pending-release-10", PendingRelease) is None
+
+
+@pytest.fixture
+def release(storage: SqliteStorage, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> list[str]:
+	"""Queue two changes for release PR #10, return every render of the release notes."""
+	monkeypatch.chdir(tmp_path)
+	monkeypatch.setenv("GITHUB_SERVER_URL", "https://github.com")
+	monkeypatch.setenv("CIBOT_GITHUB_REPO_SLUG", "octo/repo")
+	backend = release_backend()
+	for number, change_type in ((1, ChangeType.FEATURE), (2, ChangeType.BUG_FIX)):
+		change = note(backend, number)
+		change.change_type = change_type
+		change.description = f"Description {number}."
+		storage.set(f"{PREFIX}{number}", change)
+	renders: list[str] = []
+
+	def template(path: Path | None = None) -> SimpleNamespace:
+		def render(**context: object) -> str:
+			renders.append(release_notes_template(path).render(**context))
+			return renders[-1]
+
+		return SimpleNamespace(render=render)
+
+	monkeypatch.setattr(deferred_release, "release_notes_template", template)
+	return renders
+
+
+def run_release(storage: SqliteStorage) -> tuple[str, str, ReleaseInfo | None]:
+	"""Prepare release PR #10 as 1.1.0 and merge it, in separate runs like CI does."""
+	plugin = DeferredReleasePlugin(release_backend(), storage)
+	assert plugin.on_pr_changed(10) == BumpType.MINOR
+	plugin.prepare_release(BumpType.MINOR, "1.1.0")
+	comment = plugin.provide_comment_for_pr()
+	assert comment is not None
+	info = DeferredReleasePlugin(release_backend(), storage).on_commit_to_main("abc")
+	return Path("CHANGELOG.md").read_text(), comment[0], info
+
+
+def test_release_notes_are_rendered_once(storage: SqliteStorage, release: list[str]) -> None:
+	changelog, comment, info = run_release(storage)
+
+	assert release == [
+		"""### Release: 1.1.0
+#### Release
+A release.
+#### Changes
+##### Feature(es)
+- **Change 1** - Description 1.
+ Contributed by [octocat](https://github.com/octocat) via [PR #1](https://github.com/octo/repo/pull/1/)
+##### Bug Fix(es)
+- **Change 2** - Description 2.
+ Contributed by [octocat](https://github.com/octocat) via [PR #2](https://github.com/octo/repo/pull/2/)
+"""
+	]
+	today = dt.datetime.now(tz=dt.UTC).date().isoformat()
+	assert changelog == f"{CHANGELOG_HEADER}1.1.0 - {today}\n--------------------\n{release[0]}\n"
+	assert comment == release[0]
+	assert info is not None
+	assert info.note == release[0]
+
+
+def test_custom_release_notes_template(
+	storage: SqliteStorage, release: list[str], tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+	template = tmp_path / "notes.jinja.md"
+	template.write_text(
+		"{{ version }} from {{ repo_url }}:"
+		"{% for type, changes in changes_by_type.items() %} {{ type.value }}={{ changes|length }}"
+		"{% endfor %}"
+	)
+	monkeypatch.setenv("DEFERRED_RELEASE_RELEASE_NOTES_TEMPLATE", str(template))
+
+	_, _, info = run_release(storage)
+
+	assert release == ["1.1.0 from https://github.com/octo/repo: Feature=1 Bug Fix=1"]
+	assert info is not None
+	assert info.note == release[0]
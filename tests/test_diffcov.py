@@ -0,0 +1,209 @@
+import subprocess
+from pathlib import Path
+
+import pytest
+from loguru import logger
+
+from cibot.backends.base import PrReviewComment
+from cibot.plugins.diffcov import (
+	DIFF_COV_REVIEW_COMMENT_ID,
+	DiffCovPlugin,
+	DiffCovSettings,
+	create_report_for_cov_files,
+	discover_coverage_files,
+	report_cache_key,
+)
+from cibot.plugins.result_cache import StorageResultCache
+from cibot.storage_layers.sqlite import SqliteStorage
+from tests.fakes import FakeBackend
+
+
+@pytest.fixture
+def backend() -> FakeBackend:
+	return FakeBackend()
+
+
+@pytest.fixture
+def plugin(backend: FakeBackend) -> DiffCovPlugin:
+	return DiffCovPlugin(backend, storage=None)  # type: ignore[arg-type]
+
+
+def positions(backend: FakeBackend) -> set[tuple[str, int | None, int]]:
+	return {(c.file, c.start_line, c.end_line) for c in backend.review_comments.values()}
+
+
+def test_reconcile_creates_one_comment_per_range(
+	plugin: DiffCovPlugin, backend: FakeBackend
+) -> None:
+	plugin._reconcile_review_comments(1, {"a.py": [(1, 3), (8, 8)], "b.py": [(2, 2)]})
+
+	assert positions(backend) == {("a.py", 1, 3), ("a.py", None, 8), ("b.py", None, 2)}
+	assert all(c.content_id == DIFF_COV_REVIEW_COMMENT_ID for c in backend.review_comments.values())
+
+
+def test_reconcile_unchanged_report_writes_nothing(
+	plugin: DiffCovPlugin, backend: FakeBackend
+) -> None:
+	violations = {"a.py": [(1, 3), (8, 8)]}
+	plugin._reconcile_review_comments(1, violations)
+	backend.writes.clear()
+
+	plugin._reconcile_review_comments(1, violations)
+	assert backend.writes == []
+
+
+def test_reconcile_only_touches_changed_ranges(plugin: DiffCovPlugin, backend: FakeBackend) -> None:
+	plugin._reconcile_review_comments(1, {"a.py": [(1, 3), (8, 8)]})
+	kept = next(i for i, c in backend.review_comments.items() if c.end_line == 3)
+	backend.writes.clear()
+
+	plugin._reconcile_review_comments(1, {"a.py": [(1, 3), (10, 12)]})
+	assert positions(backend) == {("a.py", 1, 3), ("a.py", 10, 12)}
+	assert kept in backend.review_comments
+	assert sorted(w.split()[0] for w in backend.writes) == ["create", "delete"]
+
+
+def test_reconcile_deletes_outdated_and_duplicate_comments(
+	plugin: DiffCovPlugin, backend: FakeBackend
+) -> None:
+	def existing(end_line: int, *, outdated: bool = False) -> PrReviewComment:
+		return PrReviewComment(
+			pr_number=1,
+			file="a.py",
+			start_line=None,
+			end_line=end_line,
+			content="stale",
+			content_id=DIFF_COV_REVIEW_COMMENT_ID,
+			outdated=outdated,
+		)
+
+	backend.review_comments = {1: existing(5, outdated=True), 2: existing(7), 3: existing(7)}
+
+	plugin._reconcile_review_comments(1, {"a.py": [(5, 5), (7, 7)]})
+	assert 1 not in backend.review_comments
+	assert len(backend.review_comments) == 2
+	assert positions(backend) == {("a.py", None, 5), ("a.py", None, 7)}
+
+
+@pytest.fixture
+def tree(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+	subprocess.run(["git", "init", "-q"], cwd=tmp_path, check=True)
+	(tmp_path / ".gitignore").write_text("coverage/\n")
+	for report in (
+		"coverage.xml",
+		"coverage/lcov.info",
+		"node_modules/dep/coverage.xml",
+		"a/b/c/coverage.xml",
+	):
+		(tmp_path / report).parent.mkdir(parents=True, exist_ok=True)
+		(tmp_path / report).write_text("")
+	monkeypatch.chdir(tmp_path)
+	return tmp_path
+
+
+def test_discovery_finds_reports_in_ignored_dirs(tree: Path) -> None:
+	found = discover_coverage_files(DiffCovSettings(SEARCH_ROOTS=[tree]))
+
+	assert found == sorted(
+		tree.resolve() / report
+		for report in ("coverage.xml", "coverage/lcov.info", "a/b/c/coverage.xml")
+	)
+
+
+def test_discovery_can_respect_gitignore(tree: Path) -> None:
+	found = discover_coverage_files(DiffCovSettings(SEARCH_ROOTS=[tree], RESPECT_GITIGNORE=True))
+
+	assert tree.resolve() / "coverage/lcov.info" not in found
+	assert tree.resolve() / "coverage.xml" in found
+
+
+def test_discovery_logs_dirs_below_max_depth(tree: Path) -> None:
+	messages: list[str] = []
+	sink = logger.add(messages.append, level="WARNING", format="{message}")
+	try:
+		found = discover_coverage_files(DiffCovSettings(SEARCH_ROOTS=[tree], MAX_DEPTH=2))
+	finally:
+		logger.remove(sink)
+
+	assert tree.resolve() / "a/b/c/coverage.xml" not in found
+	assert len(messages) == 1
+	assert str(tree.resolve() / "a/b/c") in messages[0]
+
+
+def test_cache_key_uses_repo_relative_paths(tree: Path) -> None:
+	subprocess.run(["git", "add", "-A"], cwd=tree, check=True)
+	subprocess.run(
+		["git", "-c", "user.name=t", "-c", "user.email=t@t", "commit", "-qm", "init"],
+		cwd=tree,
+		check=True,
+	)
+	settings = DiffCovSettings(COMPARE_BRANCH="HEAD")
+
+	key = report_cache_key([tree.resolve() / "coverage.xml"], settings)
+	assert key is not None
+	assert key == report_cache_key([Path("coverage.xml")], settings)
+	assert key != report_cache_key([Path("coverage/lcov.info")], settings)
+
+
+def test_storage_cache_needs_sqlite(tmp_path: Path, backend: FakeBackend) -> None:
+	settings = DiffCovSettings(CACHE="storage")
+	sqlite = SqliteStorage(tmp_path / "db.sqlite3")
+
+	assert isinstance(DiffCovPlugin(backend, sqlite)._result_cache(settings), StorageResultCache)
+	assert DiffCovPlugin(backend, storage=None)._result_cache(settings) is None  # type: ignore[arg-type]
+
+
+def git(repo: Path, *args: str) -> None:
+	subprocess.run(
+		["git", "-c", "user.name=t", "-c", "user.email=t@t", *args], cwd=repo, check=True
+	)
+
+
+@pytest.fixture
+def branch(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+	"""Create a repo whose ``feature`` branch adds lines 3 and 4 to ``mod.py``."""
+	git(tmp_path, "init", "-q", "-b", "main")
+	(tmp_path / "mod.py").write_text("a = 1\nb = 2\n")
+	git(tmp_path, "add", "-A")
+	git(tmp_path, "commit", "-qm", "init")
+	git(tmp_path, "checkout", "-qb", "feature")
+	(tmp_path / "mod.py").write_text("a = 1\nb = 2\nc = 3\nd = 4\n")
+	git(tmp_path, "commit", "-qam", "feature")
+	monkeypatch.chdir(tmp_path)
+	return tmp_path
+
+
+COVERAGE_XML = """<?xml version="1.0" ?>
+<coverage>
+	<sources><source>.</source></sources>
+	<packages><package name="."><classes>
+		<class filename="mod.py"><lines>
+			<line number="1" hits="1"/>
+			<line number="2" hits="1"/>
+			<line number="3" hits="1"/>
+			<line number="4" hits="0"/>
+		</lines></class>
+	</classes></package></packages>
+</coverage>
+"""
+
+
+def test_in_process_report(branch: Path) -> None:
+	(branch / "coverage.xml").write_text(COVERAGE_XML)
+
+	report = create_report_for_cov_files([branch / "coverage.xml"], "main")
+
+	assert report["src_stats"] == {
+		"mod.py": {"percent_covered": 50.0, "violation_lines": [4], "covered_lines": [3]}
+	}
+	assert report["total_num_lines"] == 2
+	assert report["total_num_violations"] == 1
+	assert report["num_changed_lines"] == 2
+
+
+def test_in_process_report_rejects_mixed_formats(branch: Path) -> None:
+	(branch / "coverage.xml").write_text(COVERAGE_XML)
+	(branch / "lcov.info").write_text("SF:mod.py\nDA:4,0\nend_of_record\n")
+
+	with pytest.raises(ValueError, match="Mixing LCov and XML"):
+		create_report_for_cov_files([branch / "coverage.xml", branch / "lcov.info"], "main")
@@ -0,0 +1,128 @@
+import json
+import threading
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import override
+
+import httpx
+import msgspec
+import pytest
+
+from cibot.backends import github_async_backend
+from cibot.backends.github_async_backend import AsyncGithubBackend
+from cibot.backends.github_backend import COMMENT_MARKER, GithubSettings, PrCommentRef
+from cibot.ratelimit import RequestScheduler
+from cibot.storage_layers.sqlite import SqliteStorage
+from tests.test_github_backend import pull_request
+
+
+class ThreadRecordingStorage(SqliteStorage):
+	"""Record the threads storage is called from."""
+
+	def __init__(self, path: Path) -> None:
+		super().__init__(path)
+		self.threads: set[str] = set()
+
+	@override
+	def get[T](self, key: str, type_: type[T]) -> T | None:
+		self.threads.add(threading.current_thread().name)
+		return super().get(key, type_)
+
+	@override
+	def set(self, key: str, value: msgspec.Struct) -> None:
+		self.threads.add(threading.current_thread().name)
+		super().set(key, value)
+
+
+class FakeGithub:
+	"""Answer the backend's requests from in-memory issue comments."""
+
+	def __init__(self, comments: dict[int, str], *, truncated: bool = False) -> None:
+		self.comments = comments
+		self.truncated = truncated
+		self.calls: list[str] = []
+		self.next_id = 100
+
+	def handle(self, request: httpx.Request) -> httpx.Response:
+		path = request.url.path.removeprefix("/repos/octo/repo")
+		if path == "/graphql":
+			pr = pull_request([])
+			pr["comments"] = {"pageInfo": {"hasPreviousPage": self.truncated}, "nodes": []}
+			return httpx.Response(200, json={"data": {"repository": {"pullRequest": pr}}})
+		self.calls.append(f"{request.method} {path}")
+		body = json.loads(request.content) if request.content else {}
+		match request.method, path.split("/"):
+			case "GET", [_, "issues", "7", "comments"]:
+				page = [] if request.url.params["page"] != "1" else self.comments.items()
+				return httpx.Response(200, json=[{"id": i, "body": b} for i, b in page])
+			case "POST", [_, "issues", "7", "comments"]:
+				self.next_id += 1
+				self.comments[self.next_id] = body["body"]
+				return httpx.Response(201, json={"id": self.next_id, "body": body["body"]})
+			case verb, [_, "issues", "comments", id_] if int(id_) in self.comments:
+				if verb == "PATCH":
+					self.comments[int(id_)] = body["body"]
+				return httpx.Response(200, json={"id": int(id_), "body": self.comments[int(id_)]})
+			case "DELETE", [_, "pulls", "comments", _]:
+				return httpx.Response(204)
+		return httpx.Response(404, json={"message": "Not Found"})
+
+
+type MakeBackend = Callable[[FakeGithub, SqliteStorage], AsyncGithubBackend]
+
+
+@pytest.fixture
+def make_backend(
+	monkeypatch: pytest.MonkeyPatch, scheduler: RequestScheduler
+) -> Iterator[MakeBackend]:
+	backends: list[AsyncGithubBackend] = []
+
+	def make(github: FakeGithub, storage: SqliteStorage) -> AsyncGithubBackend:
+		transport = httpx.MockTransport(github.handle)
+		monkeypatch.setattr(github_async_backend.httpx, "AsyncHTTPTransport", lambda **_: transport)
+		settings = GithubSettings(TOKEN="token", REPO_SLUG="octo/repo", API_URL="https://gh.test")  # noqa: S106
+		backend = AsyncGithubBackend(storage, 7, settings, scheduler)
+		backends.append(backend)
+		return backend
+
+	yield make
+	for backend in backends:
+		backend.close()
+
+
+def test_comment_is_edited_in_place(make_backend: MakeBackend, tmp_path: Path) -> None:
+	github = FakeGithub({})
+	backend = make_backend(github, SqliteStorage(tmp_path / "db.sqlite3"))
+
+	backend.upsert_pr_comment("hello", "summary")
+	backend.upsert_pr_comment("hello", "summary")
+	backend.upsert_pr_comment("changed", "summary")
+
+	assert github.calls == ["POST /issues/7/comments", "PATCH /issues/comments/101"]
+	assert backend.get_pr_comment("summary") == f"changed\n<!--{COMMENT_MARKER} summary -->"
+
+
+def test_deleted_stored_comment_is_recreated(make_backend: MakeBackend, tmp_path: Path) -> None:
+	storage = ThreadRecordingStorage(tmp_path / "db.sqlite3")
+	storage.set("pr-comment-7-summary", PrCommentRef(id=55))
+	github = FakeGithub({}, truncated=True)
+	backend = make_backend(github, storage)
+
+	backend.upsert_pr_comment("hello", "summary")
+
+	assert github.calls == [
+		"GET /issues/comments/55",
+		"GET /issues/7/comments",
+		"POST /issues/7/comments",
+	]
+	assert storage.get("pr-comment-7-summary", PrCommentRef) == PrCommentRef(id=101)
+	assert "cibot-github-async" not in storage.threads
+
+
+def test_review_comments_are_deleted(make_backend: MakeBackend, tmp_path: Path) -> None:
+	github = FakeGithub({})
+	backend = make_backend(github, SqliteStorage(tmp_path / "db.sqlite3"))
+
+	backend.delete_pr_review_comments([1, 2, 3])
+
+	assert sorted(github.calls) == [f"DELETE /pulls/comments/{i}" for i in (1, 2, 3)]
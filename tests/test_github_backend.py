@@ -0,0 +1,170 @@
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, override
+
+from cibot.backends.base import PrReviewComment
+from cibot.backends.github_backend import (
+	COMMENT_MARKER,
+	GithubBackend,
+	GithubSettings,
+	PrCommentRef,
+	comment_ref_key,
+	pr_context_from_graphql,
+	review_comments_for_content_id,
+	thread_comment_nodes,
+)
+from cibot.storage_layers.base import BaseStorage
+from cibot.storage_layers.sqlite import SqliteStorage
+
+CONTENT_ID = "diffcov-test"
+
+
+def review_node(id_: int, line: int | None, original_line: int | None = None) -> dict[str, Any]:
+	return {
+		"databaseId": id_,
+		"body": f"\n[//]: {CONTENT_ID}\nmissing coverage\n",
+		"path": "pkg/mod.py",
+		"line": line,
+		"startLine": None,
+		"originalLine": original_line if original_line is not None else line,
+		"originalStartLine": None,
+	}
+
+
+def pull_request(threads: list[list[dict[str, Any]]]) -> dict[str, Any]:
+	return {
+		"number": 7,
+		"title": "title",
+		"body": None,
+		"headRefOid": "abc",
+		"author": {"login": "octocat"},
+		"labels": {"nodes": []},
+		"comments": {"pageInfo": {"hasPreviousPage": False}, "nodes": []},
+		"reviewThreads": {
+			"pageInfo": {"hasNextPage": False, "endCursor": None},
+			"nodes": [
+				{"comments": {"pageInfo": {"hasNextPage": False}, "nodes": nodes}}
+				for nodes in threads
+			],
+		},
+	}
+
+
+def test_outdated_review_comments_keep_their_original_line() -> None:
+	pr = pull_request([[review_node(1, 10)], [review_node(2, None, original_line=12)]])
+	context = pr_context_from_graphql(pr, thread_comment_nodes(pr["reviewThreads"]))
+
+	comments = dict(review_comments_for_content_id(context, CONTENT_ID))
+	assert comments[1].end_line == 10
+	assert not comments[1].outdated
+	assert comments[2].end_line == 12
+	assert comments[2].outdated
+
+
+def test_file_level_review_comments_are_skipped() -> None:
+	pr = pull_request([[review_node(1, None, original_line=None)]])
+	context = pr_context_from_graphql(pr, thread_comment_nodes(pr["reviewThreads"]))
+
+	assert context.review_comments[0].end_line is None
+	assert review_comments_for_content_id(context, CONTENT_ID) == []
+
+
+class RecordedBackend(GithubBackend):
+	"""GithubBackend answering REST calls from ``remote`` comment bodies."""
+
+	def __init__(self, storage: BaseStorage, remote: dict[int, str]) -> None:
+		super().__init__(None, storage, 7, GithubSettings())  # type: ignore[arg-type]
+		self.remote = remote
+		self.calls: list[str] = []
+		self._pr_contexts[7] = pr_context_from_graphql(
+			{**pull_request([]), "comments": {"pageInfo": {"hasPreviousPage": True}, "nodes": []}},
+			[],
+		)
+
+	@override
+	def _request(self, verb: str, path: str, **payload: Any) -> Any:
+		self.calls.append(f"{verb} {path}")
+		id_ = int(path.rsplit("/", 1)[1])
+		if verb == "PATCH":
+			self.remote[id_] = payload["body"]
+		return {"id": id_, "body": self.remote[id_]}
+
+
+def test_stored_comment_is_compared_before_editing(tmp_path: Path) -> None:
+	storage = SqliteStorage(tmp_path / "db.sqlite3")
+	storage.set(comment_ref_key(7, "summary"), PrCommentRef(id=55))
+	backend = RecordedBackend(storage, {55: f"hello\n<!--{COMMENT_MARKER} summary -->"})
+
+	backend.upsert_pr_comment("hello", "summary")
+	assert backend.calls == ["GET /issues/comments/55"]
+
+	backend.upsert_pr_comment("changed", "summary")
+	assert backend.calls[-1] == "PATCH /issues/comments/55"
+
+
+def test_forget_pr_drops_its_comment_refs(tmp_path: Path) -> None:
+	storage = SqliteStorage(tmp_path / "db.sqlite3")
+	storage.set(comment_ref_key(7, "summary"), PrCommentRef(id=55))
+	storage.set(comment_ref_key(70, "summary"), PrCommentRef(id=56))
+
+	RecordedBackend(storage, {}).forget_pr(7)
+	assert list(storage.items("pr-comment-", PrCommentRef)) == [comment_ref_key(70, "summary")]
+
+
+class ReviewingBackend(GithubBackend):
+	"""GithubBackend recording the reviews it submits."""
+
+	def __init__(self, batch_size: int) -> None:
+		settings = GithubSettings(REVIEW_BATCH_SIZE=batch_size)
+		repo = SimpleNamespace(full_name="octo/repo")
+		super().__init__(repo, None, 7, settings)  # type: ignore[arg-type]
+		self.queries = 0
+		self.reviews: list[dict[str, Any]] = []
+
+	@override
+	def _graphql(self, query: str, variables: dict[str, Any]) -> dict[str, Any]:
+		self.queries += 1
+		return {"repository": {"pullRequest": pull_request([])}}
+
+	@override
+	def _request(self, verb: str, path: str, **payload: Any) -> Any:
+		assert (verb, path) == ("POST", "/pulls/7/reviews")
+		self.reviews.append(payload)
+		return {}
+
+
+def review_comment(line: int, start_line: int | None = None) -> PrReviewComment:
+	return PrReviewComment(
+		pr_number=7,
+		file="pkg/mod.py",
+		start_line=start_line,
+		end_line=line,
+		content="missing coverage",
+		content_id=CONTENT_ID,
+	)
+
+
+def test_review_comments_are_submitted_in_batches() -> None:
+	backend = ReviewingBackend(batch_size=2)
+	backend.create_pr_review_comments([review_comment(line) for line in range(1, 6)])
+
+	assert [len(review["comments"]) for review in backend.reviews] == [2, 2, 1]
+	assert {review["commit_id"] for review in backend.reviews} == {"abc"}
+	assert {review["event"] for review in backend.reviews} == {"COMMENT"}
+	assert backend.queries == 1
+
+
+def test_review_comment_payload_spans_lines() -> None:
+	backend = ReviewingBackend(batch_size=50)
+	backend.create_pr_review_comments([review_comment(3), review_comment(9, start_line=4)])
+
+	single, multi = backend.reviews[0]["comments"]
+	assert single == {
+		"body": review_comment(3).body(),
+		"path": "pkg/mod.py",
+		"line": 3,
+		"side": "RIGHT",
+	}
+	assert multi["start_line"] == 4
+	assert multi["start_side"] == "RIGHT"
+	assert multi["line"] == 9
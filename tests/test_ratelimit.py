@@ -0,0 +1,141 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from github import GithubException
+
+from cibot.ratelimit import RequestScheduler, ScheduledTransport, SchedulerSettings
+
+
+@pytest.fixture
+def scheduler() -> RequestScheduler:
+	return RequestScheduler(SchedulerSettings(MUTATION_INTERVAL=0, BACKOFF_BASE=0))
+
+
+def test_server_errors_back_off_for_idempotent_calls_only(scheduler: RequestScheduler) -> None:
+	assert scheduler.retry_delay(0, 502, {}, "", idempotent=True) == 0
+	assert scheduler.retry_delay(0, None, {}, "", idempotent=True) == 0
+	assert scheduler.retry_delay(0, 502, {}, "", idempotent=False) is None
+	assert scheduler.retry_delay(0, 422, {}, "", idempotent=True) is None
+
+
+def test_backoff_grows_up_to_its_cap() -> None:
+	scheduler = RequestScheduler(SchedulerSettings(BACKOFF_BASE=1, BACKOFF_MAX=4))
+
+	delays = [scheduler.retry_delay(attempt, 503, {}, "", idempotent=True) for attempt in range(5)]
+	assert all(
+		d is not None and 0 <= d <= cap for d, cap in zip(delays, [1, 2, 4, 4, 4], strict=True)
+	)
+
+
+def test_rate_limits_wait_for_retry_after_whatever_the_verb(scheduler: RequestScheduler) -> None:
+	delay = scheduler.retry_delay(0, 429, {"retry-after": "7"}, "", idempotent=False)
+	assert delay == 7
+	forbidden = scheduler.retry_delay(
+		0, 403, {}, "You have exceeded a secondary rate limit", idempotent=False
+	)
+	assert forbidden == scheduler.settings.SECONDARY_LIMIT_WAIT
+	assert scheduler.stats.rate_limited == 2
+
+
+def test_primary_limit_waits_for_its_reset(scheduler: RequestScheduler) -> None:
+	reset = time.time() + 30
+	headers = {"x-ratelimit-remaining": "0", "x-ratelimit-reset": str(reset)}
+
+	delay = scheduler.retry_delay(0, 403, headers, "", idempotent=True)
+	assert delay is not None
+	assert 29 < delay <= 31
+	assert 28 < scheduler.acquire(mutation=False) <= 30
+
+
+def test_retries_stop_at_max_retries_and_budget() -> None:
+	scheduler = RequestScheduler(SchedulerSettings(MAX_RETRIES=2, RETRY_BUDGET=10))
+	headers = {"retry-after": "4"}
+
+	assert scheduler.retry_delay(2, 429, headers, "", idempotent=True) is None
+	assert scheduler.retry_delay(0, 429, headers, "", idempotent=True) == 4
+	assert scheduler.retry_delay(1, 429, headers, "", idempotent=True) == 4
+	assert scheduler.retry_delay(1, 429, headers, "", idempotent=True) is None
+	assert scheduler.stats.retries == 2
+
+	scheduler.reset_budget()
+	assert scheduler.retry_delay(0, 429, headers, "", idempotent=True) == 4
+
+
+def test_mutations_are_spaced_across_calls() -> None:
+	scheduler = RequestScheduler(SchedulerSettings(MUTATION_INTERVAL=1))
+
+	assert scheduler.acquire(mutation=True) == 0
+	assert scheduler.acquire(mutation=False) == 0
+	assert 0.9 < scheduler.acquire(mutation=True) <= 1
+
+
+def test_call_counts_retries_as_one_call(scheduler: RequestScheduler) -> None:
+	failures = [GithubException(502, {"message": "Bad Gateway"})] * 2
+
+	def send() -> str:
+		if failures:
+			raise failures.pop()
+		return "ok"
+
+	assert scheduler.call(send, mutation=False, idempotent=True) == "ok"
+	assert (scheduler.stats.calls, scheduler.stats.attempts, scheduler.stats.retries) == (1, 3, 2)
+
+
+def test_call_does_not_retry_non_idempotent_posts(scheduler: RequestScheduler) -> None:
+	attempts = 0
+
+	def send() -> None:
+		nonlocal attempts
+		attempts += 1
+		raise GithubException(502, {"message": "Bad Gateway"})
+
+	with pytest.raises(GithubException):
+		scheduler.call(send, mutation=True, idempotent=False)
+	assert attempts == 1
+
+
+def send_through_transport(
+	scheduler: RequestScheduler, method: str, responses: list[httpx.Response]
+) -> tuple[httpx.Response, int]:
+	"""Send one request answered by ``responses`` in turn, return the last one and the count."""
+	sent = 0
+
+	def handle(_: httpx.Request) -> httpx.Response:
+		nonlocal sent
+		sent += 1
+		return responses.pop(0)
+
+	async def send() -> httpx.Response:
+		transport = ScheduledTransport(httpx.MockTransport(handle), scheduler)
+		async with httpx.AsyncClient(transport=transport, base_url="https://gh.test") as client:
+			return await client.request(method, "/repos/octo/repo/issues/1/comments")
+
+	return asyncio.run(send()), sent
+
+
+def test_transport_retries_server_errors(scheduler: RequestScheduler) -> None:
+	response, sent = send_through_transport(
+		scheduler, "GET", [httpx.Response(502), httpx.Response(502), httpx.Response(200, json=[])]
+	)
+
+	assert response.status_code == 200
+	assert sent == 3
+	assert (scheduler.stats.calls, scheduler.stats.attempts, scheduler.stats.retries) == (1, 3, 2)
+
+
+def test_transport_does_not_retry_non_idempotent_posts(scheduler: RequestScheduler) -> None:
+	response, sent = send_through_transport(scheduler, "POST", [httpx.Response(502)])
+
+	assert response.status_code == 502
+	assert sent == 1
+
+
+def test_transport_retries_rate_limited_posts(scheduler: RequestScheduler) -> None:
+	limited = httpx.Response(429, headers={"Retry-After": "0"})
+	response, sent = send_through_transport(scheduler, "POST", [limited, httpx.Response(201)])
+
+	assert response.status_code == 201
+	assert sent == 2
+	assert scheduler.stats.rate_limited == 1
@@ -0,0 +1,109 @@
+import subprocess
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from cibot.ratelimit import RequestScheduler
+from cibot.releasefile import InvalidReleaseFileError, ReleaseType, get_release_preview
+
+RELEASE = "Release type: minor\n\nAdd things.\n"
+
+
+def git(repo: Path, *args: str) -> str:
+	return subprocess.run(
+		["git", "-c", "user.name=t", "-c", "user.email=t@t", *args],
+		cwd=repo,
+		check=True,
+		capture_output=True,
+		text=True,
+	).stdout.strip()
+
+
+class CompareRepo:
+	"""Answer the compare and contents calls of the API fallback, recording them."""
+
+	def __init__(self, files: dict[str, str]) -> None:
+		self.files = files
+		self.calls: list[str] = []
+
+	def compare(self, base: str, head: str) -> SimpleNamespace:
+		self.calls.append(f"compare {base}...{head}")
+		return SimpleNamespace(
+			files=[SimpleNamespace(filename=name, status="added") for name in self.files]
+		)
+
+	def get_contents(self, path: str, ref: str) -> SimpleNamespace:
+		self.calls.append(f"get {path}@{ref}")
+		return SimpleNamespace(decoded_content=self.files[path].encode())
+
+
+def make_pr(repo: CompareRepo, head: str, base: str) -> SimpleNamespace:
+	return SimpleNamespace(
+		head=SimpleNamespace(sha=head),
+		base=SimpleNamespace(sha=base, ref="main", repo=repo),
+		requester=None,
+	)
+
+
+@pytest.fixture
+def checkout(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+	"""Create a repo whose ``feature`` branch adds a file, ``RELEASE.md`` is left to tests."""
+	git(tmp_path, "init", "-q", "-b", "main")
+	(tmp_path / "mod.py").write_text("a = 1\n")
+	git(tmp_path, "add", "-A")
+	git(tmp_path, "commit", "-qm", "init")
+	git(tmp_path, "checkout", "-qb", "feature")
+	monkeypatch.chdir(tmp_path)
+	return tmp_path
+
+
+def test_release_file_is_read_from_the_checkout(
+	checkout: Path, scheduler: RequestScheduler
+) -> None:
+	base = git(checkout, "rev-parse", "main")
+	(checkout / "RELEASE.md").write_text(RELEASE)
+	git(checkout, "add", "-A")
+	git(checkout, "commit", "-qm", "release")
+	repo = CompareRepo({})
+
+	preview = get_release_preview(
+		make_pr(repo, git(checkout, "rev-parse", "HEAD"), base), scheduler
+	)
+
+	assert preview.type == ReleaseType.MINOR
+	assert repo.calls == []
+
+
+def test_release_file_outside_the_pr_diff_is_ignored(
+	checkout: Path, scheduler: RequestScheduler
+) -> None:
+	git(checkout, "checkout", "-q", "main")
+	(checkout / "RELEASE.md").write_text(RELEASE)
+	git(checkout, "add", "-A")
+	git(checkout, "commit", "-qm", "release")
+	git(checkout, "checkout", "-q", "feature")
+	git(checkout, "merge", "-q", "main")
+	(checkout / "mod.py").write_text("a = 2\n")
+	git(checkout, "commit", "-qam", "change")
+	pr = make_pr(
+		CompareRepo({}), git(checkout, "rev-parse", "HEAD"), git(checkout, "rev-parse", "main")
+	)
+
+	with pytest.raises(InvalidReleaseFileError):
+		get_release_preview(pr, scheduler)
+
+
+def test_without_checkout_the_pr_diff_is_compared(
+	tmp_path: Path, monkeypatch: pytest.MonkeyPatch, scheduler: RequestScheduler
+) -> None:
+	monkeypatch.chdir(tmp_path)
+	repo = CompareRepo({"RELEASE.md": RELEASE, "mod.py": "a = 1\n"})
+
+	assert get_release_preview(make_pr(repo, "head", "base"), scheduler).type == ReleaseType.MINOR
+	assert repo.calls == ["compare base...head", "get RELEASE.md@head"]
+
+	repo = CompareRepo({"mod.py": "a = 1\n"})
+	with pytest.raises(InvalidReleaseFileError):
+		get_release_preview(make_pr(repo, "head", "base"), scheduler)
+	assert repo.calls == ["compare base...head"]
@@ -0,0 +1,116 @@
+import threading
+import time
+from pathlib import Path
+from typing import override
+
+import pytest
+
+from cibot import cli, serve
+from cibot.cli import ReleasePrMarker
+from cibot.plugins.base import BumpType, CiBotPlugin
+from cibot.serve import Dispatcher, Event, parse_event
+from cibot.storage_layers.sqlite import SqliteStorage
+from tests.fakes import FakeBackend
+
+
+def test_closed_prs_are_forgotten() -> None:
+	payload = {"action": "closed", "number": 3, "repository": {"full_name": "o/r"}}
+
+	assert parse_event("pull_request", payload) == Event("o/r", pr=3, closed=True)
+	assert parse_event("pull_request", {**payload, "action": "assigned"}) is None
+
+
+def run_concurrently(events: list[Event]) -> int:
+	"""Run ``events`` on as many workers, return how many handlers overlapped at most."""
+	running: list[Event] = []
+	overlap = 0
+	lock = threading.Lock()
+
+	def handle(event: Event) -> None:
+		nonlocal overlap
+		with lock:
+			running.append(event)
+			overlap = max(overlap, len(running))
+		time.sleep(0.05)
+		with lock:
+			running.remove(event)
+
+	dispatcher = Dispatcher(handle, len(events), len(events))
+	dispatcher.start()
+	for event in events:
+		dispatcher.submit(event)
+	dispatcher.join()
+	dispatcher.stop()
+	return overlap
+
+
+def test_events_of_one_repo_run_one_at_a_time() -> None:
+	assert run_concurrently([Event("o/a", pr=1), Event("o/a", pr=2)]) == 1
+	assert run_concurrently([Event("o/a", pr=1), Event("o/b", pr=1)]) == 2
+
+
+def test_plugins_reading_the_checkout_are_refused(monkeypatch: pytest.MonkeyPatch) -> None:
+	monkeypatch.setenv("CIBOT_SERVE_REPOS", '["o/a"]')
+	with pytest.raises(ValueError, match="diffcov"):
+		serve.serve(["diffcov"])
+
+
+class ReleasePlugin(CiBotPlugin):
+	@override
+	def plugin_name(self) -> str:
+		return "release"
+
+	@override
+	def supported_backends(self) -> tuple[str, ...]:
+		return ("*",)
+
+	@override
+	def on_pr_changed(self, pr: int) -> BumpType | None:
+		return BumpType.MINOR
+
+	@override
+	def prepare_release(self, release_type: BumpType, next_version: str) -> list[Path]:
+		msg = "the server has no checkout to prepare the release in"
+		raise AssertionError(msg)
+
+
+class ReloadedStorage(SqliteStorage):
+	reloads = 0
+
+	@override
+	def reload(self) -> None:
+		self.reloads += 1
+
+
+def test_events_reload_storage_and_leave_release_prs_unprepared(
+	monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+	storage = ReloadedStorage(tmp_path / "db.sqlite3")
+	backend = FakeBackend()
+	monkeypatch.setattr(serve, "get_storage", lambda _slug: storage)
+	monkeypatch.setattr(cli, "get_storage", lambda _slug: storage)
+	monkeypatch.setattr(serve, "get_backend", lambda _pr, _slug: backend)
+	monkeypatch.setattr(cli, "load_plugin", lambda _name: ReleasePlugin)
+	backends = serve.RepoBackends()
+
+	serve.run_event(Event("o/a", pr=1), ["release"], backends)
+	serve.run_event(Event("o/a", pr=1), ["release"], backends)
+
+	assert storage.reloads == 2
+	assert storage.items("release-pr-", ReleasePrMarker) == {}
+
+
+def test_backends_are_reused_per_repo(monkeypatch: pytest.MonkeyPatch) -> None:
+	created: list[str | None] = []
+
+	def get_backend(pr_number: int | None, slug: str | None = None) -> FakeBackend:
+		created.append(slug)
+		return FakeBackend()
+
+	monkeypatch.setattr(serve, "get_backend", get_backend)
+	backends = serve.RepoBackends()
+
+	assert backends.get("o/a", 1) is backends.get("o/a", 2)
+	assert backends.get("o/a", 3).pr_number == 3
+	backends.get("o/b", 1)
+	assert created == ["o/a", "o/b"]
@@ -0,0 +1,131 @@
+from collections.abc import Callable
+from pathlib import Path
+
+import msgspec
+import pytest
+
+from cibot.ratelimit import RequestScheduler
+from cibot.storage_layers.base import BaseStorage
+from cibot.storage_layers.github_issue import GithubIssueStorage
+from cibot.storage_layers.github_sharded import GithubShardedIssueStorage
+from cibot.storage_layers.sqlite import Settings as SqliteSettings
+from cibot.storage_layers.sqlite import SqliteStorage
+from tests.fakes import FakeRepo
+
+
+class Value(msgspec.Struct):
+	value: int
+
+
+type MakeStorage = Callable[..., BaseStorage]
+
+
+@pytest.fixture(params=["github_issue", "github_sharded", "sqlite"])
+def make_storage(
+	request: pytest.FixtureRequest, repo: FakeRepo, scheduler: RequestScheduler, tmp_path: Path
+) -> MakeStorage:
+	def make(*, write_behind: bool) -> BaseStorage:
+		match request.param:
+			case "github_issue":
+				return GithubIssueStorage(repo, scheduler, write_behind=write_behind)
+			case "github_sharded":
+				return GithubShardedIssueStorage(repo, scheduler, write_behind=write_behind)
+			case _:
+				return SqliteStorage(tmp_path / "storage.sqlite3", write_behind=write_behind)
+
+	return make
+
+
+def test_write_through(make_storage: MakeStorage) -> None:
+	storage = make_storage(write_behind=False)
+	storage.set("a", Value(1))
+	storage.set("b", Value(2))
+	storage.delete("b")
+
+	reopened = make_storage(write_behind=False)
+	assert reopened.get("a", Value) == Value(1)
+	assert reopened.get("b", Value) is None
+
+
+def test_write_behind_commit(make_storage: MakeStorage) -> None:
+	storage = make_storage(write_behind=True)
+	storage.set("a", Value(1))
+	storage.set("a", Value(2))
+	assert storage.get("a", Value) == Value(2)
+	assert make_storage(write_behind=False).get("a", Value) is None
+
+	storage.commit()
+	assert make_storage(write_behind=False).get("a", Value) == Value(2)
+
+
+def test_write_behind_rollback(make_storage: MakeStorage) -> None:
+	make_storage(write_behind=False).set("a", Value(1))
+	storage = make_storage(write_behind=True)
+	storage.set("a", Value(2))
+	storage.set("b", Value(3))
+	storage.rollback()
+
+	assert storage.get("a", Value) == Value(1)
+	assert storage.get("b", Value) is None
+	storage.commit()
+	assert make_storage(write_behind=False).get("b", Value) is None
+
+
+def test_write_behind_issue_edited_once(repo: FakeRepo, scheduler: RequestScheduler) -> None:
+	storage = GithubIssueStorage(repo, scheduler, write_behind=True)
+	for i in range(10):
+		storage.set(f"key-{i}", Value(i))
+	storage.delete("key-0")
+	assert repo.remote.writes == 0
+
+	storage.commit()
+	storage.commit()
+	assert repo.remote.writes == 1
+
+
+def test_items_and_delete_prefix(make_storage: MakeStorage) -> None:
+	storage = make_storage(write_behind=False)
+	storage.set("note-1", Value(1))
+	storage.set("note-2", Value(2))
+	storage.set("other", Value(3))
+	assert storage.items("note-", Value) == {"note-1": Value(1), "note-2": Value(2)}
+
+	storage.delete_prefix("note-")
+	reopened = make_storage(write_behind=False)
+	assert reopened.items("note-", Value) == {}
+	assert reopened.get("other", Value) == Value(3)
+
+
+@pytest.mark.parametrize("write_behind", [True, False])
+@pytest.mark.parametrize("storage_type", [GithubIssueStorage, GithubShardedIssueStorage])
+def test_concurrent_writers_keep_both_keys(
+	repo: FakeRepo,
+	scheduler: RequestScheduler,
+	storage_type: type[GithubIssueStorage | GithubShardedIssueStorage],
+	*,
+	write_behind: bool,
+) -> None:
+	storage_type(repo, scheduler).set("seed", Value(0))
+	first = storage_type(repo, scheduler, write_behind=write_behind)
+	second = storage_type(repo, scheduler, write_behind=write_behind)
+	first.set("a", Value(1))
+	second.set("b", Value(2))
+	second.delete("seed")
+	first.commit()
+	second.commit()
+
+	reopened = storage_type(repo, scheduler)
+	assert reopened.items("", Value) == {"a": Value(1), "b": Value(2)}
+
+
+def test_sqlite_default_path_is_outside_the_checkout() -> None:
+	assert not SqliteSettings().path.is_relative_to(Path.cwd())
+
+
+def test_reload_sees_other_writers(make_storage: MakeStorage) -> None:
+	storage = make_storage(write_behind=False)
+	storage.set("a", Value(1))
+	make_storage(write_behind=False).set("a", Value(2))
+
+	storage.reload()
+	assert storage.get("a", Value) == Value(2)
@@ -0,0 +1,100 @@
+import json
+import threading
+from pathlib import Path
+from typing import override
+
+import pytest
+
+from cibot import tracing
+from cibot.cli import PluginRunner
+from cibot.plugins.base import BumpType, CiBotPlugin
+from cibot.tracing import Tracer, run_process, span, trace_to, traced
+from tests.fakes import FakeBackend
+
+
+@pytest.fixture(autouse=True)
+def tracer(monkeypatch: pytest.MonkeyPatch) -> Tracer:
+	tracer = Tracer()
+	monkeypatch.setattr(tracing, "TRACER", tracer)
+	return tracer
+
+
+@traced("storage")
+def load() -> None:
+	pass
+
+
+class TracedPlugin(CiBotPlugin):
+	"""Load from storage in a pool thread, waiting until both plugins run at once."""
+
+	barrier = threading.Barrier(2, timeout=5)
+
+	def __init__(self, name: str) -> None:
+		super().__init__(FakeBackend(), storage=None)  # type: ignore[arg-type]
+		self.name = name
+
+	@override
+	def plugin_name(self) -> str:
+		return self.name
+
+	@override
+	def supported_backends(self) -> tuple[str, ...]:
+		return ("*",)
+
+	@override
+	def on_pr_changed(self, pr: int) -> BumpType | None:
+		self.barrier.wait()
+		load()
+		return None
+
+
+def test_disabled_tracer_records_nothing(tracer: Tracer) -> None:
+	with span("work", "hook", plugin="a"):
+		load()
+
+	assert tracer.spans == []
+
+
+def test_spans_are_attributed_to_plugins_across_threads(tracer: Tracer) -> None:
+	tracer.enable()
+	runner = PluginRunner(
+		[TracedPlugin("a"), TracedPlugin("b")],
+		FakeBackend(),
+		storage=None,  # type: ignore[arg-type]
+		max_workers=2,
+	)
+	runner.run_hook("on_pr_changed", lambda plugin: plugin.on_pr_changed(1))
+
+	loads = {s.plugin: s for s in tracer.spans if s.category == "storage"}
+	hooks = {s.plugin: s for s in tracer.spans if s.category == "hook"}
+	assert set(loads) == set(hooks) == {"a", "b"}
+	assert loads["a"].name == "load"
+	assert loads["a"].thread != loads["b"].thread
+	for plugin, hook in hooks.items():
+		assert hook.start_ns <= loads[plugin].start_ns <= loads[plugin].end_ns <= hook.end_ns
+
+
+def test_trace_file_holds_chrome_trace_events(tracer: Tracer, tmp_path: Path) -> None:
+	path = tmp_path / "trace.json"
+	with trace_to(path), span("on_pr_changed", "hook", plugin="a"):
+		load()
+		run_process(["git", "--version"], check=True, capture_output=True)
+
+	trace = json.loads(path.read_text())
+	events = {event["name"]: event for event in trace["traceEvents"]}
+	assert set(events) == {"on_pr_changed", "load", "git --version"}
+	assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events.values())
+	assert events["load"]["args"] == {"plugin": "a"}
+	assert events["git --version"]["args"] == {"plugin": "a", "command": "git --version"}
+	assert events["on_pr_changed"]["ts"] <= events["load"]["ts"]
+
+
+def test_summary_totals_calls_per_plugin_and_category(tracer: Tracer) -> None:
+	tracer.enable()
+	with span("on_pr_changed", "hook", plugin="a"):
+		load()
+		load()
+	load()
+
+	rows = [line.split()[:3] for line in tracer.summary().splitlines()[1:]]
+	assert rows == [["a", "hook", "1"], ["a", "storage", "2"], ["cibot", "storage", "1"]]